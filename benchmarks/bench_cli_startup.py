@@ -0,0 +1,58 @@
+# Benchmark: the cold start time of the command line pipeline (src/walk_data_cli.py)
+#
+# Times fresh interpreter processes (the best of several runs, as a cron job or shell
+# would start them): the interpreter alone, `walk_data_cli.py --help`, a `run` with no
+# export.zip to convert (the nightly refresh with nothing to do), and for comparison
+# importing the modules its stages use (walk_data_aux and helper_app), which a CLI
+# importing everything at start up would pay for on every invocation. Also times
+# importing folium, which the app's convert and summary pages no longer import (with
+# streamlit-folium and st_aggrid), when it is installed.
+#
+# Usage: python benchmarks/bench_cli_startup.py [n_runs]
+
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).parent.parent / "src"
+sys.path.insert(0, str(SRC_DIR))
+
+from walk_data_cli import NOTHING_TO_DO_STATUS  # noqa: E402
+
+CLI = (SRC_DIR / "walk_data_cli.py").as_posix()
+N_RUNS = 5
+
+
+def startup_ms(args, n_runs, status=0):
+    times = []
+    for _ in range(n_runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, *args], cwd=SRC_DIR, capture_output=True)
+        times.append(time.perf_counter() - start)
+        assert result.returncode == status, result.stderr
+    return min(times) * 1000
+
+
+def main(n_runs=N_RUNS):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        missing_zip = (Path(tmp_dir) / "export.zip").as_posix()
+        cases = [
+            ("python -c pass", ["-c", "pass"], 0),
+            ("cli --help", [CLI, "--help"], 0),
+            ("cli run (nothing to do)", [CLI, "run", missing_zip], NOTHING_TO_DO_STATUS),
+            ("import the stages' modules", ["-c", "import walk_data_aux, helper_app"], 0),
+        ]
+        try:
+            import folium  # noqa: F401
+
+            cases.append(("import folium", ["-c", "import folium"], 0))
+        except ImportError:
+            pass
+        for label, args, status in cases:
+            print(f"{label:<28} {startup_ms(args, n_runs, status):7.0f} ms")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
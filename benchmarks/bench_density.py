@@ -0,0 +1,91 @@
+# Benchmark: the density grid behind the all-walks heatmap (helper_density)
+#
+# Builds synthetic databases as bench_point_fetch does (every walk starting from the same
+# place, so more walks cover much the same area) with their compact tracks, and reports
+# for each number of walks:
+#   - the time to build the grid, and to add a few new walks to it incrementally
+#   - the time to read and coarsen the grid for the map (helper_app's cached reader,
+#     bypassing its cache), the cells drawn and the size of the HeatMap data, against
+#     the raw points a heatmap of every point would draw
+#
+# Usage: python benchmarks/bench_density.py [points_per_workout] [n_workouts ...]
+
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from sqlite_utils import Database
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from bench_point_fetch import build_database  # noqa: E402
+from helper_density import build_density_grid, heatmap_cells, read_density  # noqa: E402
+from helper_tracks import build_workout_tracks  # noqa: E402
+from walk_data_ingest import create_workout_points_indexes  # noqa: E402
+
+N_WORKOUTS = [100, 1_000]
+POINTS_PER_WORKOUT = 2_000
+N_NEW_WORKOUTS = 10
+N_READS = 20
+
+
+def heatmap_payload_kb(latitudes, longitudes, n_points):
+    # The data folium's HeatMap writes into the page (see helper_folium.add_density_layer)
+    weights = np.log1p(n_points) / np.log1p(n_points.max())
+    data = np.column_stack(
+        [np.round(latitudes, 5), np.round(longitudes, 5), np.round(weights, 3)]
+    ).tolist()
+    return len(json.dumps(data)) / 1e3
+
+
+def bench(n_workouts, points_per_workout):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = Path(tmp_dir) / "bench.sqlite"
+        workout_ids = build_database(db_file, n_workouts, points_per_workout)
+        db = Database(db_file)
+        db["workouts"].insert_all(
+            (
+                {"id": workout_id, "workoutActivityType": "HKWorkoutActivityTypeWalking"}
+                for workout_id in workout_ids
+            ),
+            pk="id",
+        )
+        create_workout_points_indexes(db)
+        build_workout_tracks(db)
+
+        start = time.perf_counter()
+        build_density_grid(db, workout_ids[:-N_NEW_WORKOUTS])
+        build_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        build_density_grid(db)
+        add_seconds = time.perf_counter() - start
+
+        read_ms = []
+        for _ in range(N_READS):
+            start = time.perf_counter()
+            latitudes, longitudes, n_points = heatmap_cells(*read_density(db.conn))
+            read_ms.append((time.perf_counter() - start) * 1000)
+        n_cells = len(read_density(db.conn)[0])
+        assert n_points.sum() == n_workouts * points_per_workout
+
+        print(
+            f"{n_workouts:>7,} walks ({n_workouts * points_per_workout:>10,} points): "
+            f"build {build_seconds:6.2f} s, add {N_NEW_WORKOUTS} walks "
+            f"{add_seconds * 1000:6.1f} ms, read for the map p50 "
+            f"{np.percentile(read_ms, 50):5.2f} ms, {n_cells:,} cells -> "
+            f"{len(n_points):,} drawn, {heatmap_payload_kb(latitudes, longitudes, n_points):,.0f} kB "
+            f"(every point: ~{n_workouts * points_per_workout * 24 / 1e3:,.0f} kB)"
+        )
+
+
+def main(points_per_workout=POINTS_PER_WORKOUT, n_workouts=N_WORKOUTS):
+    for n in n_workouts:
+        bench(n, points_per_workout)
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*args[:1], *([args[1:]] if len(args) > 1 else []))
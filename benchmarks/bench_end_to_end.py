@@ -0,0 +1,295 @@
+# Benchmark: the app's pipeline end to end, on a synthetic export.zip
+#
+# Generates an export.zip (see synthetic_export.py) and times each stage the app runs:
+#   - convert: convert_healthkit_export_to_sqlite (the walking and hiking workouts, as
+#     the convert page does by default)
+#   - summary: create_walk_workout_summary (with an empty location cache)
+#   - point_fetch: query_workout_points for a sample of walks, with an empty point cache
+#   - map_walks: a helper_folium walk map (create_walk_map_handle) of each of the sample
+#   - map_overview: the map of every walk, as the map page builds it for a year / group
+#     (fetch_workouts_points, build_group_layer and add_group_layer)
+# The maps are rendered to HTML (what folium_static embeds) and skipped if folium or
+# streamlit-folium isn't installed.
+#
+# Each stage is run once timed and then again under tracemalloc for its peak Python
+# memory (tracing slows every allocation down). The conversion's route parsing worker
+# processes aren't traced: use --workers 1 to include it. The results are written as
+# JSON (with the configuration, environment and git commit, so runs are comparable) to
+# benchmarks/results/, and --compare prints each stage against an earlier results file.
+#
+# Usage: python benchmarks/bench_end_to_end.py [--workouts N] [--points N] [--records N]
+#            [--workers N] [--fetches N] [--output DIR] [--compare RESULTS.json]
+
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from bench_point_fetch import latencies_ms  # noqa: E402
+from synthetic_export import (  # noqa: E402
+    N_RECORDS,
+    N_WORKOUTS,
+    POINTS_PER_WORKOUT,
+    write_export_zip,
+)
+import helper_app  # noqa: E402
+from helper_activity_types import WALKING_ACTIVITY_TYPES  # noqa: E402
+from helper_geocode import LocationCache  # noqa: E402
+from helper_map_cache import build_group_layer, layer_points  # noqa: E402
+from helper_simplify import MAX_MAP_POINTS, zoom_for_bounds  # noqa: E402
+from walk_data_aux import (  # noqa: E402
+    convert_healthkit_export_to_sqlite,
+    create_walk_workout_summary,
+)
+
+RESULTS_DIR = Path(__file__).parent / "results"
+N_FETCHES = 50
+MAP_SIZE = (750, 550)
+
+
+class Pipeline:
+    # The stages, each re-runnable (the traced run repeats them) and returning a dict of
+    # extra results. Later stages use the database and summary of the last conversion.
+    def __init__(self, work_dir, export_zip, workers, n_fetches):
+        self.work_dir = work_dir
+        self.export_zip = export_zip
+        self.workers = workers
+        self.n_fetches = n_fetches
+        self.n_runs = 0
+        self.db_file = None
+        self.summary_df = None
+
+    def convert(self):
+        # A fresh directory each run, as the conversion renames export.zip
+        self.n_runs += 1
+        run_dir = self.work_dir / f"run_{self.n_runs}"
+        run_dir.mkdir()
+        shutil.copyfile(self.export_zip, run_dir / "export.zip")
+        self.db_file, _ = convert_healthkit_export_to_sqlite(
+            run_dir / "export.zip",
+            activity_types=WALKING_ACTIVITY_TYPES,
+            workers=self.workers,
+            data_dir=run_dir,
+        )
+        return {"database_mb": round(Path(self.db_file).stat().st_size / 1e6, 2)}
+
+    def summary(self):
+        output_file = create_walk_workout_summary(
+            self.db_file,
+            output_file=self.work_dir / "workouts_summary.csv",
+            location_cache=LocationCache(cache_file=None),
+        )
+        self.summary_df = pd.read_csv(output_file)
+        return {"workouts": len(self.summary_df)}
+
+    def sample_uuids(self):
+        rng = np.random.default_rng(0)
+        n = min(self.n_fetches, len(self.summary_df))
+        return self.summary_df["uuid"].to_numpy()[rng.permutation(len(self.summary_df))[:n]]
+
+    def point_fetch(self):
+        helper_app.WORKOUT_POINTS_CACHE.entries.clear()
+        conn = sqlite3.connect(self.db_file)
+        n_points = []
+
+        def fetch(uuid):
+            n_points.append(len(helper_app.query_workout_points(uuid, self.summary_df, conn)))
+
+        cold = latencies_ms(fetch, self.sample_uuids())
+        warm = latencies_ms(fetch, self.sample_uuids())
+        conn.close()
+        return {
+            "fetches": len(cold),
+            "points": int(np.sum(n_points[: len(cold)])),
+            "cold_p50_ms": round(float(np.percentile(cold, 50)), 3),
+            "cold_p95_ms": round(float(np.percentile(cold, 95)), 3),
+            "warm_p50_ms": round(float(np.percentile(warm, 50)), 3),
+        }
+
+    def map_walks(self):
+        import folium
+        import helper_folium
+
+        helper_app.WORKOUT_POINTS_CACHE.entries.clear()
+        conn = sqlite3.connect(self.db_file)
+        html_bytes = 0
+        for uuid in self.sample_uuids():
+            walk_points = helper_app.query_workout_points(uuid, self.summary_df, conn)
+            map_handle = folium.Map((0, 0), zoom_start=13, detect_retina=True)
+            helper_folium.create_walk_map_handle(walk_points, map_handle, {"uuid": uuid})
+            map_handle.fit_bounds(map_handle.get_bounds())
+            html_bytes += len(map_handle.get_root().render())
+        conn.close()
+        return {"maps": len(self.sample_uuids()), "html_mb": round(html_bytes / 1e6, 2)}
+
+    def map_overview(self):
+        import folium
+        import helper_folium
+
+        helper_app.WORKOUT_POINTS_CACHE.entries.clear()
+        conn = sqlite3.connect(self.db_file)
+        walks_df = self.summary_df
+        zoom = zoom_for_bounds(
+            np.r_[walks_df["start_latitude"], walks_df["finish_latitude"]],
+            np.r_[walks_df["start_longitude"], walks_df["finish_longitude"]],
+            *MAP_SIZE,
+        )
+        walks_points = helper_app.fetch_workouts_points(
+            conn, walks_df["workout_id"], zoom, MAX_MAP_POINTS
+        )
+        layer = build_group_layer(walks_df, walks_points, zoom)
+        map_handle = folium.Map((0, 0), zoom_start=13, detect_retina=True)
+        helper_folium.add_group_layer(map_handle, layer)
+        html = map_handle.get_root().render()
+        conn.close()
+        return {
+            "walks": len(walks_df),
+            "zoom": zoom,
+            "points_drawn": layer_points(layer),
+            "html_mb": round(len(html) / 1e6, 2),
+        }
+
+
+STAGES = ["convert", "summary", "point_fetch", "map_walks", "map_overview"]
+
+
+def run_stage(stage):
+    gc.collect()
+    start = time.perf_counter()
+    try:
+        extra = stage()
+    except ImportError as e:
+        return {"skipped": str(e)}
+    seconds = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    stage()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": round(seconds, 4), "peak_memory_mb": round(peak / 1e6, 2), **extra}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "sqlite": sqlite3.sqlite_version,
+    }
+
+
+def compare(results, previous_file):
+    with open(previous_file) as f:
+        previous = json.load(f)
+    if previous["config"] != results["config"]:
+        print(f"Note: the configuration differs from {previous_file}: {previous['config']}")
+    print(f"\nCompared with {previous_file} (commit {previous.get('git_commit')}):")
+    print(f"{'stage':<14} {'before (s)':>11} {'now (s)':>9} {'ratio':>7} {'peak MB':>15}")
+    for name, stage in results["stages"].items():
+        before = previous["stages"].get(name, {})
+        if "seconds" not in stage or "seconds" not in before:
+            continue
+        print(
+            f"{name:<14} {before['seconds']:11.3f} {stage['seconds']:9.3f} "
+            f"{stage['seconds'] / before['seconds']:7.2f} "
+            f"{before['peak_memory_mb']:7.1f} -> {stage['peak_memory_mb']:<7.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workouts", type=int, default=N_WORKOUTS)
+    parser.add_argument("--points", type=int, default=POINTS_PER_WORKOUT, help="per workout")
+    parser.add_argument("--records", type=int, default=N_RECORDS)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--fetches", type=int, default=N_FETCHES)
+    parser.add_argument("--output", type=Path, default=RESULTS_DIR)
+    parser.add_argument("--compare", type=Path, help="an earlier results JSON file")
+    args = parser.parse_args()
+
+    results = {
+        "benchmark": "end_to_end",
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "config": {
+            "workouts": args.workouts,
+            "points_per_workout": args.points,
+            "records": args.records,
+            "workers": args.workers,
+            "fetches": args.fetches,
+        },
+        "environment": environment(),
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = Path(tmp_dir)
+        export_zip = work_dir / "synthetic_export.zip"
+        start = time.perf_counter()
+        n_points = write_export_zip(export_zip, args.workouts, args.points, args.records)
+        results["input"] = {
+            "points": n_points,
+            "export_zip_mb": round(export_zip.stat().st_size / 1e6, 2),
+            "generate_seconds": round(time.perf_counter() - start, 2),
+        }
+        print(
+            f"Synthetic export.zip: {args.workouts:,} workouts x {args.points:,} points, "
+            f"{args.records:,} records ({results['input']['export_zip_mb']:.1f} MB)"
+        )
+
+        pipeline = Pipeline(work_dir, export_zip, args.workers, args.fetches)
+        results["stages"] = {}
+        for name in STAGES:
+            stage = run_stage(getattr(pipeline, name))
+            results["stages"][name] = stage
+            if "skipped" in stage:
+                print(f"{name:<14} skipped ({stage['skipped']})")
+            else:
+                print(
+                    f"{name:<14} {stage['seconds']:9.3f} s  peak {stage['peak_memory_mb']:8.1f} MB"
+                )
+    results["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3, 1)
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    results_file = args.output / (
+        f"end_to_end_{datetime.now():%Y%m%d_%H%M%S}_{results['git_commit'] or 'nogit'}.json"
+    )
+    with open(results_file, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results: {results_file}")
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Benchmark: repairing a defective export.xml as it is read (walk_data_ingest.RepairedXmlReader)
+#
+# Writes a synthetic export.zip with the defects of some iOS versions' exports (see
+# synthetic_export.py) and compares:
+#   - on disk, as export.zip_fix_xml.sh: unzip export.xml, then sed it into a repaired
+#     copy (the DTD patch is specific to one iOS version's DTD and isn't applied here,
+#     so this understates the old cost); the time and bytes written to disk
+#   - streamed: reading export.xml out of the zip as is, and through RepairedXmlReader
+#     (the difference being the cost of the repairs), with the peak Python memory
+# and checks that the ingest fails without the repairs and succeeds with them.
+#
+# Usage: python benchmarks/bench_export_repair.py [n_records]
+
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+from xml.etree.ElementTree import ParseError
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from synthetic_export import write_export_zip  # noqa: E402
+from walk_data_ingest import (  # noqa: E402
+    RepairedXmlReader,
+    find_export_xml,
+    ingest_healthkit_export,
+)
+
+N_RECORDS = 300_000
+READ_BYTES = 64 * 1024
+
+
+def stream_seconds(export_zip, repair):
+    with zipfile.ZipFile(export_zip) as zip_ref:
+        with zip_ref.open(find_export_xml(zip_ref)) as xml_fp:
+            fp = RepairedXmlReader(xml_fp) if repair else xml_fp
+            start = time.perf_counter()
+            while fp.read(READ_BYTES):
+                pass
+            return time.perf_counter() - start
+
+
+def main(n_records=N_RECORDS):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        export_zip = tmp_dir / "export.zip"
+        write_export_zip(export_zip, 20, 500, n_records, ios_defects=True)
+        with zipfile.ZipFile(export_zip) as zip_ref:
+            xml_mb = find_export_xml(zip_ref).file_size / 1e6
+        print(f"export.xml: {n_records:,} records, {xml_mb:,.0f} MB")
+
+        if shutil.which("sed") is not None:
+            start = time.perf_counter()
+            with zipfile.ZipFile(export_zip) as zip_ref:
+                xml_file = zip_ref.extract(find_export_xml(zip_ref), tmp_dir)
+            with open(tmp_dir / "export-fixed.xml", "w") as fixed_fp:
+                subprocess.run(["sed", "s/startDate/endDate/2", xml_file], stdout=fixed_fp, check=True)
+            print(
+                f"{'unzip + sed on disk':<24} {time.perf_counter() - start:6.2f} s, "
+                f"{2 * xml_mb:,.0f} MB written"
+            )
+
+        raw = stream_seconds(export_zip, repair=False)
+        repaired = stream_seconds(export_zip, repair=True)
+        print(f"{'streamed as is':<24} {raw:6.2f} s")
+        print(
+            f"{'streamed and repaired':<24} {repaired:6.2f} s "
+            f"(repairs {repaired - raw:+.2f} s, {xml_mb / max(repaired - raw, 1e-9):,.0f} MB/s), "
+            f"0 MB written"
+        )
+        tracemalloc.start()
+        stream_seconds(export_zip, repair=True)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{'':<24} peak Python memory {peak / 1e6:.1f} MB")
+
+        try:
+            ingest_healthkit_export(export_zip, tmp_dir / "as_is.sqlite", workers=1, repair_xml=False)
+            print("Ingest without the repairs: succeeded")
+        except ParseError as e:
+            print(f"Ingest without the repairs: failed ({e})")
+        stats = ingest_healthkit_export(export_zip, tmp_dir / "repaired.sqlite", workers=1)
+        print(
+            f"Ingest with the repairs: {stats.workouts:,} workouts, {stats.records:,} records "
+            f"in {stats.elapsed_seconds:.1f} s"
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
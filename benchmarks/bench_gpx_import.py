@@ -0,0 +1,56 @@
+# Benchmark: bulk import of a directory of GPX files (walk_data_gpx_import)
+#
+# Writes n_files synthetic GPX files (walks of points_per_file points at 1 point per
+# second, a day apart) and imports them into an empty database, serially and across a
+# pool of worker processes (one per CPU core), reporting the throughput in files and
+# points per second. The import is then repeated to time the case where every file is
+# already in the database (skipped by start time).
+#
+# Usage: python benchmarks/bench_gpx_import.py [n_files] [points_per_file]
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from bench_gpx_viewer import write_gpx  # noqa: E402
+from bench_simplify import synthetic_walks  # noqa: E402
+from walk_data_gpx_import import import_gpx_files  # noqa: E402
+
+N_FILES = 500
+POINTS_PER_FILE = 3_000
+
+
+def report(label, stats):
+    print(
+        f"{label:<28} {stats.elapsed_seconds:6.2f} s {stats.files_per_second:9,.0f} files/s "
+        f"{stats.points_per_second:11,.0f} points/s ({stats.workouts:,} imported, "
+        f"{stats.workouts_skipped:,} skipped)"
+    )
+
+
+def main(n_files=N_FILES, points_per_file=POINTS_PER_FILE):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        gpx_dir = Path(tmp_dir) / "gpx"
+        gpx_dir.mkdir()
+        start = np.datetime64("2020-01-01T06:00:00")
+        for n, points in enumerate(synthetic_walks(n_files, points_per_file)):
+            write_gpx(
+                gpx_dir / f"walk_{n:05d}.gpx",
+                points,
+                start + np.timedelta64(n, "D"),
+            )
+        print(f"{n_files:,} GPX files x {points_per_file:,} points")
+
+        for workers in sorted({1, os.cpu_count() or 1}):
+            db_file = Path(tmp_dir) / f"import_{workers}.sqlite"
+            report(f"{workers} worker(s)", import_gpx_files(gpx_dir, db_file, workers=workers))
+        report("again (all already imported)", import_gpx_files(gpx_dir, db_file))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,80 @@
+# Benchmark: the GPX viewer's parsing and cached redraws (helper_gpx)
+#
+# Writes a synthetic multi-day GPX file (1 point per second) and times what a view of it
+# costs in app_gpx_viewer: the first load (streaming parse to NumPy arrays and
+# simplification for the zoom which fits the track) and a rerun (both served from the
+# cache), each followed by building the folium map HTML when folium is installed. For
+# comparison, gpx_converter's Converter.gpx_to_dataframe() (which the viewer previously
+# ran on every rerun) is timed when it is installed.
+#
+# Usage: python benchmarks/bench_gpx_viewer.py [n_days]
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from bench_simplify import render_seconds, synthetic_walks  # noqa: E402
+from helper_gpx import cached_gpx_track, cached_simplified_track  # noqa: E402
+from helper_simplify import zoom_for_bounds  # noqa: E402
+
+N_DAYS = 3
+MAP_SIZE = (550, 300)
+
+
+def write_gpx(gpx_file, points, start="2020-01-01T00:00:00"):
+    start = np.datetime64(start)
+    dates = (start + np.arange(len(points)).astype("timedelta64[s]")).astype(str)
+    with open(gpx_file, "w") as fp:
+        fp.write('<?xml version="1.0" encoding="UTF-8"?>\n<gpx version="1.1"><trk><trkseg>\n')
+        for (latitude, longitude), date in zip(points.tolist(), dates):
+            fp.write(
+                f'<trkpt lat="{latitude:.6f}" lon="{longitude:.6f}">'
+                f"<ele>50.0</ele><time>{date}Z</time></trkpt>\n"
+            )
+        fp.write("</trkseg></trk></gpx>\n")
+
+
+def view(gpx_file):
+    # As app_gpx_viewer: the track's bounds -> zoom -> simplified track -> map
+    arrays = cached_gpx_track(gpx_file)
+    zoom = zoom_for_bounds(arrays["latitude"], arrays["longitude"], *MAP_SIZE)
+    return cached_simplified_track(gpx_file, zoom)
+
+
+def timed_view(label, gpx_file):
+    start = time.perf_counter()
+    points = view(gpx_file)
+    seconds = time.perf_counter() - start
+    render = render_seconds([points])
+    total = f", {(seconds + render) * 1000:.0f} ms with the map" if render is not None else ""
+    print(f"{label:<12} {seconds * 1000:9.1f} ms ({len(points):,} points drawn){total}")
+
+
+def main(n_days=N_DAYS):
+    (points,) = synthetic_walks(1, n_days * 24 * 3600)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        gpx_file = Path(tmp_dir) / "multi_day.gpx"
+        write_gpx(gpx_file, points)
+        print(
+            f"{n_days} day GPX file: {len(points):,} points, "
+            f"{gpx_file.stat().st_size / 1e6:.0f} MB"
+        )
+        timed_view("first load", gpx_file)
+        timed_view("rerun", gpx_file)
+
+        try:
+            from gpx_converter import Converter
+        except ImportError:
+            return
+        start = time.perf_counter()
+        Converter(input_file=str(gpx_file)).gpx_to_dataframe()
+        print(f"{'gpx_converter':<12} {(time.perf_counter() - start) * 1000:9.1f} ms (every rerun)")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,123 @@
+# Benchmark: Parquet track store vs SQLite
+#
+# Builds a synthetic database (n_workouts x points_per_workout rows, workouts spread
+# over a few years), exports it to a Parquet track store and compares the size on disk,
+# fetching one workout's points, fetching a group of workouts' points and reading the
+# inputs of the workouts summary, for the two backends (uncached reads).
+#
+# Usage: python benchmarks/bench_parquet_store.py [n_workouts] [points_per_workout]
+
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlite_utils import Database
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from bench_point_fetch import build_database, latencies_ms, report  # noqa: E402
+from helper_app import read_workout_points, read_workouts_points  # noqa: E402
+from helper_parquet import ParquetTrackStore  # noqa: E402
+from helper_simplify import build_simplified_tracks  # noqa: E402
+from walk_data_aux import (  # noqa: E402
+    export_sqlite_to_parquet,
+    read_workouts_from_parquet,
+    read_workouts_from_sqlite,
+)
+from walk_data_ingest import create_workout_points_indexes  # noqa: E402
+
+N_WORKOUTS = 1_000
+POINTS_PER_WORKOUT = 2_000
+N_FETCHES = 200
+GROUP_SIZE = 50
+N_GROUP_FETCHES = 10
+
+
+def add_workouts_table(db_file, workout_ids, seed=42):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2019-01-01") + pd.to_timedelta(
+        np.sort(rng.integers(0, 4 * 365 * 86400, len(workout_ids))), unit="s"
+    )
+    workouts_df = pd.DataFrame(
+        {
+            "id": workout_ids,
+            "workoutActivityType": "HKWorkoutActivityTypeWalking",
+            "duration": "33.33",
+            "totalDistance": "2.500",
+            "totalEnergyBurned": "600",
+            "sourceName": "Watch",
+            "sourceVersion": "9.0",
+            "startDate": start.strftime("%Y-%m-%d %H:%M:%S +1000"),
+            "endDate": (start + pd.Timedelta(minutes=33)).strftime("%Y-%m-%d %H:%M:%S +1000"),
+            "metadata_HKWeatherTemperature": "70 degF",
+            "metadata_HKWeatherHumidity": "42 %",
+            "metadata_HKElevationAscended": "1200 cm",
+            "metadata_HKAverageMETs": "3.5 kcal/hr·kg",
+        }
+    )
+    with sqlite3.connect(db_file) as conn:
+        workouts_df.to_sql("workouts", conn, index=False)
+
+
+def size_mb(path):
+    files = path.rglob("*") if path.is_dir() else [path]
+    return sum(file.stat().st_size for file in files if file.is_file()) / 1e6
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main(n_workouts=N_WORKOUTS, points_per_workout=POINTS_PER_WORKOUT):
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = Path(tmp_dir) / "bench.sqlite"
+        workout_ids = build_database(db_file, n_workouts, points_per_workout)
+        add_workouts_table(db_file, workout_ids)
+        db = Database(db_file)
+        create_workout_points_indexes(db)
+        build_simplified_tracks(db)
+
+        store_dir, seconds = timed(export_sqlite_to_parquet, db_file)
+        print(
+            f"{n_workouts * points_per_workout:,} points ({n_workouts:,} workouts): "
+            f"SQLite {size_mb(db_file):,.0f} MB, Parquet {size_mb(store_dir):,.0f} MB "
+            f"(exported in {seconds:.1f} s)"
+        )
+        store, seconds = timed(ParquetTrackStore, store_dir)
+        print(f"Opened the Parquet store ({len(store.files)} files) in {seconds * 1000:.1f} ms")
+
+        workout_sample = rng.choice(workout_ids, N_FETCHES)
+        report(
+            "SQLite: one workout",
+            latencies_ms(lambda workout_id: read_workout_points(db.conn, workout_id, None), workout_sample),
+        )
+        report(
+            "Parquet: one workout",
+            latencies_ms(lambda workout_id: read_workout_points(store, workout_id, None), workout_sample),
+        )
+
+        groups = [rng.choice(workout_ids, GROUP_SIZE, replace=False) for _ in range(N_GROUP_FETCHES)]
+        for label, source in [("SQLite", db.conn), ("Parquet", store)]:
+            latencies = []
+            for group in groups:
+                _, seconds = timed(read_workouts_points, source, group, None)
+                latencies.append(seconds * 1000)
+            report(f"{label}: {GROUP_SIZE} workouts", np.array(latencies))
+
+        for label, read_workouts, source in [
+            ("SQLite", read_workouts_from_sqlite, db_file),
+            ("Parquet", read_workouts_from_parquet, store_dir),
+        ]:
+            _, seconds = timed(read_workouts, source)
+            print(f"{label + ': summary inputs':<32} {seconds * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
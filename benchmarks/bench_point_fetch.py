@@ -0,0 +1,109 @@
+# Benchmark: latency of fetching one workout's points from workout_points
+#
+# Builds a synthetic database (n_workouts x points_per_workout rows) and compares the
+# previous lookup (f-string query through pd.read_sql_query, no index - a full table
+# scan per workout) with the parameterised, covering-index lookup in helper_app
+# (uncached, i.e. bypassing the app's WORKOUT_POINTS_CACHE).
+#
+# Usage: python benchmarks/bench_point_fetch.py [n_workouts] [points_per_workout]
+# (e.g. 10000 5000 for a 50M point database - allow plenty of time and disk to build it)
+
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlite_utils import Database
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from helper_app import read_workout_points  # noqa: E402
+from walk_data_ingest import create_workout_points_indexes  # noqa: E402
+
+N_WORKOUTS = 1_000
+POINTS_PER_WORKOUT = 2_000
+N_LEGACY_FETCHES = 10
+N_FETCHES = 1_000
+
+
+def build_database(db_file, n_workouts, points_per_workout, seed=42):
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(db_file)
+    conn.execute(
+        "CREATE TABLE workout_points (date TEXT, latitude FLOAT, longitude FLOAT, "
+        "altitude FLOAT, horizontalAccuracy FLOAT, verticalAccuracy FLOAT, "
+        "course FLOAT, speed FLOAT, workout_id TEXT)"
+    )
+    dates = pd.date_range("2020-01-01", periods=points_per_workout, freq="s").strftime(
+        "%Y-%m-%dT%H:%M:%SZ"
+    )
+    with conn:
+        for workout in range(n_workouts):
+            workout_id = f"{workout:040x}"
+            latitude = -33.8 + np.cumsum(rng.normal(0, 1e-4, points_per_workout))
+            longitude = 151.2 + np.cumsum(rng.normal(0, 1e-4, points_per_workout))
+            conn.executemany(
+                "INSERT INTO workout_points VALUES (?, ?, ?, 10.0, 3.0, 2.0, 90.0, 1.3, ?)",
+                zip(dates, latitude.tolist(), longitude.tolist(), [workout_id] * points_per_workout),
+            )
+    conn.close()
+    return [f"{workout:040x}" for workout in range(n_workouts)]
+
+
+def latencies_ms(fetch, workout_ids):
+    latencies = []
+    for workout_id in workout_ids:
+        start = time.perf_counter()
+        fetch(workout_id)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies)
+
+
+def report(label, latencies):
+    print(
+        f"{label:<32} p50 {np.percentile(latencies, 50):9.2f} ms   "
+        f"p95 {np.percentile(latencies, 95):9.2f} ms   max {latencies.max():9.2f} ms"
+    )
+
+
+def main(n_workouts=N_WORKOUTS, points_per_workout=POINTS_PER_WORKOUT):
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = Path(tmp_dir) / "bench.sqlite"
+        start = time.perf_counter()
+        workout_ids = build_database(db_file, n_workouts, points_per_workout)
+        print(
+            f"Built {n_workouts * points_per_workout:,} points "
+            f"({n_workouts:,} workouts) in {time.perf_counter() - start:.1f} s"
+        )
+        db = Database(db_file)
+
+        def legacy_fetch(workout_id):
+            return pd.read_sql_query(
+                f'SELECT latitude, longitude FROM workout_points WHERE workout_id = "{workout_id}"',
+                db.conn,
+            ).values
+
+        report(
+            "f-string + read_sql (no index)",
+            latencies_ms(legacy_fetch, rng.choice(workout_ids, N_LEGACY_FETCHES)),
+        )
+
+        start = time.perf_counter()
+        create_workout_points_indexes(db)
+        print(f"Created covering index in {time.perf_counter() - start:.1f} s")
+
+        report(
+            "parameterised, covering index",
+            latencies_ms(
+                lambda workout_id: read_workout_points(db.conn, workout_id, None),
+                rng.choice(workout_ids, N_FETCHES),
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
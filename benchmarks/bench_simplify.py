@@ -0,0 +1,95 @@
+# Benchmark: map payload and render time, raw vs zoom-simplified tracks
+#
+# Generates synthetic walks (GPS-like random walks at 1 point per second) and, for a
+# few zoom levels, compares the number of points, the size of the polyline coordinates
+# sent to the browser and the time to build the folium map HTML for the raw tracks
+# against the tracks simplified by helper_simplify, and reports the stored level of
+# detail chosen for the map given the number of points (MAX_MAP_POINTS). The render
+# time is only reported when folium is installed.
+#
+# Usage: python benchmarks/bench_simplify.py [n_walks] [points_per_walk]
+
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from helper_simplify import (  # noqa: E402
+    MAX_MAP_POINTS,
+    SIMPLIFIED_ZOOM_LEVELS,
+    choose_zoom_level,
+    simplify_track_for_zoom,
+    zoom_for_bounds,
+)
+
+N_WALKS = 20
+POINTS_PER_WALK = 5_000
+MAP_SIZE = (750, 550)
+
+
+def synthetic_walks(n_walks, points_per_walk, seed=42):
+    rng = np.random.default_rng(seed)
+    walks = []
+    for _ in range(n_walks):
+        # ~1.3 m/s with a slowly wandering heading plus a few metres of GPS jitter
+        heading = np.cumsum(rng.normal(0, 0.05, points_per_walk))
+        steps = 1.3 / 111_320 * np.c_[np.cos(heading), np.sin(heading)]
+        jitter = rng.normal(0, 3 / 111_320, (points_per_walk, 2))
+        walks.append(np.array([-33.8, 151.2]) + np.cumsum(steps, axis=0) + jitter)
+    return walks
+
+
+def render_seconds(walks):
+    try:
+        import folium
+    except ImportError:
+        return None
+    start = time.perf_counter()
+    map_handle = folium.Map(location=walks[0][0].tolist(), zoom_start=13)
+    for walk in walks:
+        folium.PolyLine(walk.tolist(), weight=4).add_to(map_handle)
+    map_handle.get_root().render()
+    return time.perf_counter() - start
+
+
+def report(label, walks):
+    n_points = sum(len(walk) for walk in walks)
+    payload_kb = len(json.dumps([walk.tolist() for walk in walks])) / 1024
+    seconds = render_seconds(walks)
+    render = f"{seconds * 1000:9.1f} ms" if seconds is not None else "      n/a"
+    print(f"{label:<16} {n_points:>10,} {payload_kb:>12,.0f} {render:>12}")
+
+
+def main(n_walks=N_WALKS, points_per_walk=POINTS_PER_WALK):
+    walks = synthetic_walks(n_walks, points_per_walk)
+    all_points = np.concatenate(walks)
+    fit_zoom = zoom_for_bounds(all_points[:, 0], all_points[:, 1], *MAP_SIZE)
+    print(f"{n_walks} walks x {points_per_walk:,} points, zoom to fit: {fit_zoom}")
+    print(f"{'tracks':<16} {'points':>10} {'payload (KB)':>12} {'render':>12}")
+    report("raw", walks)
+    for zoom in sorted({fit_zoom, 13, 16}):
+        start = time.perf_counter()
+        simplified = [simplify_track_for_zoom(walk, zoom) for walk in walks]
+        seconds = time.perf_counter() - start
+        report(f"zoom {zoom} ({seconds * 1000:.0f} ms)", simplified)
+
+    # As stored at ingest: the level for the zoom to fit, unless that exceeds the budget
+    stored = {
+        level: [simplify_track_for_zoom(walk, level) for walk in walks]
+        for level in SIMPLIFIED_ZOOM_LEVELS
+    }
+    stored[None] = walks
+    level = choose_zoom_level(
+        fit_zoom,
+        {level: sum(len(walk) for walk in tracks) for level, tracks in stored.items()},
+        MAX_MAP_POINTS,
+    )
+    report(f"level {level} (chosen)", stored[level])
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,124 @@
+# Benchmark: spatial index of the walks' start/finish points (helper_spatial)
+#
+# Builds a synthetic database of n_workouts workouts (two points each, the start and the
+# finish, clustered around a few dozen "walk" locations), indexes them in the R-tree
+# and times "walks near here" queries and walk group suggestions for a batch of
+# unlabelled workouts (the rest being labelled by their cluster).
+#
+# Usage: python benchmarks/bench_spatial.py [n_workouts] [n_unlabelled] [distance_km]
+
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlite_utils import Database
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from bench_point_fetch import latencies_ms, report  # noqa: E402
+from helper_spatial import (  # noqa: E402
+    NEAR_DISTANCE_KM,
+    build_endpoints_rtree,
+    suggest_walk_groups,
+    workouts_near,
+)
+from walk_data_ingest import create_workout_points_indexes  # noqa: E402
+
+N_WORKOUTS = 100_000
+N_UNLABELLED = 1_000
+N_CLUSTERS = 40
+N_QUERIES = 200
+
+
+def build_database(db_file, n_workouts, seed=42):
+    # Returns a DataFrame of the workouts' ids, clusters and start/finish points
+    rng = np.random.default_rng(seed)
+    centres = rng.uniform([-34.5, 150.0], [-33.0, 152.0], (N_CLUSTERS, 2))
+    clusters = rng.integers(0, N_CLUSTERS, n_workouts)
+    starts = centres[clusters] + rng.normal(0, 0.01, (n_workouts, 2))
+    finishes = starts + rng.normal(0, 0.005, (n_workouts, 2))
+    workout_ids = [f"{workout:040x}" for workout in range(n_workouts)]
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE TABLE workouts (id TEXT PRIMARY KEY)")
+    conn.execute(
+        "CREATE TABLE workout_points (date TEXT, latitude FLOAT, longitude FLOAT, workout_id TEXT)"
+    )
+    with conn:
+        conn.executemany("INSERT INTO workouts VALUES (?)", ((id,) for id in workout_ids))
+        for date, points in [("2020-01-01T00:00:00Z", starts), ("2020-01-01T01:00:00Z", finishes)]:
+            conn.executemany(
+                "INSERT INTO workout_points VALUES (?, ?, ?, ?)",
+                ((date, *point, id) for point, id in zip(points.tolist(), workout_ids)),
+            )
+    conn.close()
+    return pd.DataFrame(
+        {
+            "workout_id": workout_ids,
+            "walk_group": [f"G{cluster}" for cluster in clusters],
+            "start_latitude": starts[:, 0],
+            "start_longitude": starts[:, 1],
+            "finish_latitude": finishes[:, 0],
+            "finish_longitude": finishes[:, 1],
+        }
+    )
+
+
+def main(n_workouts=N_WORKOUTS, n_unlabelled=N_UNLABELLED, distance_km=NEAR_DISTANCE_KM):
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = Path(tmp_dir) / "bench.sqlite"
+        workouts_df = build_database(db_file, n_workouts)
+        db = Database(db_file)
+        create_workout_points_indexes(db)
+
+        start = time.perf_counter()
+        build_endpoints_rtree(db)
+        print(
+            f"Indexed {n_workouts:,} workouts' start/finish in "
+            f"{time.perf_counter() - start:.1f} s"
+        )
+
+        sample = rng.integers(0, n_workouts, N_QUERIES)
+        n_near = []
+
+        def near(workout):
+            n_near.append(
+                len(
+                    workouts_near(
+                        db.conn,
+                        workouts_df["start_latitude"].iloc[workout],
+                        workouts_df["start_longitude"].iloc[workout],
+                        distance_km,
+                    )
+                )
+            )
+
+        report(f"Walks within {distance_km} km", latencies_ms(near, sample))
+        print(f"{'':<32} {np.mean(n_near):,.0f} walks on average")
+
+        labelled_df = workouts_df.iloc[n_unlabelled:]
+        workout_groups = dict(zip(labelled_df["workout_id"], labelled_df["walk_group"]))
+        for n in [1, n_unlabelled]:
+            start = time.perf_counter()
+            suggestions_df = suggest_walk_groups(
+                db.conn, workouts_df.iloc[:n], workout_groups, distance_km
+            )
+            seconds = time.perf_counter() - start
+            correct = (
+                suggestions_df.merge(workouts_df, on="workout_id", suffixes=("", "_actual"))
+                .eval("walk_group == walk_group_actual")
+                .mean()
+            )
+            print(
+                f"Suggest groups for {n:,} walks: {seconds * 1000:9.1f} ms "
+                f"({len(suggestions_df):,} suggestions, {correct:.0%} correct)"
+            )
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:4]
+    main(*[int(arg) for arg in args[:2]], *[float(arg) for arg in args[2:]])
@@ -0,0 +1,112 @@
+# Benchmark: compact track blobs (helper_tracks) against the workout_points rows
+#
+# Builds a synthetic database as bench_point_fetch does, then its compact tracks, and
+# reports:
+#   - the size on disk of workout_points and its covering index, against that of the
+#     workout_tracks table (from SQLite's dbstat), and the time to build the tracks
+#   - the latency of fetching one workout's raw points (helper_app.read_workout_points,
+#     i.e. bypassing the app's cache) and of a group of workouts read together
+#     (read_workouts_points), from the rows and from the blobs
+#   - the largest difference between the decoded and the raw latitudes/longitudes
+#   - the size of the database file before and after the workout_points rows the tracks
+#     replace are dropped (helper_tracks.drop_track_points, then VACUUM)
+#
+# Usage: python benchmarks/bench_track_blobs.py [n_workouts] [points_per_workout]
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from sqlite_utils import Database
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from bench_point_fetch import build_database, latencies_ms  # noqa: E402
+from helper_app import read_workout_points, read_workouts_points  # noqa: E402
+from helper_tracks import build_workout_tracks, drop_track_points  # noqa: E402
+from walk_data_ingest import create_workout_points_indexes  # noqa: E402
+
+N_WORKOUTS = 1_000
+POINTS_PER_WORKOUT = 2_000
+N_FETCHES = 1_000
+N_GROUPS = 20
+GROUP_SIZE = 50
+
+
+def table_mb(conn, names):
+    return (
+        conn.execute(
+            f"SELECT SUM(pgsize) FROM dbstat WHERE name IN ({', '.join('?' * len(names))})",
+            names,
+        ).fetchone()[0]
+        / 1e6
+    )
+
+
+def fetch_latencies(conn, fetch_ids, groups):
+    one = latencies_ms(lambda workout_id: read_workout_points(conn, workout_id, None), fetch_ids)
+    group = latencies_ms(lambda group: read_workouts_points(conn, group, None), groups)
+    return one, group
+
+
+def main(n_workouts=N_WORKOUTS, points_per_workout=POINTS_PER_WORKOUT):
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = Path(tmp_dir) / "bench.sqlite"
+        workout_ids = build_database(db_file, n_workouts, points_per_workout)
+        db = Database(db_file)
+        db["workouts"].insert_all(({"id": workout_id} for workout_id in workout_ids), pk="id")
+        create_workout_points_indexes(db)
+        print(f"{n_workouts * points_per_workout:,} points ({n_workouts:,} workouts)")
+
+        fetch_ids = rng.choice(workout_ids, N_FETCHES)
+        groups = [list(rng.choice(workout_ids, GROUP_SIZE)) for _ in range(N_GROUPS)]
+        rows_one, rows_group = fetch_latencies(db.conn, fetch_ids, groups)
+        raw = read_workouts_points(db.conn, workout_ids, None)
+
+        start = time.perf_counter()
+        build_workout_tracks(db)
+        build_seconds = time.perf_counter() - start
+        blobs_one, blobs_group = fetch_latencies(db.conn, fetch_ids, groups)
+        decoded = read_workouts_points(db.conn, workout_ids, None)
+
+        index_names = [
+            name
+            for (name,) in db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'workout_points'"
+            )
+        ]
+        rows_mb = table_mb(db.conn, ["workout_points", *index_names])
+        blobs_mb = table_mb(db.conn, ["workout_tracks", "sqlite_autoindex_workout_tracks_1"])
+        print(
+            f"Size: workout_points + index {rows_mb:,.1f} MB, workout_tracks {blobs_mb:,.1f} MB "
+            f"({rows_mb / blobs_mb:.1f}x smaller, built in {build_seconds:.1f} s)"
+        )
+        for label, rows, blobs in [
+            ("one workout", rows_one, blobs_one),
+            (f"{GROUP_SIZE} workouts", rows_group, blobs_group),
+        ]:
+            print(
+                f"{label:<12} rows p50 {np.percentile(rows, 50):8.2f} ms p95 "
+                f"{np.percentile(rows, 95):8.2f} ms | blobs p50 {np.percentile(blobs, 50):8.2f} ms "
+                f"p95 {np.percentile(blobs, 95):8.2f} ms ({np.median(rows) / np.median(blobs):.1f}x)"
+            )
+        error = max(np.abs(decoded[workout_id] - raw[workout_id]).max() for workout_id in raw)
+        print(f"Largest decoding error: {error:.2e} degrees (~{error * 111_320:.2f} m)")
+
+        file_mb = db_file.stat().st_size / 1e6
+        start = time.perf_counter()
+        drop_track_points(db)
+        db.vacuum()
+        drop_seconds = time.perf_counter() - start
+        print(
+            f"Database: {file_mb:,.1f} MB with workout_points, "
+            f"{db_file.stat().st_size / 1e6:,.1f} MB once dropped "
+            f"({drop_seconds:.1f} s to check, drop and vacuum)"
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,123 @@
+# Benchmark: per-workout track statistics (walk_data_stats)
+#
+# Builds a synthetic database (n_workouts x points_per_workout rows) and times
+# build_workout_stats over every workout, reporting the throughput (workouts and points
+# per second) and, in a second (traced) run, the peak Python memory, which is bounded by
+# the chunk size rather than the number of points. For comparison, a per-point Python loop
+# calculating the distance and moving time is timed on a sample of the workouts.
+#
+# Usage: python benchmarks/bench_workout_stats.py [n_workouts] [points_per_workout] [chunk_workouts]
+
+import math
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlite_utils import Database
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from bench_point_fetch import build_database  # noqa: E402
+from walk_data_ingest import create_workout_points_indexes  # noqa: E402
+from walk_data_stats import (  # noqa: E402
+    EARTH_RADIUS_METRES,
+    MAX_MOVING_SEGMENT_SECONDS,
+    MOVING_SPEED_METRES_PER_SECOND,
+    STATS_CHUNK_WORKOUTS,
+    build_workout_stats,
+    iter_workout_points,
+)
+
+N_WORKOUTS = 1_000
+POINTS_PER_WORKOUT = 2_000
+N_LOOP_WORKOUTS = 20
+
+
+def loop_distance_and_moving_seconds(points_df):
+    # Row at a time, as a straightforward implementation would
+    metres = 0.0
+    moving_seconds = 0.0
+    previous = None
+    for date, latitude, longitude in zip(
+        points_df["date"], points_df["latitude"], points_df["longitude"]
+    ):
+        seconds = pd.Timestamp(date).timestamp()
+        if previous is not None:
+            latitude_1, longitude_1, seconds_1 = previous
+            a = (
+                math.sin(math.radians(latitude - latitude_1) / 2) ** 2
+                + math.cos(math.radians(latitude_1))
+                * math.cos(math.radians(latitude))
+                * math.sin(math.radians(longitude - longitude_1) / 2) ** 2
+            )
+            segment_metres = 2 * EARTH_RADIUS_METRES * math.asin(math.sqrt(min(a, 1)))
+            duration = seconds - seconds_1
+            metres += segment_metres
+            if (
+                0 < duration <= MAX_MOVING_SEGMENT_SECONDS
+                and segment_metres / duration >= MOVING_SPEED_METRES_PER_SECOND
+            ):
+                moving_seconds += duration
+        previous = (latitude, longitude, seconds)
+    return metres, moving_seconds
+
+
+def main(
+    n_workouts=N_WORKOUTS,
+    points_per_workout=POINTS_PER_WORKOUT,
+    chunk_workouts=STATS_CHUNK_WORKOUTS,
+):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = Path(tmp_dir) / "bench.sqlite"
+        start = time.perf_counter()
+        workout_ids = build_database(db_file, n_workouts, points_per_workout)
+        db = Database(db_file)
+        create_workout_points_indexes(db)
+        db["workouts"].insert_all({"id": workout_id} for workout_id in workout_ids)
+        n_points = n_workouts * points_per_workout
+        print(
+            f"Built {n_points:,} points ({n_workouts:,} workouts) "
+            f"in {time.perf_counter() - start:.1f} s"
+        )
+
+        start = time.perf_counter()
+        build_workout_stats(db, workout_ids, chunk_workouts)
+        seconds = time.perf_counter() - start
+        print(
+            f"Vectorised (chunks of {chunk_workouts}): {seconds:.2f} s, "
+            f"{n_workouts / seconds:,.0f} workouts/s, {n_points / seconds:,.0f} points/s"
+        )
+
+        # Separately, as tracing slows every allocation down
+        tracemalloc.start()
+        build_workout_stats(db, workout_ids, chunk_workouts)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"Peak Python memory (tracemalloc): {peak / 1e6:.1f} MB")
+
+        sample_ids = workout_ids[:N_LOOP_WORKOUTS]
+        start = time.perf_counter()
+        loop_results = [
+            loop_distance_and_moving_seconds(points_df)
+            for _, points_df in iter_workout_points(db.conn, sample_ids)
+        ]
+        seconds = (time.perf_counter() - start) / len(sample_ids) * n_workouts
+        print(f"Per-point loop (extrapolated from {len(sample_ids)}): {seconds:.2f} s")
+
+        stats = db.execute(
+            "SELECT distance_km, moving_time_hours FROM workout_stats "
+            "WHERE workout_id IN (SELECT value FROM json_each(?)) ORDER BY workout_id",
+            [pd.Series(sample_ids).to_json(orient="values")],
+        ).fetchall()
+        assert np.allclose(
+            np.array(stats),
+            [(metres / 1000, moving_seconds / 3600) for metres, moving_seconds in loop_results],
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:4]])
@@ -0,0 +1,106 @@
+# Benchmark: derived columns of create_walk_workout_summary, row-wise vs vectorised
+#
+# Times the previous row-wise (DataFrame.apply + pendulum) implementation against the
+# vectorised one now used in walk_data_aux, on synthetic workouts, and checks that both
+# produce identical values. Geocoding and the SQL queries are not included.
+#
+# Usage: python benchmarks/bench_workout_summary.py [n_workouts ...]
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pendulum
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from walk_data_aux import (  # noqa: E402
+    TIMEZONE,
+    calculate_elapsed_time_hours,
+    convert_datetime_from_gmt_to_timezone,
+    local_datetime_string,
+    uuid_from_datetime,
+)
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+
+def synthetic_workouts(n_workouts, seed=42):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2015-01-01", tz="UTC") + pd.to_timedelta(
+        np.sort(rng.integers(0, 8 * 365 * 86400, n_workouts)), unit="s"
+    )
+    finish = start + pd.to_timedelta(rng.integers(600, 8 * 3600, n_workouts), unit="s")
+    local_start = start.tz_convert(TIMEZONE)
+    local_end = finish.tz_convert(TIMEZONE)
+    return pd.DataFrame(
+        {
+            # As stored by HealthKit in the workouts / workout_points tables
+            "startDate": local_start.strftime("%Y-%m-%d %H:%M:%S %z"),
+            "endDate": local_end.strftime("%Y-%m-%d %H:%M:%S %z"),
+            "start_datetime": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "finish_datetime": finish.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+    )
+
+
+def rowwise(df):
+    # The implementation previously in create_walk_workout_summary
+    timezone = pendulum.timezone(TIMEZONE)
+    out = pd.DataFrame(index=df.index)
+    start_date = df["startDate"].apply(
+        lambda dt: pendulum.instance(pd.Timestamp(dt)).to_datetime_string()
+    )
+    out["startDate"] = start_date
+    out["uuid"] = start_date.apply(lambda dt: uuid_from_datetime(dt))
+    out["elapsed_time_hours"] = df.apply(
+        lambda row: float(
+            (
+                pendulum.parse(row["finish_datetime"])
+                - pendulum.parse(row["start_datetime"])
+            ).in_seconds()
+            / 60
+            / 60
+        ),
+        axis=1,
+    )
+    out["start_datetime"] = df["start_datetime"].apply(
+        lambda dt: timezone.convert(pendulum.parse(dt)).to_datetime_string()
+    )
+    return out
+
+
+def vectorised(df):
+    out = pd.DataFrame(index=df.index)
+    out["startDate"] = local_datetime_string(df["startDate"])
+    out["uuid"] = [uuid_from_datetime(dt) for dt in out["startDate"]]
+    out["elapsed_time_hours"] = calculate_elapsed_time_hours(
+        df["finish_datetime"], df["start_datetime"]
+    )
+    out["start_datetime"] = convert_datetime_from_gmt_to_timezone(df["start_datetime"])
+    return out
+
+
+def timed(func, df):
+    start = time.perf_counter()
+    result = func(df)
+    return result, time.perf_counter() - start
+
+
+def main(sizes):
+    print(f"{'workouts':>10} {'row-wise (s)':>14} {'vectorised (s)':>16} {'speedup':>9}")
+    for n_workouts in sizes:
+        df = synthetic_workouts(n_workouts)
+        expected, rowwise_seconds = timed(rowwise, df)
+        result, vectorised_seconds = timed(vectorised, df)
+        assert expected.to_csv(index=False) == result.to_csv(index=False)
+        print(
+            f"{n_workouts:>10,} {rowwise_seconds:>14.3f} {vectorised_seconds:>16.3f} "
+            f"{rowwise_seconds / vectorised_seconds:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,257 @@
+# Synthetic Apple HealthKit export.zip generator (for the benchmarks)
+#
+# Writes an export.zip laid out as the Health app exports it:
+#   - apple_health_export/export.xml, with the DOCTYPE internal subset, n_records heart
+#     rate / step count Records, the Workouts (with their MetadataEntry, WorkoutEvent and
+#     WorkoutRoute/FileReference children) and a daily ActivitySummary
+#   - apple_health_export/workout-routes/route_YYYY-MM-DD_H.MMam.gpx, one per workout,
+#     with points_per_workout points at 1 point per second (with the speed, course and
+#     accuracy extensions of the route files)
+#
+# The workouts are mostly walks and hikes (every 10th is a run) a day or two apart,
+# starting around a few dozen walk locations in and around Sydney (so they group into
+# walks as real ones do); dates are local Sydney time as in a real export. Generation
+# is deterministic for a given seed.
+#
+# With ios_defects=True the export has the defects of some iOS versions' exports (see
+# data/README.md): a malformed DTD and a second startDate attribute (instead of endDate)
+# on every DEFECT_RECORD_INTERVAL-th Record.
+#
+# Usage: python benchmarks/synthetic_export.py export.zip [n_workouts] [points_per_workout] [n_records]
+
+import sys
+import zipfile
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+N_WORKOUTS = 200
+POINTS_PER_WORKOUT = 2_000
+N_RECORDS = 10_000
+N_WALK_LOCATIONS = 30
+
+TIMEZONE = ZoneInfo("Australia/Sydney")
+FIRST_WORKOUT = datetime(2019, 6, 1, 7, 0, tzinfo=timezone.utc)
+EXPORT_DIR = "apple_health_export"
+
+DOCTYPE = """<!DOCTYPE HealthData [
+<!-- HealthKit Export Version: 12 -->
+<!ELEMENT HealthData (ExportDate,Me,(Record|Correlation|Workout|ActivitySummary|ClinicalRecord)*)>
+<!ATTLIST HealthData
+  locale CDATA #REQUIRED
+>
+<!ELEMENT ExportDate EMPTY>
+<!ATTLIST ExportDate
+  value CDATA #REQUIRED
+>
+<!ELEMENT Workout ((MetadataEntry|WorkoutEvent|WorkoutRoute)*)>
+<!ATTLIST Workout
+  workoutActivityType CDATA #REQUIRED
+  duration            CDATA #IMPLIED
+  durationUnit        CDATA #IMPLIED
+  totalDistance       CDATA #IMPLIED
+  totalDistanceUnit   CDATA #IMPLIED
+  sourceName          CDATA #REQUIRED
+  startDate           CDATA #REQUIRED
+  endDate             CDATA #REQUIRED
+>
+{defects}]>
+"""
+
+# As the DTD of the affected exports ends (see the lines removed by data/patch.txt)
+DTD_DEFECTS = """<!ELEMENT Glasses (LeftEye?,RightEye?)>
+<!ATTLIST Glasses
+  dateIssued       CDATA #REQUIRED
+  brand            CDATA #IMPLIED
+<!ELEMENT RightEye EMPTY>
+  device           CDATA #IMPLIED
+<!ELEMENT MetadataEntry EMPTY>
+<!ATTLIST MetadataEntry
+  key              CDATA #IMPLIED
+  value            CDATA #IMPLIED
+>
+>
+"""
+DEFECT_RECORD_INTERVAL = 100
+
+GPX_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="Apple Health Export" xmlns="http://www.topografix.com/GPX/1/1" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd">
+<metadata>
+<time>{time}</time>
+</metadata>
+<trk>
+<name>Route {name}</name>
+<trkseg>
+"""
+
+GPX_FOOTER = "</trkseg>\n</trk>\n</gpx>\n"
+
+
+def healthkit_date(moment):
+    return moment.astimezone(TIMEZONE).strftime("%Y-%m-%d %H:%M:%S %z")
+
+
+def route_file_name(start):
+    local = start.astimezone(TIMEZONE)
+    hour = local.hour % 12 or 12
+    return f"route_{local:%Y-%m-%d}_{hour}.{local:%M}{'am' if local.hour < 12 else 'pm'}.gpx"
+
+
+def synthetic_track(rng, centre, n_points):
+    # (latitude, longitude, altitude, speed, course) arrays: ~1.3 m/s along a slowly
+    # wandering heading, with a few metres of GPS jitter
+    heading = rng.uniform(0, 2 * np.pi) + np.cumsum(rng.normal(0, 0.05, n_points))
+    speed = np.clip(rng.normal(1.3, 0.2, n_points), 0, None)
+    steps = speed[:, None] / 111_320 * np.c_[np.cos(heading), np.sin(heading)]
+    jitter = rng.normal(0, 3 / 111_320, (n_points, 2))
+    points = centre + rng.normal(0, 0.002, 2) + np.cumsum(steps, axis=0) + jitter
+    altitude = 40 + np.cumsum(rng.normal(0, 0.2, n_points))
+    course = np.degrees(heading) % 360
+    return points[:, 0], points[:, 1], altitude, speed, course
+
+
+def gpx_text(start, track):
+    times = (
+        np.datetime64(start.replace(tzinfo=None), "s") + np.arange(len(track[0]))
+    ).astype(str)
+    lines = [GPX_HEADER.format(time=f"{start:%Y-%m-%dT%H:%M:%SZ}", name=healthkit_date(start))]
+    for time, latitude, longitude, altitude, speed, course in zip(
+        times, *(column.tolist() for column in track)
+    ):
+        lines.append(
+            f'<trkpt lon="{longitude:.6f}" lat="{latitude:.6f}"><ele>{altitude:.6f}</ele>'
+            f"<time>{time}Z</time><extensions><speed>{speed:.6f}</speed>"
+            f"<course>{course:.6f}</course><hAcc>4.5</hAcc><vAcc>3.2</vAcc>"
+            f"</extensions></trkpt>\n"
+        )
+    lines.append(GPX_FOOTER)
+    return "".join(lines)
+
+
+def workout_xml(activity_type, start, finish, distance_km, route_name, rng):
+    start_date = healthkit_date(start)
+    end_date = healthkit_date(finish)
+    minutes = (finish - start).total_seconds() / 60
+    return (
+        f' <Workout workoutActivityType="{activity_type}" duration="{minutes:.6f}" '
+        f'durationUnit="min" totalDistance="{distance_km:.6f}" totalDistanceUnit="km" '
+        f'totalEnergyBurned="{minutes * 18:.3f}" totalEnergyBurnedUnit="kJ" '
+        f'sourceName="Apple Watch" sourceVersion="9.5" device="&lt;&lt;HKDevice&gt;&gt;" '
+        f'creationDate="{end_date}" startDate="{start_date}" endDate="{end_date}">\n'
+        f'  <MetadataEntry key="HKIndoorWorkout" value="0"/>\n'
+        f'  <MetadataEntry key="HKTimeZone" value="Australia/Sydney"/>\n'
+        f'  <MetadataEntry key="HKWeatherTemperature" value="{rng.uniform(50, 90):.0f} degF"/>\n'
+        f'  <MetadataEntry key="HKWeatherHumidity" value="{rng.uniform(30, 90) * 100:.0f} %"/>\n'
+        f'  <MetadataEntry key="HKElevationAscended" value="{rng.uniform(0, 30000):.0f} cm"/>\n'
+        f'  <MetadataEntry key="HKAverageMETs" value="{rng.uniform(3, 6):.5f} kcal/hr·kg"/>\n'
+        f'  <WorkoutEvent type="HKWorkoutEventTypeSegment" date="{start_date}" '
+        f'duration="{minutes:.6f}" durationUnit="min"/>\n'
+        f'  <WorkoutRoute sourceName="Apple Watch" sourceVersion="9.5" '
+        f'creationDate="{end_date}" startDate="{start_date}" endDate="{end_date}">\n'
+        f'   <MetadataEntry key="HKMetadataKeySyncVersion" value="2"/>\n'
+        f'   <FileReference path="/workout-routes/{route_name}"/>\n'
+        f"  </WorkoutRoute>\n"
+        f" </Workout>\n"
+    )
+
+
+def record_xml(n, moment, ios_defects=False):
+    date = healthkit_date(moment)
+    end_attribute = (
+        "startDate" if ios_defects and n % DEFECT_RECORD_INTERVAL == 0 else "endDate"
+    )
+    if n % 4:
+        return (
+            f' <Record type="HKQuantityTypeIdentifierHeartRate" sourceName="Apple Watch" '
+            f'sourceVersion="9.5" unit="count/min" creationDate="{date}" startDate="{date}" '
+            f'{end_attribute}="{date}" value="{60 + n % 50}">\n'
+            f'  <MetadataEntry key="HKMetadataKeyHeartRateMotionContext" value="0"/>\n'
+            f" </Record>\n"
+        )
+    return (
+        f' <Record type="HKQuantityTypeIdentifierStepCount" sourceName="iPhone" '
+        f'unit="count" creationDate="{date}" startDate="{date}" {end_attribute}="{date}" '
+        f'value="{n % 500}"/>\n'
+    )
+
+
+def write_export_zip(
+    export_zip,
+    n_workouts=N_WORKOUTS,
+    points_per_workout=POINTS_PER_WORKOUT,
+    n_records=N_RECORDS,
+    seed=42,
+    ios_defects=False,
+):
+    # Returns the total number of route points written. The route files are written
+    # first, as zipfile allows only one member to be open for writing at a time.
+    rng = np.random.default_rng(seed)
+    centres = rng.uniform([-34.0, 150.9], [-33.6, 151.35], (N_WALK_LOCATIONS, 2))
+    # A day or two apart, starting between 7am and 5pm (FIRST_WORKOUT is 5pm in Sydney)
+    days = np.cumsum(rng.integers(1, 3, n_workouts)).tolist()
+    minutes = rng.integers(-10 * 60, 0, n_workouts).tolist()
+    starts = [
+        FIRST_WORKOUT + timedelta(days=day, minutes=minute) for day, minute in zip(days, minutes)
+    ]
+    last_date = starts[-1] if starts else FIRST_WORKOUT
+    with zipfile.ZipFile(export_zip, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        workouts = []
+        for n, start in enumerate(starts):
+            track = synthetic_track(
+                rng, centres[rng.integers(N_WALK_LOCATIONS)], points_per_workout
+            )
+            finish = start + timedelta(seconds=points_per_workout - 1)
+            route_name = route_file_name(start)
+            activity_type = (
+                "HKWorkoutActivityTypeRunning"
+                if n % 10 == 9
+                else "HKWorkoutActivityTypeHiking"
+                if n % 5 == 4
+                else "HKWorkoutActivityTypeWalking"
+            )
+            zip_ref.writestr(
+                f"{EXPORT_DIR}/workout-routes/{route_name}", gpx_text(start, track)
+            )
+            distance_km = float(track[3].sum()) / 1000
+            workouts.append(
+                workout_xml(activity_type, start, finish, distance_km, route_name, rng)
+            )
+
+        with zip_ref.open(f"{EXPORT_DIR}/export.xml", "w", force_zip64=True) as xml_fp:
+            xml_fp.write(
+                (
+                    '<?xml version="1.0" encoding="UTF-8"?>\n'
+                    + DOCTYPE.format(defects=DTD_DEFECTS if ios_defects else "")
+                    + '<HealthData locale="en_AU">\n'
+                    + f' <ExportDate value="{healthkit_date(last_date)}"/>\n'
+                    + ' <Me HKCharacteristicTypeIdentifierDateOfBirth="" '
+                    + 'HKCharacteristicTypeIdentifierBiologicalSex="HKBiologicalSexNotSet"/>\n'
+                ).encode("utf8")
+            )
+            span_seconds = (last_date - FIRST_WORKOUT).total_seconds() or 1
+            for n in range(n_records):
+                moment = FIRST_WORKOUT + timedelta(seconds=span_seconds * n / n_records)
+                xml_fp.write(record_xml(n, moment, ios_defects).encode("utf8"))
+            for workout in workouts:
+                xml_fp.write(workout.encode("utf8"))
+            day = FIRST_WORKOUT.astimezone(TIMEZONE).date()
+            while day <= last_date.astimezone(TIMEZONE).date():
+                xml_fp.write(
+                    (
+                        f' <ActivitySummary dateComponents="{day}" activeEnergyBurned="1500" '
+                        f'activeEnergyBurnedGoal="1400" activeEnergyBurnedUnit="kJ" '
+                        f'appleExerciseTime="35" appleExerciseTimeGoal="30" '
+                        f'appleStandHours="12" appleStandHoursGoal="12"/>\n'
+                    ).encode("utf8")
+                )
+                day += timedelta(days=1)
+            xml_fp.write(b"</HealthData>\n")
+        zip_ref.writestr(
+            f"{EXPORT_DIR}/export_cda.xml", '<?xml version="1.0"?>\n<ClinicalDocument/>\n'
+        )
+    return n_workouts * points_per_workout
+
+
+if __name__ == "__main__":
+    write_export_zip(sys.argv[1], *[int(arg) for arg in sys.argv[2:5]])
@@ -0,0 +1,40 @@
+-- Get starting and finishing point for each workout
+-- Two seeks per workout on the (workout_id, date) index of workout_points, rather than
+-- ranking every point, so the cost grows with the number of workouts not points.
+-- Points without a date (NULL, which sorts first) are never the start or finish.
+with endpoints as (
+  select
+    id as workout_id,
+    (
+      select rowid from workout_points
+      where workout_id = workouts.id and date is not null
+      order by date asc
+      limit 1
+    ) as start_rowid,
+    (
+      select rowid from workout_points
+      where workout_id = workouts.id and date is not null
+      order by date desc
+      limit 1
+    ) as finish_rowid
+  from
+    workouts
+)
+select
+  start_point.date as start_datetime,
+  start_point.latitude as start_latitude,
+  start_point.longitude as start_longitude,
+  start_point.altitude as start_altitude,
+  start_point.speed as start_speed,
+  endpoints.workout_id,
+  finish_point.date as finish_datetime,
+  finish_point.latitude as finish_latitude,
+  finish_point.longitude as finish_longitude,
+  finish_point.altitude as finish_altitude,
+  finish_point.speed as finish_speed
+from
+  endpoints
+  join workout_points as start_point on start_point.rowid = endpoints.start_rowid
+  join workout_points as finish_point on finish_point.rowid = endpoints.finish_rowid
+order by
+  endpoints.workout_id
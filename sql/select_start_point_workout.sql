@@ -22,6 +22,8 @@ from
       ) as date_rank
     from
       workout_points
+    where
+      date is not null
   )
 where
   date_rank = 1
\ No newline at end of file
@@ -1,25 +1,27 @@
-import warnings
 from pathlib import Path
 from dataclasses import dataclass
 from datetime import datetime
 
-import folium
-import pandas as pd
+import numpy as np
 import streamlit as st
-from streamlit_folium import folium_static
-from gpx_converter import Converter
 
-import helper_folium
+from helper_gpx import cached_gpx_track, cached_simplified_track
 
 
-warnings.simplefilter(action="ignore", category=FutureWarning)
+# The GPX files are parsed with the streaming reader in helper_gpx and cached (until the
+# file changes) across reruns, along with each track simplified for the zoom it is drawn
+# at, so only the first view of a (large, e.g. multi-day) file pays for the parsing.
+# folium is only imported (via helper_folium) once there is a track to draw.
+
 
 @dataclass
 class Track:
     name: str
     date: datetime.date
     time: datetime.time
-    data: pd.DataFrame
+    path: Path
+    n_points: int
+    bounds: np.ndarray  # [[min_latitude, min_longitude], [max_latitude, max_longitude]]
 
 
 st.set_page_config(
@@ -31,39 +33,78 @@ st.set_page_config(
 )
 
 
-def extract_track_metadata(gpx_file):
-    if gpx_file is not None:
+def track_start(gpx_file, dates):
+    # From a route file name, e.g. route_2020-01-01_6.00pm.gpx, otherwise the first point
+    try:
         tmp = gpx_file.name.replace("route_", "").replace(".gpx", "").replace("_", " ")
-        track_date = datetime.strptime(tmp, "%Y-%m-%d %H.%M%p")
-        track_df = Converter(input_file=gpx_file).gpx_to_dataframe()
-        track = Track(name="undefined", date=track_date.date(), time=track_date.time(), data=track_df)
-        return track
-    else:
-        return Track()
-    
+        return datetime.strptime(tmp, "%Y-%m-%d %I.%M%p")
+    except ValueError:
+        pass
+    dates = dates[dates != ""]
+    if len(dates) == 0:
+        return None
+    return datetime.fromisoformat(dates[0].replace("Z", "+00:00"))
 
-def plot_track(track):
-    df = track.data[["latitude", "longitude"]]
-    df.columns = ["lat", "lon"]
-    helper_folium.create_walk_map(df, workout_info=[])
+
+def extract_track_metadata(gpx_file):
+    arrays = cached_gpx_track(gpx_file)
+    points = np.column_stack([arrays["latitude"], arrays["longitude"]])
+    points = points[~np.isnan(points).any(axis=1)]
+    if len(points) == 0:
+        return None
+    track_date = track_start(gpx_file, arrays["date"])
+    return Track(
+        name=gpx_file.name,
+        date=track_date.date() if track_date is not None else None,
+        time=track_date.time() if track_date is not None else None,
+        path=gpx_file,
+        n_points=len(points),
+        bounds=np.array([points.min(axis=0), points.max(axis=0)]),
+    )
+
+
+def plot_tracks(tracks):
+    import helper_folium
+    from helper_simplify import zoom_for_bounds
+
+    bounds = np.concatenate([track.bounds for track in tracks])
+    zoom = zoom_for_bounds(bounds[:, 0], bounds[:, 1], *helper_folium.WALK_MAP_SIZE)
+    helper_folium.create_walks_map(
+        [cached_simplified_track(track.path, zoom) for track in tracks],
+        [{"uuid": track.name} for track in tracks],
+        zoom,
+    )
     return None
 
 
+def gpx_files(path):
+    # The GPX file, or every GPX file in the directory
+    if path.is_dir():
+        return sorted(path.glob("*.gpx"))
+    return [path]
+
+
 # Start of App
 
 # gpx_file = st.file_uploader(label="Choose GPX file to view", type="gpx") -- use absolute path instead of file uploader
 
 st.header("GPX viewer")
 
-gpx_file = st.text_input(label="GPX path/filename")
-
-if gpx_file is not None:
-    if Path(gpx_file).exists():
-        st.write(Path(gpx_file).name)
-        track = extract_track_metadata(Path(gpx_file))
-        #st.write(track.data)
-        #st.write(track.data[["latitude", "longitude"]])
-        plot_track(track)
+gpx_path = st.text_input(label="GPX path/filename (or directory of GPX files)")
+
+if gpx_path:
+    if Path(gpx_path).exists():
+        tracks = []
+        for gpx_file in gpx_files(Path(gpx_path)):
+            track = extract_track_metadata(gpx_file)
+            if track is None:
+                st.warning(f"{gpx_file.name} has no track points")
+                continue
+            tracks.append(track)
+            st.write(f"{track.name}: {track.date} {track.time}, {track.n_points:,} points")
+        if tracks:
+            plot_tracks(tracks)
+        else:
+            st.error(f"No GPX tracks found in {gpx_path}")
     else:
-        st.error(f"File {gpx_file} does not exist")
-
+        st.error(f"File {gpx_path} does not exist")
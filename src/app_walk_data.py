@@ -1,24 +1,41 @@
+import time
 import warnings
 from pathlib import Path
 
-import folium
+import numpy as np
 import pandas as pd
 import streamlit as st
-from sqlite_utils import Database
-from st_aggrid import AgGrid
-from streamlit_folium import folium_static
 
+from helper_activity_types import ACTIVITY_TYPE_OPTIONS, WALKING_ACTIVITY_TYPES
 from helper_app import *
-from helper_folium import *
-from walk_data_aux import (
-    convert_healthkit_export_to_sqlite,
-    create_walk_workout_summary,
+from helper_jobs import (
+    DONE,
+    FAILED,
+    JOB_POLL_SECONDS,
+    JobAlreadyActive,
+    conversion_job_key,
+    gpx_import_job_key,
+    job_runner,
+    summary_job_key,
 )
+from helper_labels import next_unlabelled_workout
+from helper_map_cache import (
+    GROUP_LAYER_CACHE,
+    build_group_layer,
+    group_fingerprint,
+    layer_points,
+)
+from helper_parquet import parquet_store_path
+from helper_simplify import MAX_MAP_POINTS, zoom_for_bounds
+from helper_spatial import NEAR_DISTANCE_KM, suggest_walk_groups, workouts_near
 
 warnings.simplefilter(action="ignore", category=FutureWarning)
 
 # Labelling / grouping approach assumes the sorting by workout start time
 
+# folium, streamlit-folium and st_aggrid (slow to import) are only imported by the pages
+# which draw maps or grids, so the convert and summary pages start up without them
+
 
 st.set_page_config(
     page_title="Emmaus-Walking-Data",
@@ -31,37 +48,176 @@ st.set_page_config(
 
 MAX_MIN_DISTANCE_THRESHOLD = 50
 
+GROUP_MAP_SIZE = (750, 550)
+
+HEATMAP = "All walks (heatmap)"
+
+
+def suggest_unlabelled_walks(spatial_index, data_df, data_filtered_df, distance_km):
+    st.markdown("#### Suggested walk groups (from the labelled walks nearby)")
+    if spatial_index is None:
+        st.info(
+            "The database has no spatial index: recalculate the summary (menu option 2) to build it"
+        )
+        return
+    workout_groups = labelled_workout_groups(data_df)
+    unlabelled_df = data_filtered_df[~data_filtered_df["workout_id"].isin(workout_groups)]
+    min_share = st.slider("Minimum share of the nearby walks' votes", 0.5, 1.0, 0.8, 0.05)
+    with TRACK_STORE_LOCK:
+        suggestions_df = suggest_walk_groups(
+            spatial_index, unlabelled_df, workout_groups, distance_km, min_share
+        )
+    if suggestions_df.empty:
+        st.write("No suggestions")
+        return
+    suggestions_df = unlabelled_df[
+        ["workout_id", "uuid", "start_datetime", "start_location", "totaldistance_km"]
+    ].merge(suggestions_df, on="workout_id")
+    st.write(suggestions_df.drop(columns="workout_id"))
+    if st.button(f"Save the {len(suggestions_df)} suggested labels"):
+        save_workout_labels(zip(suggestions_df["uuid"], suggestions_df["walk_group"]))
+        st.info("Labels saved")
+        st.experimental_rerun()
+
 
-def convert_healthkit_to_sqlite():
+def show_job(runner, job):
+    # The job's status and stage progress, with buttons to cancel or resume it. Returns
+    # True while it is queued or running, for the page to be rerun (polled) until done.
+    st.markdown(f"**{job.kind.capitalize()} job {job.id}: {job.status}** ({job.created_at})")
+    if job.active:
+        if job.stage is not None:
+            st.progress(job.progress or 0.0)
+            st.text(f"Stage: {job.stage}" + (f" - {job.message}" if job.message else ""))
+        if job.cancel_requested:
+            st.text("Cancelling...")
+        elif st.button("Cancel", key=f"cancel_job_{job.id}"):
+            runner.cancel(job.id)
+        return True
+    if job.status == FAILED:
+        st.error(f"Failed at the {job.stage} stage: {job.error}")
+    if job.resumable:
+        done = ", ".join(job.state.get("stages_done", [])) or "none"
+        if st.button(f"Resume (stages done: {done})", key=f"resume_job_{job.id}"):
+            try:
+                runner.resume(job.id)
+            except JobAlreadyActive as e:
+                st.warning(str(e))
+            return True
+    return False
+
+
+def convert_healthkit_to_sqlite(backend):
     st.subheader("Convert HealthKit data (export.zip) to SQLite database")
 
     placeholder = st.empty()
 
     data_dir = Path(__file__).parent.parent / "data"
+    latest_db_file, db_available = get_latest_sqlite_file(data_dir)
     db_path = placeholder.text_input(
         label="Most recent SQLite database (in data directory)",
-        value=get_latest_sqlite_file(data_dir)[0],
+        value=latest_db_file,
     )
 
     path_export_zip = st.text_input(label="Enter path to export.zip")
+
+    ingest_everything = st.checkbox(
+        "Ingest all HealthKit data (every workout type and all Records - much slower)"
+    )
+    activity_types = st.multiselect(
+        "Workout types to ingest",
+        ACTIVITY_TYPE_OPTIONS,
+        default=list(WALKING_ACTIVITY_TYPES),
+        disabled=ingest_everything,
+    )
+    incremental = st.checkbox(
+        "Incremental: only add workouts new since the most recent SQLite database",
+        value=db_available > 0,
+        disabled=db_available == 0,
+    )
+    compact_tracks = st.checkbox(
+        "Compact tracks: faster maps and a far smaller database, without the accuracy, "
+        "course and speed of each point (kept once the database has them)"
+    )
     disabled = path_export_zip == "" or Path(path_export_zip).exists() is False
 
-    if convert_button := st.button("Convert export.zip", disabled=disabled, key=1):
-        with st.spinner(text="In progress..."):
-            db_file_data_dir, mv_zip_file = convert_healthkit_export_to_sqlite(
-                Path(path_export_zip)
+    runner = job_runner()
+    job = runner.latest_job(conversion_job_key(path_export_zip)) if path_export_zip else None
+    if job is not None and job.active:
+        return show_job(runner, job)
+
+    if st.button("Convert export.zip", disabled=disabled, key=1):
+        try:
+            job_id = runner.submit(
+                "convert",
+                conversion_job_key(path_export_zip),
+                {
+                    "export_zip": Path(path_export_zip).as_posix(),
+                    "activity_types": None if ingest_everything else activity_types,
+                    "previous_db_file": latest_db_file if incremental and db_available else None,
+                    "parquet": backend == BACKEND_PARQUET,
+                    "compact_tracks": compact_tracks,
+                },
             )
-        if Path(db_file_data_dir).exists():
-            db_path = placeholder.text_input(
-                label="Most recent SQLite database (in data directory)",
-                value=db_file_data_dir,
-                key=1,
+        except JobAlreadyActive as e:
+            job_id = e.job.id
+        return show_job(runner, runner.job(job_id))
+    if job is None:
+        return False
+    if show_job(runner, job):  # resumed
+        return True
+    if job.status == DONE:
+        placeholder.text_input(
+            label="Most recent SQLite database (in data directory)",
+            value=job.state["db_file"],
+            key=1,
+        )
+        st.markdown("##")
+        st.info("Export successful: export.zip renamed to " + job.state["zip_file"])
+    return False
+
+
+def import_gpx_to_sqlite(backend):
+    st.subheader("Import GPX files (walks recorded outside Apple Health)")
+
+    data_dir = Path(__file__).parent.parent / "data"
+    latest_db_file, db_available = get_latest_sqlite_file(data_dir)
+    path_gpx = st.text_input(label="Enter path to a directory or zip archive of GPX files")
+    disabled = db_available == 0 or path_gpx == "" or Path(path_gpx).exists() is False
+
+    runner = job_runner()
+    job = runner.latest_job(gpx_import_job_key(latest_db_file)) if db_available else None
+    if job is not None and job.active:
+        return show_job(runner, job)
+
+    if st.button("Import GPX files", disabled=disabled):
+        try:
+            job_id = runner.submit(
+                "import",
+                gpx_import_job_key(latest_db_file),
+                {
+                    "source": Path(path_gpx).as_posix(),
+                    "db_file": Path(latest_db_file).as_posix(),
+                    "parquet": backend == BACKEND_PARQUET,
+                },
             )
-            st.markdown("##")
-            st.info("Export successful: export.zip renamed to " + mv_zip_file)
+        except JobAlreadyActive as e:
+            job_id = e.job.id
+        return show_job(runner, runner.job(job_id))
+    if job is None:
+        return False
+    if show_job(runner, job):  # resumed
+        return True
+    if job.status == DONE:
+        st.info(
+            f"Imported {job.state['workouts']:,} walks into {Path(latest_db_file).name} - "
+            "recalculate the workouts summary to label and map them"
+        )
+        for name, reason in job.state["files_failed"]:
+            st.warning(f"{name}: {reason}")
+    return False
 
 
-def calculate_workout_summary():
+def calculate_workout_summary(backend):
     st.subheader("Calculate workout summary")
     data_dir = Path(__file__).parent.parent / "data"
     db_file, db_available = get_latest_sqlite_file(data_dir)
@@ -69,13 +225,45 @@ def calculate_workout_summary():
         label="Most recent SQLite database (in data directory)", value=db_file
     )
     disable_calc_button = db_available == 0
+    runner = job_runner()
+    output_file = summary_file(backend)
+    job = runner.latest_job(summary_job_key(output_file))
+    if job is not None and job.active:
+        return show_job(runner, job)
+
     if st.button(label="Calculate summary", disabled=disable_calc_button):
-        with st.spinner(text="In progress..."):
-            summary_file = create_walk_workout_summary(db_file)
-        st.write(summary_file)
+        try:
+            job_id = runner.submit(
+                "summary",
+                summary_job_key(output_file),
+                {
+                    "db_file": Path(db_file).as_posix(),
+                    "output_file": Path(output_file).as_posix(),
+                    "parquet": backend == BACKEND_PARQUET,
+                },
+            )
+        except JobAlreadyActive as e:
+            job_id = e.job.id
+        return show_job(runner, runner.job(job_id))
+    if job is None:
+        return False
+    if show_job(runner, job):  # resumed
+        return True
+    if job.status == DONE:
+        hits = job.state["location_cache_hits"]
+        lookups = hits + job.state["location_cache_misses"]
+        st.write(job.state["output_file"])
+        st.caption(
+            f"Location cache: {hits:,} hits, {job.state['location_cache_misses']:,} misses "
+            f"({hits / lookups if lookups else 0:.0%} hit rate), "
+            f"{job.state['location_cache_entries']:,} entries"
+        )
+    return False
+
 
+def label_group_walks(backend):
+    from helper_folium import create_walk_map
 
-def label_group_walks():
     db_path, db_available = get_latest_sqlite_file(
         Path(__file__).parent.parent / "data"
     )
@@ -87,24 +275,24 @@ def label_group_walks():
 
     # Load data
 
-    db = Database(db_path)
+    track_store = open_track_store(db_path, backend)
 
     try:
-        DATA_CSV = Path("data/workouts_summary.csv")
-        data_df = pd.read_csv(DATA_CSV, parse_dates=["start_datetime"])
+        DATA_SUMMARY = summary_file(backend)
+        data_df = cached_read(DATA_SUMMARY, read_summary)
         data_df.sort_values(by="start_datetime", inplace=True)
         data_df.reset_index(inplace=True)
         data_df["index"] = data_df.index
     except IOError as e:
         st.info(
             "Cannot find: "
-            + DATA_CSV.as_posix()
+            + DATA_SUMMARY.as_posix()
             + " - first use Menu item #2 to calculate."
         )
         return
 
     if Path(DATA_WALK_GROUPS_CSV).exists():
-        walk_groups_df = pd.read_csv(DATA_WALK_GROUPS_CSV)
+        walk_groups_df = cached_read(DATA_WALK_GROUPS_CSV)
         walk_group = walk_groups_df["walk_group"].to_list()
     else:
         # Create default walk_groups.csv
@@ -112,21 +300,11 @@ def label_group_walks():
         with open(DATA_WALK_GROUPS_CSV, "a") as walk_groups_csv:
             walk_groups_csv.write('"walk_group","walk_group_name"')
 
-    if Path("data/workouts_labelled.csv").exists():
-        data_labelled = True
-        workouts_labelled_df = pd.read_csv("data/workouts_labelled.csv")
-        if workouts_labelled_df.empty:
-            last_labelled_workout_id = 0
-            data_labelled = False
-        else:
-            last_labelled_workout_id = workouts_labelled_df.loc[
-                workouts_labelled_df.index[-1], "uuid"
-            ]
-    else:
-        data_labelled = False
-        last_labelled_workout_id = 0
-        with open("data/workouts_labelled.csv", "a") as workouts_labelled_csv:
-            workouts_labelled_csv.write("uuid,walk_group")
+    # The workouts to label (and their labels) are in the label store
+    sync_label_store(DATA_SUMMARY)
+
+    # Start/finish points of the walks, for the walks nearby and suggested walk groups
+    spatial_index = open_spatial_index(db_path)
 
     # Sidebar
     st.sidebar.text_input(label="SQLite database", value=db_path.split("/")[-1])
@@ -147,7 +325,7 @@ def label_group_walks():
             "New walk group name e.g. Great North Walk", value="", key=1
         )
         # update walk_group info if new group created
-        walk_groups_df = pd.read_csv(DATA_WALK_GROUPS_CSV)
+        walk_groups_df = cached_read(DATA_WALK_GROUPS_CSV)
         walk_group = walk_groups_df["walk_group"].to_list()
 
     st.sidebar.markdown("##")
@@ -164,6 +342,11 @@ def label_group_walks():
 
     display_all = st.sidebar.checkbox("Info: Display summary of workouts")
 
+    near_distance_km = st.sidebar.number_input(
+        "Nearby walks: start/finish within (km)", 0.1, 10.0, NEAR_DISTANCE_KM, 0.1
+    )
+    suggest_all = st.sidebar.checkbox("Suggest walk groups for unlabelled walks")
+
     # filter data & do calculations
 
     # Seems that it is possible to get duplicated workouts, not sure if this is an
@@ -187,29 +370,23 @@ def label_group_walks():
         st.markdown(
             f"#### Walks selected (total distance > {threshold} km) : Count is {len(data_filtered_df)}"
         )
+        from st_aggrid import AgGrid
+
         grid = AgGrid(data_filtered_df[display_columns], editable=True)
         grid_df = grid["data"]
 
-    next_row_index = (
-        data_filtered_df["uuid"]
-        .loc[data_filtered_df["uuid"] == last_labelled_workout_id]
-        .index
-        + 1
-        if data_labelled
-        and data_filtered_df["uuid"].isin([last_labelled_workout_id]).any()
-        else 0
+    if suggest_all:
+        suggest_unlabelled_walks(
+            spatial_index, data_df, data_filtered_df, near_distance_km
+        )
+
+    # The earliest unlabelled walk over the threshold (an index seek in the label store)
+    next_workout_id = next_unlabelled_workout(
+        label_store(), threshold, data_filtered_df["uuid"].astype(str)
     )
-    if next_row_index >= len(data_filtered_df):
+    if next_workout_id is None:
         st.info("Finished labelling - stopping: no walks left to label")
         return
-    else:
-        # Following is a pragmatic hack as for some reason Pandas sometimes returns a dataframe with a single row, and other times as a series.
-        try:
-            next_row = data_filtered_df[display_columns].iloc[[next_row_index], :]
-        except Exception:
-            next_row = data_filtered_df[display_columns].iloc[next_row_index]
-
-    next_workout_id = next_row["uuid"].iloc[0]
 
     # Main page - Label/group walks
 
@@ -223,12 +400,45 @@ def label_group_walks():
 
     st.write(workout_info.T)
 
-    query_df = pd.read_sql_query(
-        query_workout_points(next_workout_id, data_filtered_df), db.conn
-    )
-    create_walk_map(query_df, workout_info)
+    walk_points = query_workout_points(next_workout_id, data_filtered_df, track_store)
+    create_walk_map(walk_points, workout_info)
+
+    suggested_group = None
+    if spatial_index is not None:
+        workout_groups = labelled_workout_groups(data_df)
+        next_workout = data_filtered_df[data_filtered_df["uuid"] == next_workout_id]
+        with TRACK_STORE_LOCK:
+            suggestion_df = suggest_walk_groups(
+                spatial_index, next_workout, workout_groups, near_distance_km
+            )
+        if not suggestion_df.empty:
+            suggestion = suggestion_df.iloc[0]
+            suggested_group = suggestion["walk_group"]
+            st.write(
+                f"Suggested walk group: **{suggested_group}** "
+                f"({suggestion['share']:.0%} of the votes of the {suggestion['n_walks']} "
+                f"labelled walks starting or finishing within {near_distance_km} km)"
+            )
+        with st.expander("Walks starting or finishing near this walk's start"):
+            with TRACK_STORE_LOCK:
+                near_df = workouts_near(
+                    spatial_index,
+                    next_workout["start_latitude"].iloc[0],
+                    next_workout["start_longitude"].iloc[0],
+                    near_distance_km,
+                )
+            near_df["walk_group"] = near_df["workout_id"].map(workout_groups)
+            near_df = data_df[["workout_id", "start_datetime", "uuid", "totaldistance_km"]].merge(
+                near_df[["workout_id", "endpoint", "distance_km", "walk_group"]],
+                on="workout_id",
+            )
+            st.write(near_df.sort_values("distance_km").drop(columns="workout_id"))
 
-    walk_group_selected = st.selectbox("Walk group label?", walk_group)
+    walk_group_selected = st.selectbox(
+        "Walk group label?",
+        walk_group,
+        index=walk_group.index(suggested_group) if suggested_group in walk_group else 0,
+    )
 
     if walk_group != []:
         save_walk_disabled = False
@@ -242,59 +452,137 @@ def label_group_walks():
 
     if st.button("Save walk label", disabled=save_walk_disabled):
         save_workout_label(next_workout_id, walk_group_selected)
-        st.info("File saved")
+        st.info("Label saved")
         st.experimental_rerun()
 
 
-def map_walks():
-    # Load data
-    data_df, walk_groups_df, workouts_labelled_df = load_data()
-    if data_df is None or walk_groups_df is None or workouts_labelled_df is None:
-        return None
-    if workouts_labelled_df.empty:
+def map_walks(backend):
+    import folium
+    from streamlit_folium import folium_static
+
+    from helper_folium import add_group_layer
+
+    map_by = st.sidebar.radio("Map walks by:", ["Walk group", "Year", HEATMAP])
+    if map_by == HEATMAP:
+        # Every walk, labelled or not
+        return map_walks_density()
+
+    # Load data (with the labels merged on - cached until the files change)
+    data_labelled_df, walk_groups_df = load_labelled_data(backend)
+    if data_labelled_df.empty:
         st.info("No workouts to map - you need to label some first.")
         return None
-    db = Database(get_latest_sqlite_file(Path(__file__).parent.parent / "data")[0])
+    db_file = get_latest_sqlite_file(Path(__file__).parent.parent / "data")[0]
 
     walk_group = walk_groups_df["walk_group"].to_list()
+    walk_years = sorted(data_labelled_df["start_datetime"].dt.year.unique(), reverse=True)
 
     # Sidebar
-    walk_group_selected = st.sidebar.selectbox("Walk to map?", walk_group)
-
-    # Data transformation
-    data_labelled_df = data_df.merge(workouts_labelled_df, on="uuid")
+    if map_by == "Year":
+        year_selected = st.sidebar.selectbox("Year to map?", walk_years)
+    else:
+        walk_group_selected = st.sidebar.selectbox("Walk to map?", walk_group)
 
     # Main page
     st.header("Map walks")
 
-    st.write(
-        walk_groups_df["walk_group_name"][
-            walk_groups_df["walk_group"] == walk_group_selected
-        ].iloc[0]
-    )
+    if map_by == "Year":
+        st.write(f"All labelled walks in {year_selected}")
+        workouts_to_map = data_labelled_df[
+            data_labelled_df["start_datetime"].dt.year == year_selected
+        ].drop_duplicates(subset="uuid")
+        layer_name = f"year {year_selected}"
+    else:
+        st.write(
+            walk_groups_df["walk_group_name"][
+                walk_groups_df["walk_group"] == walk_group_selected
+            ].iloc[0]
+        )
+        workouts_to_map = data_labelled_df[
+            data_labelled_df["walk_group"] == walk_group_selected
+        ].drop_duplicates(subset="uuid")
+        layer_name = walk_group_selected
+
+    def build_layer():
+        # The zoom the map will be shown at (estimated from the start/finish points)
+        # decides how far the tracks are simplified - further still for an overview of
+        # many walks, so the map stays within MAX_MAP_POINTS
+        zoom = zoom_for_bounds(
+            np.r_[workouts_to_map["start_latitude"], workouts_to_map["finish_latitude"]],
+            np.r_[workouts_to_map["start_longitude"], workouts_to_map["finish_longitude"]],
+            *GROUP_MAP_SIZE,
+        )
+        # All the points for the group in one query, rather than one query per walk
+        walks_points = fetch_workouts_points(
+            open_track_store(db_file, backend),
+            workouts_to_map["workout_id"],
+            zoom,
+            MAX_MAP_POINTS,
+        )
+        return build_group_layer(workouts_to_map, walks_points, zoom)
 
-    workouts_to_map = data_labelled_df[
-        data_labelled_df["walk_group"] == walk_group_selected
-    ]["uuid"].to_list()
+    # The group's layer is only rebuilt when its labelled walks (or the database) change
+    layer = GROUP_LAYER_CACHE.get(
+        layer_name,
+        group_fingerprint(
+            workouts_to_map, f"{backend}:{db_file}:{file_signature(db_file)}"
+        ),
+        build_layer,
+    )
 
     start_coord = (0, 0)
     map_handle = folium.Map(
         start_coord, zoom_start=13, detect_retina=True, control_scale=True
     )
+    add_group_layer(map_handle, layer)
+    folium_static(map_handle, width=GROUP_MAP_SIZE[0], height=GROUP_MAP_SIZE[1])
+
+    last_build = (
+        f", last build {GROUP_LAYER_CACHE.last_build_seconds:.2f} s"
+        if GROUP_LAYER_CACHE.last_build_seconds is not None
+        else ""
+    )
+    st.caption(
+        f"{len(workouts_to_map):,} walks, {layer_points(layer):,} points drawn. "
+        f"Map cache: {len(GROUP_LAYER_CACHE):,} groups "
+        f"({GROUP_LAYER_CACHE.size_bytes() / 1e3:,.0f} kB), "
+        f"{GROUP_LAYER_CACHE.hits:,} hits, {GROUP_LAYER_CACHE.misses:,} misses "
+        f"({GROUP_LAYER_CACHE.hit_rate:.0%} hit rate){last_build}"
+    )
+
 
-    for uuid in workouts_to_map:
-        query_df = pd.read_sql_query(
-            query_workout_points(uuid, data_labelled_df), db.conn
+def map_walks_density():
+    # A heatmap of every walk's points from the database's density grid (see
+    # helper_density): its size depends on the area walked, not the number of walks
+    import folium
+    from streamlit_folium import folium_static
+
+    from helper_folium import add_density_layer
+
+    st.header("Map walks")
+    db_file, db_available = get_latest_sqlite_file(Path(__file__).parent.parent / "data")
+    if not db_available:
+        st.info("No database - you need to convert an export first.")
+        return None
+    latitudes, longitudes, n_points = read_density_heatmap(db_file)
+    if len(n_points) == 0:
+        st.info(
+            "No density grid in this database - convert an export, or rerun "
+            "the summary, to build it."
         )
-        workout_info = data_df[data_df["uuid"] == uuid].iloc[0]
-        create_walk_map_handle(query_df, map_handle, workout_info)
-        # st.info(uuid)
+        return None
+
+    map_handle = folium.Map(
+        (0, 0), zoom_start=13, detect_retina=True, control_scale=True
+    )
+    add_density_layer(map_handle, latitudes, longitudes, n_points)
+    folium_static(map_handle, width=GROUP_MAP_SIZE[0], height=GROUP_MAP_SIZE[1])
+    st.caption(f"{n_points.sum():,} points in {len(n_points):,} cells drawn.")
 
-    map_handle.fit_bounds(map_handle.get_bounds())
-    folium_static(map_handle, width=750, height=550)
 
+def review_walk_labels(backend):
+    from helper_folium import create_walk_map
 
-def review_walk_labels():
     display_columns = [
         "walk_group",
         "index",
@@ -306,22 +594,15 @@ def review_walk_labels():
         "totaldistance_km",
     ]
 
-    # Load data
-    data_df, walk_groups_df, workouts_labelled_df = load_data()
-    if data_df is None or walk_groups_df is None or workouts_labelled_df is None:
-        return None
-    if workouts_labelled_df.empty:
+    # Load data (sorted by start, with the labels merged on - cached until the files change)
+    data_labelled_df, walk_groups_df = load_labelled_data(backend, sort_by_start=True)
+    if data_labelled_df.empty:
         st.info("No workouts to map - you need to label some first.")
         return None
 
-    data_df.sort_values(by="start_datetime", inplace=True)
-    data_df.reset_index(inplace=True)
-    data_df["index"] = data_df.index
-
-    db = Database(get_latest_sqlite_file(Path(__file__).parent.parent / "data")[0])
-
-    # Data transformation
-    data_labelled_df = data_df.merge(workouts_labelled_df, on="uuid")
+    track_store = open_track_store(
+        get_latest_sqlite_file(Path(__file__).parent.parent / "data")[0], backend
+    )
 
     workout_index = st.slider("Workout # for review:", 0, len(data_labelled_df) - 1)
 
@@ -329,13 +610,10 @@ def review_walk_labels():
 
     st.write(workout_info[display_columns])
 
-    query_df = pd.read_sql_query(
-        query_workout_points(
-            data_labelled_df.iloc[workout_index]["uuid"], data_labelled_df
-        ),
-        db.conn,
+    walk_points = query_workout_points(
+        data_labelled_df.iloc[workout_index]["uuid"], data_labelled_df, track_store
     )
-    create_walk_map(query_df, workout_info)
+    create_walk_map(walk_points, workout_info)
 
 
 # Sidebar: Main menu
@@ -350,15 +628,38 @@ menu_choice = st.sidebar.radio(
         "Map walks",
     ],
 )
+backend = st.sidebar.radio("Storage backend:", [BACKEND_SQLITE, BACKEND_PARQUET])
 st.sidebar.markdown("##")
 
+latest_db_file, db_available = get_latest_sqlite_file(
+    Path(__file__).parent.parent / "data"
+)
+parquet_store_missing = (
+    backend == BACKEND_PARQUET
+    and db_available > 0
+    and not parquet_store_path(latest_db_file).exists()
+)
+
+# The conversion, GPX import and summary run as background jobs (helper_jobs): while
+# one is running its page is rerun every JOB_POLL_SECONDS to show its progress
+job_active = False
 if menu_choice == "Convert HealthKit export to SQLite":
-    convert_healthkit_to_sqlite()
+    job_active = convert_healthkit_to_sqlite(backend)
+    job_active = import_gpx_to_sqlite(backend) or job_active
 elif menu_choice == "Calculate workouts summary":
-    calculate_workout_summary()
+    job_active = calculate_workout_summary(backend)
+elif parquet_store_missing:
+    st.info(
+        "No Parquet track store for the most recent SQLite database: please first calculate "
+        "the workouts summary with the Parquet backend (menu option 2)"
+    )
 elif menu_choice == "Label/group walks":
-    label_group_walks()
+    label_group_walks(backend)
 elif menu_choice == "Review walk labels":
-    review_walk_labels()
+    review_walk_labels(backend)
 else:
-    map_walks()
+    map_walks(backend)
+
+if job_active:
+    time.sleep(JOB_POLL_SECONDS)
+    st.experimental_rerun()
@@ -0,0 +1,14 @@
+# HealthKit workout activity types used across the app. No imports, so the pages, the
+# command line and helper_density can import it without loading the ingest.
+
+# The workout types used by the app (see sql/select_star_walking_workouts.sql)
+WALKING_ACTIVITY_TYPES = ("HKWorkoutActivityTypeWalking", "HKWorkoutActivityTypeHiking")
+
+ACTIVITY_TYPE_OPTIONS = [
+    "HKWorkoutActivityTypeWalking",
+    "HKWorkoutActivityTypeHiking",
+    "HKWorkoutActivityTypeRunning",
+    "HKWorkoutActivityTypeCycling",
+    "HKWorkoutActivityTypeCrossCountrySkiing",
+    "HKWorkoutActivityTypeSnowSports",
+]
@@ -1,14 +1,108 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
+import numpy as np
 import pandas as pd
 
+from helper_density import heatmap_cells, read_density
+from helper_labels import (
+    LABEL_STORE_FILE,
+    open_label_store,
+    read_labels,
+    save_label,
+    save_labels,
+    sync_summary_workouts,
+)
+from helper_parquet import ParquetTrackStore, parquet_store_path
+from helper_simplify import choose_zoom_level, stored_zoom_level
+from helper_spatial import has_endpoints_rtree
+from helper_tracks import decode_points
+
 
 DATA_WALK_GROUPS_CSV = "data/walk_groups.csv"
+DATA_SUMMARY_CSV = "data/workouts_summary.csv"
+DATA_SUMMARY_PARQUET = "data/workouts_summary.parquet"
+
+# Where the workouts summary and points are read from: the SQLite database and CSV
+# summary, or the Parquet track store (see helper_parquet) and Parquet summary
+BACKEND_SQLITE = "SQLite"
+BACKEND_PARQUET = "Parquet"
+
+# The Streamlit script is rerun on every interaction, but this module is imported once
+# per server process: the caches below persist across reruns (and sessions). Results
+# read from files are keyed on the files' signatures, so they are invalidated whenever a
+# file is written or replaced.
+CACHED_FILES = 16
+CACHED_TRACK_STORES = 4
+WORKOUT_POINTS_CACHE_SIZE = 256
+
+
+def file_signature(path):
+    # Changes whenever the file (or, for a directory, its list of entries) changes
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+@lru_cache(maxsize=CACHED_FILES)
+def _cached_read(path, signature, read):
+    return read(path)
+
+
+def cached_read(path, read=pd.read_csv):
+    # read(path), memoised until the file changes. A copy is returned as the pages
+    # modify the DataFrames in place.
+    return _cached_read(Path(path).absolute().as_posix(), file_signature(path), read).copy()
+
+
+def label_store(store_file=LABEL_STORE_FILE):
+    # The label store (see helper_labels) connection, reused until the file is replaced
+    signature = file_signature(store_file)
+    return _label_store(
+        Path(store_file).as_posix(), signature[2] if signature is not None else None
+    )
+
+
+@lru_cache(maxsize=1)
+def _label_store(path, inode):
+    return open_label_store(path)
+
+
+def read_workouts_labelled(store_file):
+    # The labels of the label store store_file (the path cached_read passes)
+    return read_labels(label_store(store_file))
+
+
+def sync_label_store(summary_file):
+    # The workouts to label follow the summary: synced again only when it changes
+    _sync_label_store(Path(summary_file).absolute().as_posix(), file_signature(summary_file))
+
+
+@lru_cache(maxsize=CACHED_FILES)
+def _sync_label_store(summary_file, signature):
+    sync_summary_workouts(label_store(), cached_read(summary_file, read_summary))
 
 
 def save_workout_label(workout_id, walk_group):
-    with open("data/workouts_labelled.csv", "a") as f:
-        csv_str = "\n" + workout_id + "," + str(walk_group)
-        f.write(csv_str)
+    save_label(label_store(), workout_id, str(walk_group))
+
+
+def save_workout_labels(labels):
+    # labels: (uuid, walk_group) pairs, saved in one transaction
+    save_labels(label_store(), ((uuid, str(walk_group)) for uuid, walk_group in labels))
+
+
+def labelled_workout_groups(data_df):
+    # {workout_id: walk_group} of the labelled workouts in the summary
+    labels_df = cached_read(LABEL_STORE_FILE, read_workouts_labelled)
+    labelled_df = data_df[["uuid", "workout_id"]].merge(labels_df, on="uuid")
+    return dict(zip(labelled_df["workout_id"], labelled_df["walk_group"]))
 
 
 def save_new_walk_group(walk_group, walk_group_name):
@@ -18,32 +112,377 @@ def save_new_walk_group(walk_group, walk_group_name):
 
 
 def get_latest_sqlite_file(data_dir, file_pattern="healthkit_db_*.sqlite"):
+    # Only globbed again when a file is added to / removed from the data directory
+    return _latest_file(
+        Path(data_dir).absolute().as_posix(), file_pattern, file_signature(data_dir)
+    )
+
+
+@lru_cache(maxsize=CACHED_FILES)
+def _latest_file(data_dir, file_pattern, signature):
+    files = list(Path(data_dir).glob(file_pattern))
+    if not files:
+        return f"No files matching {file_pattern}", 0
     return (
-        (
-            max(
-                Path(data_dir).glob(file_pattern),
-                key=lambda f: f.stat().st_ctime,
-            )
-            .absolute()
-            .as_posix(),
-            len(list(Path(data_dir).glob(file_pattern))),
-        )
-        if list(Path(data_dir).glob(file_pattern))
-        else (f"No files matching {file_pattern}", 0)
+        max(files, key=lambda f: f.stat().st_ctime).absolute().as_posix(),
+        len(files),
     )
 
 
-def load_data():
-    DATA_CSV = Path("data/workouts_summary.csv")
+def summary_file(backend=BACKEND_SQLITE):
+    return Path(DATA_SUMMARY_PARQUET if backend == BACKEND_PARQUET else DATA_SUMMARY_CSV)
+
+
+def read_summary(summary_file):
+    if Path(summary_file).suffix == ".parquet":
+        data_df = pd.read_parquet(summary_file)
+        data_df["start_datetime"] = pd.to_datetime(data_df["start_datetime"])
+        return data_df
+    return pd.read_csv(summary_file, parse_dates=["start_datetime"])
+
+
+def load_data(backend=BACKEND_SQLITE):
+    DATA_SUMMARY = summary_file(backend)
     try:
-        data_df = pd.read_csv(DATA_CSV, parse_dates=["start_datetime"])
-        walk_groups_df = pd.read_csv(DATA_WALK_GROUPS_CSV)
-        workouts_labelled_df = pd.read_csv("data/workouts_labelled.csv")
+        data_df = cached_read(DATA_SUMMARY, read_summary)
+        walk_groups_df = cached_read(DATA_WALK_GROUPS_CSV)
+        workouts_labelled_df = cached_read(LABEL_STORE_FILE, read_workouts_labelled)
         return data_df, walk_groups_df, workouts_labelled_df
     except IOError as e:
-        raise ("Cannot find: " + DATA_CSV.as_posix() + " - first use Menu item #2 to calculate.") from e
+        raise ("Cannot find: " + DATA_SUMMARY.as_posix() + " - first use Menu item #2 to calculate.") from e
+
+
+def load_labelled_data(backend=BACKEND_SQLITE, sort_by_start=False):
+    # The summary merged with the labels (optionally sorted by start, with the position
+    # in the full summary as "index") and the walk groups, memoised until a file changes
+    data_labelled_df, walk_groups_df = _labelled_data(
+        backend,
+        sort_by_start,
+        tuple(
+            file_signature(path)
+            for path in [
+                summary_file(backend),
+                DATA_WALK_GROUPS_CSV,
+                LABEL_STORE_FILE,
+            ]
+        ),
+    )
+    return data_labelled_df.copy(), walk_groups_df.copy()
+
+
+@lru_cache(maxsize=CACHED_FILES)
+def _labelled_data(backend, sort_by_start, signatures):
+    data_df, walk_groups_df, workouts_labelled_df = load_data(backend)
+    if sort_by_start:
+        data_df.sort_values(by="start_datetime", inplace=True)
+        data_df.reset_index(inplace=True)
+        data_df["index"] = data_df.index
+    return data_df.merge(workouts_labelled_df, on="uuid"), walk_groups_df
+
+
+def open_track_store(db_file, backend=BACKEND_SQLITE):
+    # What fetch_workout_points / fetch_workouts_points read from: a SQLite connection, or
+    # the Parquet track store exported alongside the database. Reused until it changes.
+    if backend == BACKEND_PARQUET:
+        store_dir = parquet_store_path(db_file)
+        return _open_track_store(store_dir.as_posix(), backend, file_signature(store_dir))
+    return _open_track_store(Path(db_file).as_posix(), backend, file_signature(db_file))
+
+
+def open_spatial_index(db_file):
+    # The database's spatial index of the walks' start/finish points (see helper_spatial)
+    # is in the SQLite database whichever the backend: None if it predates the index.
+    # Queries on it hold TRACK_STORE_LOCK.
+    conn = open_track_store(db_file, BACKEND_SQLITE)
+    with TRACK_STORE_LOCK:
+        return conn if has_endpoints_rtree(conn) else None
+
+
+def read_density_heatmap(db_file):
+    # (latitudes, longitudes, n_points) of the density grid of all the walks (see
+    # helper_density), coarsened for a heatmap: empty if the database predates the grid.
+    # Cached until the database changes.
+    return _density_heatmap(db_file, file_signature(db_file))
+
+
+@lru_cache(maxsize=CACHED_FILES)
+def _density_heatmap(db_file, signature):
+    conn = open_track_store(db_file, BACKEND_SQLITE)
+    with TRACK_STORE_LOCK:
+        return heatmap_cells(*read_density(conn))
+
+
+# The open track stores, {(path, backend): (signature, store)} least recently used first.
+# A store is closed when its files change (it is replaced by a new one) or when it is
+# the least recently used of more than CACHED_TRACK_STORES.
+TRACK_STORES = OrderedDict()
+
+# The SQLite connections are shared by the Streamlit script threads (each rerun runs in a
+# thread of its own): their statements (with the fetch of their rows), transactions and
+# uses of the selected_workouts temp table hold this lock, so they never interleave, and
+# a connection is only closed while it is held
+TRACK_STORE_LOCK = threading.RLock()
+
+
+def _open_track_store(path, backend, signature):
+    with TRACK_STORE_LOCK:
+        key = (path, backend)
+        entry = TRACK_STORES.pop(key, None)
+        if entry is not None and entry[0] == signature:
+            store = entry[1]
+        else:
+            if entry is not None:
+                close_track_store(entry[1])
+            if backend == BACKEND_PARQUET:
+                store = ParquetTrackStore(path)
+            else:
+                store = sqlite3.connect(path, check_same_thread=False)
+        TRACK_STORES[key] = (signature, store)
+        while len(TRACK_STORES) > CACHED_TRACK_STORES:
+            _, (_, evicted) = TRACK_STORES.popitem(last=False)
+            close_track_store(evicted)
+        return store
+
+
+def close_track_store(store):
+    # Its workouts' points are dropped from WORKOUT_POINTS_CACHE with it: the store is
+    # part of their keys, so they could never be hit again
+    WORKOUT_POINTS_CACHE.discard_store(store)
+    if isinstance(store, sqlite3.Connection):
+        store.close()
+
+
+class WorkoutPointsCache:
+    # Bounded LRU of the point arrays of recently viewed workouts, keyed on (track store,
+    # workout_id, simplified zoom level). The arrays are made read-only as they are shared.
+    # A track store's entries are discarded when TRACK_STORES closes it.
+    def __init__(self, max_entries=WORKOUT_POINTS_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            points = self.entries.get(key)
+            if points is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return points
+
+    def put(self, key, points):
+        points.setflags(write=False)
+        with self.lock:
+            self.entries[key] = points
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return points
+
+    def discard_store(self, store):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] is store]:
+                del self.entries[key]
+
+
+WORKOUT_POINTS_CACHE = WorkoutPointsCache()
+
+
+# Parameterised so sqlite3 prepares it once per connection and reuses it (and served
+# entirely from the covering index created by walk_data_ingest.create_workout_points_indexes)
+WORKOUT_POINTS_SQL = (
+    "SELECT latitude, longitude FROM workout_points WHERE workout_id = ? ORDER BY date"
+)
+# The compact track (see helper_tracks), where the database has them: one row to read
+WORKOUT_TRACK_SQL = "SELECT points FROM workout_tracks WHERE workout_id = ?"
+SIMPLIFIED_WORKOUT_POINTS_SQL = (
+    "SELECT latitude, longitude FROM workout_points_simplified "
+    "WHERE workout_id = ? AND zoom = ? ORDER BY rowid"
+)
+
+
+def has_table(conn, table):
+    return (
+        conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+        is not None
+    )
+
+
+def points_level(conn, zoom, workout_ids=None, max_points=None):
+    # The simplified zoom level the points are read at (None: the raw points). Given the
+    # workouts to be drawn together and max_points, a coarser level is used if their
+    # tracks would otherwise exceed max_points (see helper_simplify.choose_zoom_level).
+    if zoom is None or isinstance(conn, ParquetTrackStore):
+        return None
+    with TRACK_STORE_LOCK:
+        if not has_table(conn, "workout_points_simplified"):
+            return None
+        if workout_ids is None or max_points is None:
+            return stored_zoom_level(zoom)
+        return choose_zoom_level(zoom, n_points_by_level(conn, workout_ids), max_points)
+
+
+def n_points_by_level(conn, workout_ids):
+    # {level: the workouts' total points at it}, None the raw points (from the track
+    # statistics, where calculated)
+    workout_ids = json.dumps(list(workout_ids))
+    n_points = {}
+    if has_table(conn, "workout_points_levels"):
+        n_points = dict(
+            conn.execute(
+                "SELECT zoom, SUM(n_points) FROM workout_points_levels "
+                "WHERE workout_id IN (SELECT value FROM json_each(?)) GROUP BY zoom",
+                (workout_ids,),
+            ).fetchall()
+        )
+    if has_table(conn, "workout_stats"):
+        n_points[None] = conn.execute(
+            "SELECT SUM(n_points) FROM workout_stats "
+            "WHERE workout_id IN (SELECT value FROM json_each(?))",
+            (workout_ids,),
+        ).fetchone()[0]
+    return n_points
+
+
+def fetch_workout_points(conn, workout_id, zoom=None):
+    # Returns an (n, 2) array of latitude, longitude. Given the zoom of the map, the
+    # precomputed simplified track for it is used where available (see helper_simplify).
+    # Recently fetched workouts come from WORKOUT_POINTS_CACHE.
+    level = points_level(conn, zoom)
+    key = (conn, workout_id, level)
+    points = WORKOUT_POINTS_CACHE.get(key)
+    if points is None:
+        points = WORKOUT_POINTS_CACHE.put(key, read_workout_points(conn, workout_id, level))
+    return points
+
+
+def read_workout_points(conn, workout_id, level):
+    if isinstance(conn, ParquetTrackStore):
+        return conn.workout_points(workout_id)
+    with TRACK_STORE_LOCK:
+        rows = []
+        if level is not None:
+            rows = conn.execute(
+                SIMPLIFIED_WORKOUT_POINTS_SQL, (workout_id, level)
+            ).fetchall()
+        if not rows and has_table(conn, "workout_tracks"):
+            track = conn.execute(WORKOUT_TRACK_SQL, (workout_id,)).fetchone()
+            if track is not None:
+                return decode_points(track[0])
+        if not rows:
+            rows = conn.execute(WORKOUT_POINTS_SQL, (workout_id,)).fetchall()
+    return np.array(rows, dtype=np.float64).reshape(-1, 2)
+
+
+def fetch_workouts_points(conn, workout_ids, zoom=None, max_points=None):
+    # Returns {workout_id: (n, 2) array of latitude, longitude} for many workouts: those
+    # recently fetched come from WORKOUT_POINTS_CACHE and the rest are read together.
+    # With max_points the level of detail also allows for the number of tracks.
+    workout_ids = list(dict.fromkeys(workout_ids))
+    level = points_level(conn, zoom, workout_ids, max_points)
+    tracks = {}
+    missing = []
+    for workout_id in workout_ids:
+        points = WORKOUT_POINTS_CACHE.get((conn, workout_id, level))
+        if points is None:
+            missing.append(workout_id)
+        else:
+            tracks[workout_id] = points
+    if missing:
+        for workout_id, points in read_workouts_points(conn, missing, level).items():
+            tracks[workout_id] = WORKOUT_POINTS_CACHE.put((conn, workout_id, level), points)
+    return tracks
+
+
+def read_workouts_points(conn, workout_ids, level):
+    # One query: the ids go in a temp table which drives (CROSS JOIN fixes the join order)
+    # index seeks into the points, and the result is split where the workout changes.
+    # The simplified tracks at the given level are used where available, then the
+    # compact tracks, and the raw points only for workouts with neither.
+    if isinstance(conn, ParquetTrackStore):
+        return conn.workouts_points(workout_ids)
+    with TRACK_STORE_LOCK:
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS selected_workouts "
+            "(key INTEGER PRIMARY KEY, workout_id TEXT UNIQUE)"
+        )
+        with conn:
+            conn.execute("DELETE FROM selected_workouts")
+            conn.executemany(
+                "INSERT OR IGNORE INTO selected_workouts (workout_id) VALUES (?)",
+                ((workout_id,) for workout_id in workout_ids),
+            )
+        workout_id_by_key = dict(
+            conn.execute("SELECT key, workout_id FROM selected_workouts")
+        )
+        tracks = {}
+        if level is not None:
+            tracks = split_tracks(
+                conn.execute(
+                    "SELECT s.key, p.latitude, p.longitude "
+                    "FROM selected_workouts AS s CROSS JOIN workout_points_simplified AS p "
+                    "ON p.workout_id = s.workout_id AND p.zoom = ? ORDER BY s.key, p.rowid",
+                    (level,),
+                ).fetchall(),
+                workout_id_by_key,
+            )
+            if len(tracks) == len(workout_id_by_key):
+                return tracks
+            # Only the raw points of workouts without a simplified track are needed
+            deselect_workouts(conn, tracks)
+        if has_table(conn, "workout_tracks"):
+            tracks.update(
+                (workout_id, decode_points(points_blob))
+                for workout_id, points_blob in conn.execute(
+                    "SELECT s.workout_id, t.points "
+                    "FROM selected_workouts AS s CROSS JOIN workout_tracks AS t "
+                    "ON t.workout_id = s.workout_id"
+                )
+            )
+            if len(tracks) == len(workout_id_by_key):
+                return tracks
+            deselect_workouts(conn, tracks)
+        tracks.update(
+            split_tracks(
+                conn.execute(
+                    "SELECT s.key, p.latitude, p.longitude "
+                    "FROM selected_workouts AS s CROSS JOIN workout_points AS p "
+                    "ON p.workout_id = s.workout_id ORDER BY s.key, p.date"
+                ).fetchall(),
+                workout_id_by_key,
+            )
+        )
+        return tracks
+
+
+def deselect_workouts(conn, workout_ids):
+    with conn:
+        conn.executemany(
+            "DELETE FROM selected_workouts WHERE workout_id = ?",
+            ((workout_id,) for workout_id in workout_ids),
+        )
+
+
+def split_tracks(rows, workout_id_by_key):
+    # (key, latitude, longitude) rows ordered by key -> {workout_id: (n, 2) array}
+    if not rows:
+        return {}
+    rows = np.array(rows, dtype=np.float64)
+    starts = np.flatnonzero(np.r_[True, rows[1:, 0] != rows[:-1, 0]])
+    return {
+        workout_id_by_key[int(rows[start, 0])]: track
+        for start, track in zip(starts, np.split(rows[:, 1:], starts[1:]))
+    }
 
 
-def query_workout_points(uuid, data_filtered_df):
+def query_workout_points(uuid, data_filtered_df, conn):
     workout_id = data_filtered_df[data_filtered_df["uuid"] == uuid]["workout_id"].iloc[0]
-    return f'SELECT latitude, longitude FROM workout_points WHERE workout_id = "{workout_id}"'
\ No newline at end of file
+    return fetch_workout_points(conn, workout_id)
\ No newline at end of file
@@ -0,0 +1,30 @@
+# Date/time parsing shared by the ingest, statistics and summary (pandas only, so it is
+# cheap to import)
+#
+# HealthKit and the GPX files write dates in more than one format:
+#   - "2019-06-11 15:00:42 +1000": workouts, records, and the points embedded in older
+#     exports (WorkoutRoute/Location) and so in healthkit-to-sqlite databases
+#   - "2020-01-01T06:00:00Z": the points of the route GPX files
+#   - "2020-01-01T16:00:00+10:00": other GPX files (e.g. imported ones)
+
+import pandas as pd
+
+# The local time zone of the summary and of the workouts imported from GPX files
+TIMEZONE = "Australia/Sydney"
+
+EPOCH = pd.Timestamp(0, tz="UTC")
+
+
+def parse_datetimes_as_utc(datetimes):
+    try:
+        return pd.to_datetime(datetimes, utc=True)
+    except ValueError:
+        # pandas >= 2 needs to be told that the formats may differ from row to row
+        return pd.to_datetime(datetimes, utc=True, format="mixed")
+
+
+def datetimes_to_seconds(datetimes):
+    # Seconds since the epoch (float64 array) of dates in any of the formats above, NaN
+    # where there is no date (None or "")
+    parsed = parse_datetimes_as_utc(pd.Series(datetimes, dtype=object))
+    return (parsed - EPOCH).dt.total_seconds().to_numpy(dtype=float)
@@ -0,0 +1,176 @@
+# Density grid of every walk's points, for an all-time heatmap
+#
+#   - Only the walks (helper_activity_types.WALKING_ACTIVITY_TYPES, as in the summary)
+#     are binned, not the other workouts of an export ingested in full (runs, rides etc.)
+#   - Every point is binned into a fixed grid of DENSITY_CELL_DEGREES cells, numbered
+#     row * (columns in the grid) + column from (-90, -180), and the count of points in
+#     each cell kept in the workout_points_density table: one row per cell visited
+#   - Built a chunk of workouts at a time (from their compact tracks where available, see
+#     helper_tracks) with np.unique over the chunk's cells, then added to the stored
+#     counts; workout_points_density_workouts records the workouts binned, so new
+#     workouts are added incrementally as they are ingested
+#   - The grid's size depends on the area walked rather than the number of walks, and it
+#     is coarsened (by powers of 2) to at most MAX_DENSITY_CELLS for the map, so an
+#     all-time map costs the same for 100 walks or 100,000
+#   - Changing DENSITY_CELL_DEGREES needs the two tables dropped (they're then rebuilt)
+
+import json
+
+import numpy as np
+
+from helper_activity_types import WALKING_ACTIVITY_TYPES
+from helper_tracks import decode_points
+from walk_data_stats import STATS_CHUNK_WORKOUTS
+
+# ~100 m (north-south)
+DENSITY_CELL_DEGREES = 0.001
+
+# Most cells drawn on one heatmap
+MAX_DENSITY_CELLS = 20_000
+
+CREATE_DENSITY_TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS workout_points_density (
+    cell INTEGER PRIMARY KEY,
+    n_points INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS workout_points_density_workouts (
+    workout_id TEXT PRIMARY KEY REFERENCES workouts (id)
+);
+"""
+
+UPSERT_DENSITY_SQL = (
+    "INSERT INTO workout_points_density (cell, n_points) VALUES (?, ?) "
+    "ON CONFLICT (cell) DO UPDATE SET n_points = n_points + excluded.n_points"
+)
+
+
+def table_exists(conn, table):
+    return (
+        conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+        is not None
+    )
+
+
+def grid_columns(cell_degrees=DENSITY_CELL_DEGREES, factor=1):
+    # Columns in the grid, or in the grid coarsened by factor (a partial cell at the end)
+    return -(-round(360 / cell_degrees) // factor)
+
+
+def grid_cells(latitudes, longitudes, cell_degrees=DENSITY_CELL_DEGREES):
+    # The grid cell number of each point (points without a position are dropped)
+    located = np.isfinite(latitudes) & np.isfinite(longitudes)
+    rows = np.floor((latitudes[located] + 90) / cell_degrees).astype(np.int64)
+    columns = np.floor((longitudes[located] + 180) / cell_degrees).astype(np.int64)
+    n_columns = grid_columns(cell_degrees)
+    return rows * n_columns + np.clip(columns, 0, n_columns - 1)
+
+
+def cell_centres(cells, cell_degrees=DENSITY_CELL_DEGREES, factor=1):
+    # Latitude, longitude arrays of the centres of cells of a grid coarsened by factor
+    rows, columns = np.divmod(cells, grid_columns(cell_degrees, factor))
+    size = cell_degrees * factor
+    return rows * size - 90 + size / 2, columns * size - 180 + size / 2
+
+
+def coarsen_cells(cells, n_points, factor, cell_degrees=DENSITY_CELL_DEGREES):
+    # The cells (and their counts) of the grid with factor x factor cells merged
+    rows, columns = np.divmod(cells, grid_columns(cell_degrees))
+    coarse = (rows // factor) * grid_columns(cell_degrees, factor) + columns // factor
+    coarse, inverse = np.unique(coarse, return_inverse=True)
+    return coarse, np.bincount(inverse, weights=n_points).astype(np.int64)
+
+
+def heatmap_cells(cells, n_points, max_cells=MAX_DENSITY_CELLS):
+    # (latitudes, longitudes, n_points) of the cells, coarsened until there are at most
+    # max_cells of them
+    cells = np.asarray(cells, dtype=np.int64)
+    n_points = np.asarray(n_points, dtype=np.int64)
+    factor = 1
+    coarse, coarse_points = cells, n_points
+    while len(coarse) > max_cells:
+        factor *= 2
+        coarse, coarse_points = coarsen_cells(cells, n_points, factor)
+    latitudes, longitudes = cell_centres(coarse, factor=factor)
+    return latitudes, longitudes, coarse_points
+
+
+def read_density(conn):
+    # (cells, n_points) arrays of the stored grid (empty if it hasn't been built)
+    if not table_exists(conn, "workout_points_density"):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    rows = np.array(
+        conn.execute("SELECT cell, n_points FROM workout_points_density").fetchall(),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    return rows[:, 0], rows[:, 1]
+
+
+def iter_chunk_points(conn, workout_ids, chunk_workouts):
+    # Yields (workout ids, (n, 2) array of their latitudes, longitudes) a chunk of
+    # workouts at a time: from the compact tracks, and workout_points for any without
+    has_tracks = table_exists(conn, "workout_tracks")
+    for start in range(0, len(workout_ids), chunk_workouts):
+        chunk = workout_ids[start : start + chunk_workouts]
+        points = []
+        missing = set(chunk)
+        if has_tracks:
+            for workout_id, points_blob in conn.execute(
+                "SELECT workout_id, points FROM workout_tracks "
+                "WHERE workout_id IN (SELECT value FROM json_each(?))",
+                (json.dumps(chunk),),
+            ):
+                points.append(decode_points(points_blob))
+                missing.discard(workout_id)
+        if missing:
+            points.append(
+                np.array(
+                    conn.execute(
+                        "SELECT latitude, longitude FROM workout_points "
+                        "WHERE workout_id IN (SELECT value FROM json_each(?))",
+                        (json.dumps(sorted(missing)),),
+                    ).fetchall(),
+                    dtype=np.float64,
+                ).reshape(-1, 2)
+            )
+        # (float64 for the binning, as the compact tracks are float32)
+        yield chunk, np.concatenate(points, dtype=np.float64)
+
+
+def build_density_grid(db, workout_ids=None, chunk_workouts=STATS_CHUNK_WORKOUTS):
+    # Adds the points of the given walks (default: every walk not yet binned) to the
+    # density grid; other workouts are ignored. Workouts already binned are skipped, so
+    # their points are never counted twice. Returns the number of workouts added.
+    if "workout_points" not in db.table_names():
+        return 0
+    activity_types = json.dumps(WALKING_ACTIVITY_TYPES)
+    db.conn.executescript(CREATE_DENSITY_TABLES_SQL)
+    if workout_ids is None:
+        workout_ids = db.execute(
+            "SELECT id FROM workouts "
+            "WHERE workoutActivityType IN (SELECT value FROM json_each(?)) "
+            "AND id NOT IN (SELECT workout_id FROM workout_points_density_workouts)",
+            (activity_types,),
+        ).fetchall()
+    else:
+        workout_ids = db.execute(
+            "SELECT DISTINCT value FROM json_each(?) "
+            "WHERE value IN (SELECT id FROM workouts "
+            "WHERE workoutActivityType IN (SELECT value FROM json_each(?))) "
+            "AND value NOT IN (SELECT workout_id FROM workout_points_density_workouts)",
+            (json.dumps(list(workout_ids)), activity_types),
+        ).fetchall()
+    workout_ids = [row[0] for row in workout_ids]
+    for chunk, points in iter_chunk_points(db.conn, workout_ids, chunk_workouts):
+        cells, n_points = np.unique(
+            grid_cells(points[:, 0], points[:, 1]), return_counts=True
+        )
+        # The counts and the workouts binned are written together
+        with db.conn:
+            db.conn.executemany(UPSERT_DENSITY_SQL, zip(cells.tolist(), n_points.tolist()))
+            db.conn.executemany(
+                "INSERT INTO workout_points_density_workouts (workout_id) VALUES (?)",
+                ((workout_id,) for workout_id in chunk),
+            )
+    return len(workout_ids)
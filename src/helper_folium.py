@@ -1,7 +1,13 @@
 
 import folium
+import numpy as np
+from folium.plugins import HeatMap
 from streamlit_folium import folium_static
 
+from helper_simplify import simplify_track_for_zoom, zoom_for_bounds
+
+WALK_MAP_SIZE = (550, 300)
+
 
 def create_tooltip(workout_info):
     try:
@@ -26,15 +32,77 @@ def plot_walk_points(walk_points, map_handle, linecolour, linewidth, workout_inf
     create_marker(walk_points[0][0], walk_points[0][1], workout_info, map_handle)
 
 
-def create_walk_map_handle(query_df, map_handle, workout_info):
-    plot_walk_points(query_df.values, map_handle, "blue", 3, workout_info)
+# walk_points: (n, 2) array (or DataFrame) of latitude, longitude. The track is simplified
+# for the zoom the map will be displayed at (by default the zoom which fits the track)
+# before it is added, which keeps the HTML embedded by folium_static small.
+
+
+def create_walk_map_handle(walk_points, map_handle, workout_info, zoom=None):
+    walk_points = np.asarray(walk_points, dtype=np.float64)
+    if zoom is None:
+        zoom = zoom_for_bounds(walk_points[:, 0], walk_points[:, 1], *WALK_MAP_SIZE)
+    plot_walk_points(
+        simplify_track_for_zoom(walk_points, zoom), map_handle, "blue", 3, workout_info
+    )
+
+
+def create_walk_map(walk_points, workout_info, zoom=None):
+    create_walks_map([walk_points], [workout_info], zoom)
+
 
+# Several walks on one map, each simplified for the same zoom (by default the zoom which
+# fits all of them)
 
-def create_walk_map(query_df, workout_info):
+
+def create_walks_map(walks_points, workout_infos, zoom=None):
+    walks_points = [np.asarray(walk_points, dtype=np.float64) for walk_points in walks_points]
+    if zoom is None:
+        all_points = np.concatenate(walks_points)
+        zoom = zoom_for_bounds(all_points[:, 0], all_points[:, 1], *WALK_MAP_SIZE)
     start_coord = (0, 0)
     map_handle = folium.Map(
         start_coord, zoom_start=13, detect_retina=True, control_scale=True
     )
-    plot_walk_points(query_df.values, map_handle, "blue", 3, workout_info)
+    for walk_points, workout_info in zip(walks_points, workout_infos):
+        create_walk_map_handle(walk_points, map_handle, workout_info, zoom)
     map_handle.fit_bounds(map_handle.get_bounds())
-    folium_static(map_handle, width=550, height=300)
\ No newline at end of file
+    folium_static(map_handle, width=WALK_MAP_SIZE[0], height=WALK_MAP_SIZE[1])
+
+
+# A walk group's cached GeoJSON layer (see helper_map_cache): tracks drawn and start
+# markers placed as create_walk_map_handle does for a single walk
+
+
+def add_group_layer(map_handle, layer):
+    folium.GeoJson(
+        layer,
+        style_function=lambda feature: {"color": "blue", "weight": 3},
+        marker=folium.Marker(icon=folium.Icon(icon="play-circle", size=10)),
+        tooltip=folium.GeoJsonTooltip(fields=["uuid"], labels=False),
+    ).add_to(map_handle)
+    if "bbox" in layer:
+        min_longitude, min_latitude, max_longitude, max_latitude = layer["bbox"]
+        map_handle.fit_bounds([[min_latitude, min_longitude], [max_latitude, max_longitude]])
+
+
+# The density grid of every walk (see helper_density) as one heatmap layer: a point per
+# cell, weighted by the log of its number of points so the most walked streets don't
+# drown out the rest
+
+
+def add_density_layer(map_handle, latitudes, longitudes, n_points):
+    if len(n_points) == 0:
+        return
+    weights = np.log1p(n_points) / np.log1p(np.max(n_points))
+    HeatMap(
+        np.column_stack(
+            [np.round(latitudes, 5), np.round(longitudes, 5), np.round(weights, 3)]
+        ).tolist(),
+        name="All walks",
+        radius=8,
+        blur=6,
+        min_opacity=0.3,
+    ).add_to(map_handle)
+    map_handle.fit_bounds(
+        [[np.min(latitudes), np.min(longitudes)], [np.max(latitudes), np.max(longitudes)]]
+    )
@@ -0,0 +1,89 @@
+# Batched reverse geocoding with a persistent location cache
+#
+# All coordinates are looked up with a single call to reverse_geocode.search (one
+# KD-tree query for the lot) and the results kept in an on-disk cache keyed by the
+# rounded latitude/longitude, so repeat summaries (and the many walks which start at
+# the same front door) skip geocoding entirely.
+#
+# A miss is geocoded at the actual coordinate (the first one seen for its key), so a
+# lookup gives the same location as reverse_geocode.search would. A later coordinate
+# with the same key (within ~50 m) gets that cached location, which differs only if
+# the two are either side of the boundary between two places.
+
+import json
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+LOCATION_CACHE_FILE = Path(__file__).parent.parent / "data" / "location_cache.json"
+
+# 3 decimal places is ~100 m - well below the resolution of a city lookup
+LOCATION_CACHE_PRECISION = 3
+LOCATION_CACHE_MAX_ENTRIES = 100_000
+
+
+class LocationCache:
+    # Least recently used entries are evicted once there are more than max_entries
+    def __init__(
+        self,
+        cache_file=LOCATION_CACHE_FILE,
+        precision=LOCATION_CACHE_PRECISION,
+        max_entries=LOCATION_CACHE_MAX_ENTRIES,
+    ):
+        self.cache_file = Path(cache_file) if cache_file is not None else None
+        self.precision = precision
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        if self.cache_file is not None and self.cache_file.exists():
+            with open(self.cache_file, "r") as f:
+                self.entries.update(json.load(f))
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def keys(self, latitudes, longitudes):
+        latitudes = np.round(np.asarray(latitudes, dtype=np.float64), self.precision)
+        longitudes = np.round(np.asarray(longitudes, dtype=np.float64), self.precision)
+        return [
+            f"{latitude:.{self.precision}f},{longitude:.{self.precision}f}"
+            for latitude, longitude in zip(latitudes, longitudes)
+        ]
+
+    def lookup(self, latitudes, longitudes):
+        # Returns the reverse_geocode location (dict) for each coordinate
+        keys = self.keys(latitudes, longitudes)
+        n_misses = sum(key not in self.entries for key in keys)
+        self.misses += n_misses
+        self.hits += len(keys) - n_misses
+        missing = {}
+        for key, latitude, longitude in zip(keys, latitudes, longitudes):
+            if key not in self.entries and key not in missing:
+                missing[key] = (float(latitude), float(longitude))
+        if missing:
+            # Imported here as loading reverse_geocode builds its KD-tree (slow), which
+            # isn't needed at all when everything is already cached
+            import reverse_geocode as rg
+
+            self.entries.update(zip(missing, rg.search(list(missing.values()))))
+        for key in dict.fromkeys(keys):
+            self.entries.move_to_end(key)
+        locations = [self.entries[key] for key in keys]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return locations
+
+    def save(self):
+        if self.cache_file is None:
+            return
+        tmp_file = self.cache_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(self.entries, f)
+        tmp_file.replace(self.cache_file)
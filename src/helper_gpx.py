@@ -0,0 +1,124 @@
+# Streaming GPX parsing into columnar (NumPy) arrays
+#
+# Used both for the workout-routes/*.gpx files inside a HealthKit export.zip and for
+# stand alone GPX files. A bare expat parser is used (no element tree is built), so
+# memory use doesn't grow with the size of the XML beyond the output arrays.
+#
+# Stand alone files (the GPX viewer) are read through cached_gpx_track, which keeps the
+# parsed arrays, and the track simplified for each zoom it has been drawn at, until the
+# file changes.
+
+import os
+from functools import lru_cache
+from xml.parsers import expat
+
+import numpy as np
+
+from helper_simplify import simplify_track_for_zoom
+
+READ_CHUNK_BYTES = 1024 * 1024
+
+CACHED_GPX_TRACKS = 64
+
+# GPX <trkpt> child element -> workout_points column
+GPX_POINT_FIELDS = {
+    "time": "date",
+    "ele": "altitude",
+    "hAcc": "horizontalAccuracy",
+    "vAcc": "verticalAccuracy",
+    "course": "course",
+    "speed": "speed",
+}
+
+FLOAT_COLUMNS = [
+    "latitude",
+    "longitude",
+    "altitude",
+    "horizontalAccuracy",
+    "verticalAccuracy",
+    "course",
+    "speed",
+]
+
+
+def gpx_points_to_arrays(fp):
+    # Returns {"date": str array, <FLOAT_COLUMNS>: float64 arrays (NaN where missing)}.
+    # Values are collected as text (a placeholder is appended for every field when a
+    # <trkpt> starts and overwritten if the field is present) and converted in bulk.
+    columns = {column: [] for column in ["date"] + FLOAT_COLUMNS}
+    field = None
+    text = []
+
+    def start_element(tag, attrs):
+        nonlocal field
+        tag = tag.rsplit(":", 1)[-1]
+        if tag == "trkpt":
+            columns["latitude"].append(attrs["lat"])
+            columns["longitude"].append(attrs["lon"])
+            columns["date"].append("")
+            for column in FLOAT_COLUMNS[2:]:
+                columns[column].append("nan")
+        else:
+            field = GPX_POINT_FIELDS.get(tag)
+            text.clear()
+
+    def end_element(tag):
+        nonlocal field
+        if field is not None and columns["latitude"]:
+            columns[field][-1] = "".join(text).strip() or columns[field][-1]
+        field = None
+
+    def character_data(data):
+        if field is not None:
+            text.append(data)
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    while chunk := fp.read(READ_CHUNK_BYTES):
+        parser.Parse(chunk, False)
+    parser.Parse(b"", True)
+
+    arrays = {"date": np.array(columns["date"], dtype=str)}
+    for column in FLOAT_COLUMNS:
+        arrays[column] = np.array(columns[column], dtype=np.float64)
+    return arrays
+
+
+def read_gpx_file(path):
+    with open(path, "rb") as fp:
+        return gpx_points_to_arrays(fp)
+
+
+def gpx_file_signature(path):
+    # Changes whenever the file is rewritten
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+@lru_cache(maxsize=CACHED_GPX_TRACKS)
+def _cached_gpx_track(path, signature):
+    return read_gpx_file(path)
+
+
+@lru_cache(maxsize=CACHED_GPX_TRACKS)
+def _cached_simplified_track(path, signature, zoom):
+    arrays = _cached_gpx_track(path, signature)
+    points = np.column_stack([arrays["latitude"], arrays["longitude"]])
+    return simplify_track_for_zoom(points[~np.isnan(points).any(axis=1)], zoom)
+
+
+def cached_gpx_track(path):
+    # read_gpx_file(path), memoised on the path and the file's mtime/size. The arrays
+    # are shared between callers, so must not be modified.
+    path = os.path.abspath(path)
+    return _cached_gpx_track(path, gpx_file_signature(path))
+
+
+def cached_simplified_track(path, zoom):
+    # (n, 2) array of the latitude, longitude of the track simplified for zoom (see
+    # helper_simplify), memoised as cached_gpx_track
+    path = os.path.abspath(path)
+    return _cached_simplified_track(path, gpx_file_signature(path), zoom)
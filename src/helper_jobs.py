@@ -0,0 +1,474 @@
+# Background jobs: the long running conversion, GPX import and summary, run outside
+# the Streamlit script so that a rerun or switching page never blocks on (or kills) them
+#
+#   - Jobs are recorded in a SQLite job store (data/jobs.sqlite) and run in a process
+#     pool owned by the Streamlit server process; the pages submit them and poll the
+#     store for their status, stage and progress
+#   - A job runs as a sequence of named stages. The stages completed (and what they
+#     produced) are saved as the job goes, so a failed, cancelled or interrupted (server
+#     restarted) job resumes from the first stage not completed
+#   - Cancelling is cooperative: the job stops at its next progress update or stage
+#   - Each job has a key (e.g. the export.zip it converts): a unique index on the keys of
+#     the queued and running jobs stops two jobs with the same key running at once
+#   - The modules the jobs run (walk_data_aux: pandas, pendulum, reverse_geocode etc.)
+#     are imported by the job functions in the worker processes, not by the pages
+
+import datetime as dt
+import json
+import os
+import sqlite3
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import Path
+
+JOB_STORE_FILE = Path(__file__).parent.parent / "data" / "jobs.sqlite"
+
+# Jobs run at once (the conversion parses routes across all cores itself)
+JOB_WORKERS = 2
+# Seconds to wait for another process's transaction to finish
+JOB_STORE_TIMEOUT = 30
+# Seconds between the pages' polls of a job's progress
+JOB_POLL_SECONDS = 1.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+INTERRUPTED = "interrupted"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+RESUMABLE_STATUSES = (FAILED, CANCELLED, INTERRUPTED)
+
+CREATE_JOB_TABLES_SQL = f"""
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress REAL,
+    message TEXT,
+    state TEXT NOT NULL DEFAULT '{{}}',
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    runner_pid INTEGER,
+    worker_pid INTEGER,
+    created_at TEXT,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_key
+    ON jobs (key) WHERE status IN ('{QUEUED}', '{RUNNING}');
+CREATE INDEX IF NOT EXISTS idx_jobs_key ON jobs (key, id);
+"""
+
+
+class JobAlreadyActive(Exception):
+    # A job with the same key is already queued or running
+    def __init__(self, job):
+        super().__init__(f"{job.kind} job {job.id} is already {job.status} for {job.key}")
+        self.job = job
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    id: int
+    kind: str
+    key: str
+    params: dict
+    status: str
+    stage: str
+    progress: float
+    message: str
+    state: dict  # stages_done, and what the stages produced (e.g. the database file)
+    error: str
+    cancel_requested: bool
+    created_at: str
+    finished_at: str
+
+    @property
+    def active(self):
+        return self.status in ACTIVE_STATUSES
+
+    @property
+    def resumable(self):
+        return self.status in RESUMABLE_STATUSES
+
+
+JOB_COLUMNS = (
+    "id, kind, key, params, status, stage, progress, message, state, error, "
+    "cancel_requested, created_at, finished_at"
+)
+
+
+def now():
+    return dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds")
+
+
+def open_job_store(store_file=JOB_STORE_FILE):
+    # Shared by the Streamlit script threads, and written by the job processes
+    conn = sqlite3.connect(store_file, timeout=JOB_STORE_TIMEOUT, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.executescript(CREATE_JOB_TABLES_SQL)
+    return conn
+
+
+def job_from_row(row):
+    row = list(row)
+    row[3] = json.loads(row[3])
+    row[8] = json.loads(row[8])
+    row[10] = bool(row[10])
+    return Job(*row)
+
+
+def read_job(conn, job_id):
+    row = conn.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return job_from_row(row) if row is not None else None
+
+
+def latest_job(conn, key):
+    # The most recent job with the key (None if there has been none)
+    row = conn.execute(
+        f"SELECT {JOB_COLUMNS} FROM jobs WHERE key = ? ORDER BY id DESC LIMIT 1", (key,)
+    ).fetchone()
+    return job_from_row(row) if row is not None else None
+
+
+def insert_job(conn, kind, key, params):
+    # The new job's id; JobAlreadyActive if a job with the key is queued or running
+    try:
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, key, params, status, runner_pid, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, key, json.dumps(params), QUEUED, os.getpid(), now()),
+            )
+    except sqlite3.IntegrityError:
+        raise JobAlreadyActive(latest_job(conn, key)) from None
+    return cursor.lastrowid
+
+
+def requeue_job(conn, job_id):
+    # A failed, cancelled or interrupted job queued to resume (keeping its state)
+    try:
+        with conn:
+            updated = conn.execute(
+                "UPDATE jobs SET status = ?, error = NULL, cancel_requested = 0, "
+                "runner_pid = ?, finished_at = NULL WHERE id = ? AND status IN (?, ?, ?)",
+                (QUEUED, os.getpid(), job_id, *RESUMABLE_STATUSES),
+            ).rowcount
+    except sqlite3.IntegrityError:
+        job = read_job(conn, job_id)
+        raise JobAlreadyActive(latest_job(conn, job.key)) from None
+    return updated == 1
+
+
+def request_cancel(conn, job_id):
+    # A queued job is cancelled at once, a running one at its next progress update
+    with conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+            (CANCELLED, now(), job_id, QUEUED),
+        )
+        conn.execute(
+            "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?",
+            (job_id, RUNNING),
+        )
+
+
+def finish_job(conn, job_id, status, error=None):
+    with conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, error, now(), job_id),
+        )
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def mark_interrupted_jobs(conn):
+    # Queued and running jobs whose server process has gone (e.g. it was restarted) will
+    # never finish: marked interrupted, so they can be resumed
+    rows = conn.execute(
+        "SELECT id, runner_pid FROM jobs WHERE status IN (?, ?)", ACTIVE_STATUSES
+    ).fetchall()
+    for job_id, runner_pid in rows:
+        if runner_pid is None or not process_exists(runner_pid):
+            finish_job(conn, job_id, INTERRUPTED)
+
+
+class JobContext:
+    # Passed to a job function: records its stages and progress, and raises JobCancelled
+    # (from stage() or progress()) once the job has been cancelled
+    def __init__(self, conn, job):
+        self.conn = conn
+        self.job = job
+        self.state = job.state
+        self.state.setdefault("stages_done", [])
+
+    def check_cancelled(self):
+        row = self.conn.execute(
+            "SELECT cancel_requested FROM jobs WHERE id = ?", (self.job.id,)
+        ).fetchone()
+        if row[0]:
+            raise JobCancelled()
+
+    def stage(self, name):
+        # True if the stage is to be run, False if it was completed by an earlier run
+        self.check_cancelled()
+        if name in self.state["stages_done"]:
+            return False
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET stage = ?, progress = NULL, message = NULL WHERE id = ?",
+                (name, self.job.id),
+            )
+        return True
+
+    def progress(self, fraction=None, message=None):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET progress = ?, message = ? WHERE id = ?",
+                (fraction, message, self.job.id),
+            )
+        self.check_cancelled()
+
+    def stage_done(self, name, **produced):
+        self.state.update(produced)
+        self.state["stages_done"].append(name)
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET progress = 1.0, state = ? WHERE id = ?",
+                (json.dumps(self.state), self.job.id),
+            )
+
+
+# Job functions: fn(job context, **params), returning once every stage is done
+
+
+def convert_export_job(
+    job,
+    export_zip,
+    activity_types=None,
+    previous_db_file=None,
+    parquet=False,
+    workers=None,
+    compact_tracks=False,
+):
+    from walk_data_aux import convert_healthkit_export_to_sqlite, export_sqlite_to_parquet
+
+    def show_progress(stats):
+        job.progress(
+            stats.fraction_done,
+            f"{stats.bytes_read / 1e6:,.0f} / {stats.bytes_total / 1e6:,.0f} MB read - "
+            f"{stats.workouts:,} new workouts ({stats.workouts_skipped:,} already ingested), "
+            f"{stats.points:,} points, {stats.records:,} records "
+            f"({stats.rows_per_second:,.0f} rows/s)"
+            + (f" - {stats.stage}" if stats.stage else ""),
+        )
+
+    if job.stage("convert"):
+        db_file, zip_file = convert_healthkit_export_to_sqlite(
+            Path(export_zip),
+            progress_callback=show_progress,
+            activity_types=activity_types,
+            previous_db_file=previous_db_file,
+            workers=workers,
+            compact_tracks=compact_tracks,
+        )
+        if db_file is None:
+            raise FileNotFoundError(zip_file)
+        job.stage_done("convert", db_file=Path(db_file).as_posix(), zip_file=zip_file)
+    if parquet and job.stage("parquet"):
+        export_sqlite_to_parquet(job.state["db_file"])
+        job.stage_done("parquet")
+
+
+def workout_summary_job(job, db_file, output_file, parquet=False):
+    from helper_geocode import LocationCache
+    from helper_parquet import parquet_store_path
+    from walk_data_aux import create_walk_workout_summary, export_sqlite_to_parquet
+
+    source = db_file
+    if parquet:
+        source = parquet_store_path(db_file)
+        if job.stage("parquet"):
+            if not source.exists():
+                export_sqlite_to_parquet(db_file)
+            job.stage_done("parquet")
+    if job.stage("summary"):
+        location_cache = LocationCache()
+        output_file = create_walk_workout_summary(
+            source, output_file=output_file, location_cache=location_cache
+        )
+        if output_file is None:
+            raise FileNotFoundError(source)
+        job.stage_done(
+            "summary",
+            output_file=Path(output_file).as_posix(),
+            location_cache_hits=location_cache.hits,
+            location_cache_misses=location_cache.misses,
+            location_cache_entries=len(location_cache),
+        )
+
+
+def gpx_import_job(job, source, db_file, parquet=False, workers=None):
+    from walk_data_aux import export_sqlite_to_parquet
+    from walk_data_gpx_import import import_gpx_files
+
+    def show_progress(stats):
+        job.progress(
+            stats.fraction_done,
+            f"{stats.routes:,} / {stats.routes_total:,} files - "
+            f"{stats.workouts:,} new walks ({stats.workouts_skipped:,} already imported), "
+            f"{stats.points:,} points ({stats.files_per_second:,.0f} files/s, "
+            f"{stats.points_per_second:,.0f} points/s)"
+            + (f" - {stats.stage}" if stats.stage else ""),
+        )
+
+    if job.stage("import"):
+        stats = import_gpx_files(
+            source, db_file, progress_callback=show_progress, workers=workers
+        )
+        job.stage_done(
+            "import",
+            workouts=stats.workouts,
+            workouts_skipped=stats.workouts_skipped,
+            files_failed=[list(failed) for failed in stats.files_failed],
+        )
+    if parquet and job.state["workouts"] > 0 and job.stage("parquet"):
+        export_sqlite_to_parquet(db_file)
+        job.stage_done("parquet")
+
+
+JOB_FUNCTIONS = {
+    "convert": convert_export_job,
+    "summary": workout_summary_job,
+    "import": gpx_import_job,
+}
+
+
+def run_job(store_file, job_id):
+    # Runs in a worker process of the JobRunner's pool
+    conn = open_job_store(store_file)
+    try:
+        with conn:
+            started = conn.execute(
+                "UPDATE jobs SET status = ?, worker_pid = ?, started_at = ? "
+                "WHERE id = ? AND status = ?",
+                (RUNNING, os.getpid(), now(), job_id, QUEUED),
+            ).rowcount
+        if not started:  # cancelled while queued
+            return
+        job = read_job(conn, job_id)
+        try:
+            JOB_FUNCTIONS[job.kind](JobContext(conn, job), **job.params)
+        except JobCancelled:
+            finish_job(conn, job_id, CANCELLED)
+        except Exception as e:
+            finish_job(conn, job_id, FAILED, f"{e}\n\n{traceback.format_exc()}")
+        else:
+            finish_job(conn, job_id, DONE)
+    finally:
+        conn.close()
+
+
+class JobRunner:
+    # The process pool running the jobs of this (server) process, and its connection to
+    # the job store. The connection is shared by the Streamlit script threads and the
+    # thread running the futures' done callbacks: self.lock serialises its use (and the
+    # pool's), so their transactions never interleave.
+    def __init__(self, store_file=JOB_STORE_FILE, workers=JOB_WORKERS):
+        self.store_file = Path(store_file).as_posix()
+        self.workers = workers
+        self.conn = open_job_store(self.store_file)
+        self.lock = threading.RLock()
+        self.executor = None
+        with self.lock:
+            mark_interrupted_jobs(self.conn)
+
+    def start(self, job_id):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            future = self.executor.submit(run_job, self.store_file, job_id)
+        future.add_done_callback(lambda future: self.job_ended(job_id, future))
+
+    def job_ended(self, job_id, future):
+        # run_job records how the job ended, unless its worker process died (e.g. killed
+        # for running out of memory), which breaks the pool: a new one is started
+        if future.cancelled() or future.exception() is None:
+            return
+        with self.lock:
+            finish_job(
+                self.conn, job_id, FAILED, f"The job could not be run: {future.exception()!r}"
+            )
+            if isinstance(future.exception(), BrokenProcessPool):
+                self.executor = None
+
+    def submit(self, kind, key, params):
+        # The new job's id; JobAlreadyActive if a job with the key is queued or running
+        with self.lock:
+            job_id = insert_job(self.conn, kind, key, params)
+        self.start(job_id)
+        return job_id
+
+    def resume(self, job_id):
+        with self.lock:
+            requeued = requeue_job(self.conn, job_id)
+        if requeued:
+            self.start(job_id)
+
+    def cancel(self, job_id):
+        with self.lock:
+            request_cancel(self.conn, job_id)
+
+    def job(self, job_id):
+        with self.lock:
+            return read_job(self.conn, job_id)
+
+    def latest_job(self, key):
+        with self.lock:
+            return latest_job(self.conn, key)
+
+
+_job_runner = None
+_job_runner_lock = threading.Lock()
+
+
+def job_runner():
+    # One per server process (the Streamlit script is rerun, but modules imported once)
+    global _job_runner
+    with _job_runner_lock:
+        if _job_runner is None:
+            _job_runner = JobRunner()
+        return _job_runner
+
+
+def conversion_job_key(export_zip):
+    return "convert:" + Path(export_zip).resolve().as_posix()
+
+
+def summary_job_key(output_file):
+    return "summary:" + Path(output_file).resolve().as_posix()
+
+
+def gpx_import_job_key(db_file):
+    # One import into a database at a time
+    return "import:" + Path(db_file).resolve().as_posix()
@@ -0,0 +1,133 @@
+# Label store: the walk group assigned to each workout, in SQLite (data/walk_labels.sqlite)
+#
+#   - One row per workout (uuid primary key), with its start date/time and distance from
+#     the workouts summary; walk_group is NULL until the workout is labelled
+#   - Saving a label is a single transaction, so concurrent sessions can't corrupt it
+#   - The next workout to label is the first unlabelled one in start order: a seek on a
+#     partial index of just the unlabelled workouts, however many are already labelled
+#   - A data/workouts_labelled.csv (as previously used) is imported when the store is
+#     first created, or at any time with import_labels_csv()
+
+import datetime as dt
+import json
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+LABEL_STORE_FILE = Path(__file__).parent.parent / "data" / "walk_labels.sqlite"
+LABELS_CSV = Path(__file__).parent.parent / "data" / "workouts_labelled.csv"
+
+# Seconds to wait for another session's transaction to finish
+LABEL_STORE_TIMEOUT = 30
+
+CREATE_LABEL_TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS workout_labels (
+    uuid TEXT PRIMARY KEY,
+    start_datetime TEXT,
+    totaldistance_km REAL,
+    walk_group TEXT,
+    labelled_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_workout_labels_walk_group
+    ON workout_labels (walk_group);
+CREATE INDEX IF NOT EXISTS idx_workout_labels_unlabelled
+    ON workout_labels (start_datetime, totaldistance_km) WHERE walk_group IS NULL;
+"""
+
+UPSERT_LABEL_SQL = (
+    "INSERT INTO workout_labels (uuid, walk_group, labelled_at) VALUES (?, ?, ?) "
+    "ON CONFLICT (uuid) DO UPDATE SET "
+    "walk_group = excluded.walk_group, labelled_at = excluded.labelled_at"
+)
+
+UPSERT_WORKOUT_SQL = (
+    "INSERT INTO workout_labels (uuid, start_datetime, totaldistance_km) VALUES (?, ?, ?) "
+    "ON CONFLICT (uuid) DO UPDATE SET "
+    "start_datetime = excluded.start_datetime, totaldistance_km = excluded.totaldistance_km"
+)
+
+# Only workouts in the current summary have a start_datetime. The planner would
+# otherwise pick the walk_group index (then sort), so the partial index is named.
+NEXT_UNLABELLED_SQL = (
+    "SELECT uuid FROM workout_labels INDEXED BY idx_workout_labels_unlabelled "
+    "WHERE walk_group IS NULL AND start_datetime IS NOT NULL AND totaldistance_km >= ? "
+    "ORDER BY start_datetime LIMIT 1"
+)
+# The same, of the given uuids (a JSON array)
+NEXT_UNLABELLED_OF_SQL = (
+    "SELECT uuid FROM workout_labels INDEXED BY idx_workout_labels_unlabelled "
+    "WHERE walk_group IS NULL AND start_datetime IS NOT NULL AND totaldistance_km >= ? "
+    "AND uuid IN (SELECT value FROM json_each(?)) "
+    "ORDER BY start_datetime LIMIT 1"
+)
+
+
+def open_label_store(store_file=LABEL_STORE_FILE, labels_csv=LABELS_CSV):
+    new_store = not Path(store_file).exists()
+    # Shared by the Streamlit script threads (each rerun runs in a thread of its own)
+    conn = sqlite3.connect(
+        store_file, timeout=LABEL_STORE_TIMEOUT, check_same_thread=False
+    )
+    conn.executescript(CREATE_LABEL_TABLES_SQL)
+    if new_store and labels_csv is not None and Path(labels_csv).exists():
+        import_labels_csv(conn, labels_csv)
+    return conn
+
+
+def import_labels_csv(conn, labels_csv=LABELS_CSV):
+    # uuid,walk_group lines - where a workout was labelled more than once the last wins
+    labels_df = pd.read_csv(labels_csv, dtype=str).dropna()
+    save_labels(conn, zip(labels_df["uuid"], labels_df["walk_group"]))
+    return len(labels_df)
+
+
+def save_labels(conn, labels):
+    labelled_at = dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds")
+    with conn:
+        conn.executemany(
+            UPSERT_LABEL_SQL,
+            ((uuid, walk_group, labelled_at) for uuid, walk_group in labels),
+        )
+
+
+def save_label(conn, uuid, walk_group):
+    save_labels(conn, [(uuid, walk_group)])
+
+
+def sync_summary_workouts(conn, data_df):
+    # Records the start and distance of the workouts in the (new) summary, which order
+    # and filter the workouts to label; labels of workouts no longer in it are kept
+    rows = zip(
+        data_df["uuid"].astype(str),
+        data_df["start_datetime"].astype(str),
+        data_df["totaldistance_km"].astype(float),
+    )
+    with conn:
+        conn.execute(
+            "UPDATE workout_labels SET start_datetime = NULL, totaldistance_km = NULL "
+            "WHERE start_datetime IS NOT NULL"
+        )
+        conn.executemany(UPSERT_WORKOUT_SQL, rows)
+
+
+def next_unlabelled_workout(conn, min_distance_km=0, uuids=None):
+    # uuid of the earliest unlabelled workout of at least min_distance_km (None if done),
+    # of the given uuids if any: the store is shared by every session, and another one
+    # may have synced it with a different summary
+    if uuids is None:
+        row = conn.execute(NEXT_UNLABELLED_SQL, (min_distance_km,)).fetchone()
+    else:
+        row = conn.execute(
+            NEXT_UNLABELLED_OF_SQL, (min_distance_km, json.dumps(list(uuids)))
+        ).fetchone()
+    return row[0] if row is not None else None
+
+
+def read_labels(conn):
+    # As workouts_labelled.csv: uuid, walk_group in the order labelled
+    return pd.read_sql_query(
+        "SELECT uuid, walk_group FROM workout_labels WHERE walk_group IS NOT NULL "
+        "ORDER BY labelled_at, rowid",
+        conn,
+    )
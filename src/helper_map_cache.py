@@ -0,0 +1,138 @@
+# Cache of the map layer (GeoJSON) of each labelled walk group
+#
+#   - The tracks of a group (simplified for the zoom the group map is shown at) and the
+#     start of each walk are built into one GeoJSON FeatureCollection, stored gzipped as
+#     data/map_cache/<group>-<fingerprint>.geojson.gz
+#   - The fingerprint is a hash of the group's labelled workouts and the track source, so
+#     labelling a walk into (or out of) the group, or converting a new database,
+#     invalidates it
+#   - Showing a group is then a read of one small compressed file, rather than querying
+#     the points and building a folium PolyLine and Marker per walk
+
+import gzip
+import hashlib
+import json
+import re
+import time
+from pathlib import Path
+
+import numpy as np
+
+from helper_simplify import simplify_track_for_zoom
+
+MAP_CACHE_DIR = Path(__file__).parent.parent / "data" / "map_cache"
+
+# Part of every fingerprint: bump when the layer format changes
+MAP_CACHE_VERSION = 2
+
+# ~0.1 m
+COORDINATE_DECIMALS = 6
+
+
+def group_fingerprint(group_df, track_source):
+    fingerprint = hashlib.sha1(f"{MAP_CACHE_VERSION}|{track_source}".encode())
+    for uuid, workout_id in sorted(
+        zip(group_df["uuid"].astype(str), group_df["workout_id"].astype(str))
+    ):
+        fingerprint.update(f"|{uuid},{workout_id}".encode())
+    return fingerprint.hexdigest()[:16]
+
+
+def build_group_layer(group_df, tracks, zoom):
+    # tracks: {workout_id: (n, 2) array of latitude, longitude}. Each walk is a LineString
+    # (GeoJSON is longitude, latitude) and a Point at its start.
+    features = []
+    coordinates_by_walk = []
+    for uuid, workout_id in zip(group_df["uuid"].astype(str), group_df["workout_id"]):
+        track = tracks.get(workout_id)
+        if track is None or len(track) == 0:
+            continue
+        coordinates = np.round(
+            simplify_track_for_zoom(track, zoom)[:, ::-1], COORDINATE_DECIMALS
+        )
+        coordinates_by_walk.append(coordinates)
+        properties = {"uuid": uuid}
+        if len(coordinates) > 1:
+            features.append(
+                {
+                    "type": "Feature",
+                    "geometry": {"type": "LineString", "coordinates": coordinates.tolist()},
+                    "properties": properties,
+                }
+            )
+        features.append(
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": coordinates[0].tolist()},
+                "properties": properties,
+            }
+        )
+    layer = {"type": "FeatureCollection", "features": features}
+    if coordinates_by_walk:
+        coordinates = np.concatenate(coordinates_by_walk)
+        layer["bbox"] = [*coordinates.min(axis=0).tolist(), *coordinates.max(axis=0).tolist()]
+    return layer
+
+
+def layer_points(layer):
+    # Number of track points drawn by the layer
+    return sum(
+        len(feature["geometry"]["coordinates"])
+        for feature in layer["features"]
+        if feature["geometry"]["type"] == "LineString"
+    )
+
+
+class GroupLayerCache:
+    def __init__(self, cache_dir=MAP_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.hits = 0
+        self.misses = 0
+        self.last_build_seconds = None
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def files(self):
+        return list(self.cache_dir.glob("*.geojson.gz"))
+
+    def __len__(self):
+        return len(self.files())
+
+    def size_bytes(self):
+        return sum(file.stat().st_size for file in self.files())
+
+    def group_prefix(self, walk_group):
+        # A readable, file name safe, version of the group plus a hash of it (so groups
+        # which differ only in unsafe characters don't collide)
+        walk_group = str(walk_group)
+        safe_name = re.sub(r"[^A-Za-z0-9_]", "_", walk_group)
+        return f"{safe_name}-{hashlib.sha1(walk_group.encode()).hexdigest()[:8]}"
+
+    def get(self, walk_group, fingerprint, build):
+        # The group's layer, from the cache or (after removing the group's stale layers)
+        # made by build() and cached
+        prefix = self.group_prefix(walk_group)
+        path = self.cache_dir / f"{prefix}-{fingerprint}.geojson.gz"
+        if path.exists():
+            self.hits += 1
+            with gzip.open(path, "rt") as f:
+                return json.load(f)
+        self.misses += 1
+        start = time.perf_counter()
+        layer = build()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        for stale_path in self.cache_dir.glob(f"{prefix}-*.geojson.gz"):
+            stale_path.unlink(missing_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with gzip.open(tmp_path, "wt", compresslevel=6) as f:
+            json.dump(layer, f, separators=(",", ":"))
+        tmp_path.replace(path)
+        self.last_build_seconds = time.perf_counter() - start
+        return layer
+
+
+# Imported once per Streamlit server process, so the statistics accumulate over reruns
+GROUP_LAYER_CACHE = GroupLayerCache()
@@ -0,0 +1,145 @@
+# Columnar (Parquet) store of the workout points - an alternative backend to SQLite
+#
+#   - One Parquet file per month (of the workout start date):
+#     <store>/month=YYYY-MM/points.parquet, sorted by workout_id then date and written
+#     with one row group per workout, so a read filtered on workout_id only decodes that
+#     workout's row group (predicate pushdown on the row group statistics)
+#   - The workouts in each file (their row in the workouts table and their start/finish
+#     points) are kept as JSON in the schema metadata, so the index of which file holds
+#     which workout, and the workouts summary, come from the file footers alone
+#   - Files are read memory-mapped
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PARTITION_FILE_NAME = "points.parquet"
+WORKOUTS_METADATA_KEY = b"workouts"
+ENDPOINTS_METADATA_KEY = b"workout_endpoints"
+
+POINTS_SCHEMA = pa.schema(
+    [
+        ("date", pa.string()),
+        ("latitude", pa.float64()),
+        ("longitude", pa.float64()),
+        ("altitude", pa.float64()),
+        ("horizontalAccuracy", pa.float64()),
+        ("verticalAccuracy", pa.float64()),
+        ("course", pa.float64()),
+        ("speed", pa.float64()),
+        ("workout_id", pa.string()),
+    ]
+)
+
+
+def parquet_store_path(db_file):
+    # data/healthkit_db_2023_03_10.sqlite -> data/healthkit_db_2023_03_10.parquet (a directory)
+    return Path(db_file).with_suffix(".parquet")
+
+
+def partition_path(store_dir, month):
+    return Path(store_dir) / f"month={month}" / PARTITION_FILE_NAME
+
+
+def json_value(value):
+    # NumPy scalars (e.g. int64) json.dumps doesn't know
+    return value.item() if isinstance(value, np.generic) else str(value)
+
+
+def records_to_json(df):
+    # NaN / None -> null, so the metadata is plain JSON. json.dumps writes floats in
+    # full (DataFrame.to_json rounds them to 10 significant digits), so the start/finish
+    # points read back are those in the database.
+    records = df.astype(object).where(df.notna(), None).to_dict(orient="records")
+    return json.dumps(records, default=json_value).encode()
+
+
+def write_points_partition(path, points_df, workouts_df, endpoints_df):
+    # points_df must be sorted by workout_id, date
+    table = pa.Table.from_pandas(points_df, schema=POINTS_SCHEMA, preserve_index=False)
+    table = table.replace_schema_metadata(
+        {
+            WORKOUTS_METADATA_KEY: records_to_json(workouts_df),
+            ENDPOINTS_METADATA_KEY: records_to_json(endpoints_df),
+        }
+    )
+    workout_ids = points_df["workout_id"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, workout_ids[1:] != workout_ids[:-1]])
+    stops = np.r_[starts[1:], len(workout_ids)]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with pq.ParquetWriter(path, table.schema, compression="zstd") as writer:
+        for start, stop in zip(starts, stops):
+            writer.write_table(table.slice(start, stop - start))
+
+
+def read_partition_metadata(path, key):
+    metadata = pq.read_schema(path, memory_map=True).metadata or {}
+    return json.loads(metadata.get(key, b"[]"))
+
+
+class ParquetTrackStore:
+    # Read side of the store: only the footers are read when it is opened
+    def __init__(self, store_dir):
+        self.store_dir = Path(store_dir)
+        self.files = sorted(self.store_dir.glob(f"month=*/{PARTITION_FILE_NAME}"))
+        self.workouts = []
+        self.endpoints = []
+        self.file_by_workout_id = {}
+        for file in self.files:
+            workouts = read_partition_metadata(file, WORKOUTS_METADATA_KEY)
+            self.workouts.extend(workouts)
+            self.endpoints.extend(read_partition_metadata(file, ENDPOINTS_METADATA_KEY))
+            self.file_by_workout_id.update((workout["id"], file) for workout in workouts)
+
+    def __len__(self):
+        return len(self.file_by_workout_id)
+
+    def workouts_df(self):
+        return pd.DataFrame(self.workouts)
+
+    def endpoints_df(self):
+        return pd.DataFrame(self.endpoints)
+
+    def read_points(self, file, workout_ids, columns):
+        return pq.read_table(
+            file,
+            columns=["workout_id", *columns],
+            filters=[("workout_id", "in", list(workout_ids))],
+            memory_map=True,
+        )
+
+    def workout_points(self, workout_id, columns=("latitude", "longitude")):
+        # Returns an (n, len(columns)) array, in date order
+        file = self.file_by_workout_id.get(workout_id)
+        if file is None:
+            return np.empty((0, len(columns)))
+        table = self.read_points(file, [workout_id], columns)
+        return np.column_stack(
+            [table[column].to_numpy() for column in columns]
+        ).reshape(-1, len(columns))
+
+    def workouts_points(self, workout_ids, columns=("latitude", "longitude")):
+        # Returns {workout_id: (n, len(columns)) array}, reading each file once
+        workout_ids_by_file = {}
+        for workout_id in dict.fromkeys(workout_ids):
+            if workout_id in self.file_by_workout_id:
+                workout_ids_by_file.setdefault(
+                    self.file_by_workout_id[workout_id], []
+                ).append(workout_id)
+        tracks = {}
+        for file, file_workout_ids in workout_ids_by_file.items():
+            table = self.read_points(file, file_workout_ids, columns)
+            if table.num_rows == 0:
+                continue
+            ids = table["workout_id"].to_numpy()
+            points = np.column_stack([table[column].to_numpy() for column in columns])
+            starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+            tracks.update(
+                (ids[start], track)
+                for start, track in zip(starts, np.split(points, starts[1:]))
+            )
+        return tracks
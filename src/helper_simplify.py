@@ -0,0 +1,240 @@
+# Track (polyline) simplification for the maps
+#
+#   - Douglas-Peucker, vectorised with NumPy across all the segments at each level of
+#     the recursion, on a local equirectangular projection
+#   - The tolerance is tied to the map zoom level: about a pixel at that zoom, so the
+#     simplified track is visually identical but has a fraction of the points
+#   - Simplified tracks for a few zoom levels are precomputed (at ingest) into the
+#     workout_points_simplified table, alongside the raw workout_points: levels of detail
+#     from overview maps of a region (zoom 4, 7) to a single walk (16)
+#   - A map of many tracks uses a coarser level than its zoom alone calls for when the
+#     tracks would otherwise exceed MAX_MAP_POINTS
+
+import json
+import math
+
+import numpy as np
+
+# Zoom levels for which simplified tracks are stored - a map at zoom z uses the
+# smallest stored level >= z (or the raw points if z is beyond all of them)
+SIMPLIFIED_ZOOM_LEVELS = (4, 7, 10, 13, 16)
+
+# Most points drawn on one map (at about a pixel per point, more is just clutter)
+MAX_MAP_POINTS = 50_000
+
+# Simplify for a couple of zoom levels beyond the one displayed, so zooming in a bit
+# on the (static) map doesn't immediately show the simplification
+SIMPLIFY_EXTRA_ZOOM = 2
+
+MAX_ZOOM = 18
+TILE_SIZE_PX = 256
+METRES_PER_DEGREE = 111_320.0
+EQUATOR_METRES_PER_PIXEL_ZOOM_0 = 156_543.03392
+
+
+def tolerance_for_zoom(zoom, latitude=0.0):
+    # Size of one pixel (at zoom + SIMPLIFY_EXTRA_ZOOM) in degrees of latitude
+    metres_per_pixel = (
+        EQUATOR_METRES_PER_PIXEL_ZOOM_0
+        * math.cos(math.radians(latitude))
+        / 2 ** (zoom + SIMPLIFY_EXTRA_ZOOM)
+    )
+    return metres_per_pixel / METRES_PER_DEGREE
+
+
+def zoom_for_bounds(latitudes, longitudes, width_px, height_px):
+    # Largest zoom at which the bounds fit in width_px x height_px (as Leaflet's fitBounds)
+    if len(latitudes) == 0:
+        return 0
+    lat_span = max(np.ptp(latitudes), 1e-6)
+    lon_span = max(np.ptp(longitudes), 1e-6)
+    # Mercator stretches latitude away from the equator
+    lat_span /= math.cos(math.radians(float(np.mean(latitudes))))
+    zoom_lon = math.log2(width_px * 360 / (TILE_SIZE_PX * lon_span))
+    zoom_lat = math.log2(height_px * 360 / (TILE_SIZE_PX * lat_span))
+    return int(min(max(min(zoom_lon, zoom_lat), 0), MAX_ZOOM))
+
+
+def simplify_mask(points, tolerance):
+    # Boolean mask of the points of an (n, 2) latitude, longitude array to keep.
+    # All the segments still to be split are processed together in each pass (one set
+    # of array operations per level of the Douglas-Peucker recursion).
+    n_points = len(points)
+    keep = np.zeros(n_points, dtype=bool)
+    if n_points <= 2:
+        keep[:] = True
+        return keep
+    # Local equirectangular projection (x scaled by cos(latitude)), in degrees
+    y = points[:, 0]
+    x = points[:, 1] * math.cos(math.radians(float(np.mean(y))))
+    keep[0] = keep[-1] = True
+    firsts = np.array([0])
+    lasts = np.array([n_points - 1])
+    while len(firsts):
+        has_interior = lasts - firsts > 1
+        firsts, lasts = firsts[has_interior], lasts[has_interior]
+        if not len(firsts):
+            break
+        # Interior points of every segment, concatenated
+        n_interior = lasts - firsts - 1
+        segment_starts = np.cumsum(n_interior) - n_interior
+        segment = np.repeat(np.arange(len(firsts)), n_interior)
+        index = (
+            np.arange(n_interior.sum())
+            - segment_starts[segment]
+            + firsts[segment]
+            + 1
+        )
+        first, last = firsts[segment], lasts[segment]
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        px = x[index] - x[first]
+        py = y[index] - y[first]
+        length_squared = dx * dx + dy * dy
+        # Distance to the segment (not the infinite line), so loops are preserved
+        t = np.clip(
+            np.divide(
+                px * dx + py * dy,
+                length_squared,
+                out=np.zeros_like(px),
+                where=length_squared > 0,
+            ),
+            0,
+            1,
+        )
+        distances = np.hypot(px - t * dx, py - t * dy)
+        # Furthest point (the first one, if tied) of each segment
+        max_distances = np.maximum.reduceat(distances, segment_starts)
+        is_max = np.flatnonzero(distances == max_distances[segment])
+        _, first_max = np.unique(segment[is_max], return_index=True)
+        splits = index[is_max[first_max]]
+        split = max_distances > tolerance
+        keep[splits[split]] = True
+        firsts = np.concatenate([firsts[split], splits[split]])
+        lasts = np.concatenate([splits[split], lasts[split]])
+    return keep
+
+
+def simplify_track(points, tolerance):
+    points = np.asarray(points, dtype=np.float64)
+    return points[simplify_mask(points, tolerance)]
+
+
+def simplify_track_for_zoom(points, zoom):
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) == 0:
+        return points
+    return simplify_track(points, tolerance_for_zoom(zoom, float(np.mean(points[:, 0]))))
+
+
+def stored_zoom_level(zoom):
+    # The precomputed level to use for a map at this zoom (None: use the raw points)
+    levels = [level for level in SIMPLIFIED_ZOOM_LEVELS if level >= zoom]
+    return min(levels) if levels else None
+
+
+def choose_zoom_level(zoom, n_points_by_level, max_points=MAX_MAP_POINTS):
+    # The level to read the tracks of a map at this zoom at: the stored level for the
+    # zoom, or the next coarser one while the tracks have more than max_points in total.
+    # n_points_by_level: {level: the tracks' total points at that level}, with None the
+    # raw points (a level missing from it is taken as within max_points).
+    level = stored_zoom_level(zoom)
+    coarser_levels = sorted(
+        (stored for stored in SIMPLIFIED_ZOOM_LEVELS if level is None or stored < level),
+        reverse=True,
+    )
+    for coarser_level in coarser_levels:
+        if n_points_by_level.get(level, 0) <= max_points:
+            break
+        level = coarser_level
+    return level
+
+
+def create_simplified_points_table(db):
+    if "workout_points_simplified" in db.table_names():
+        return
+    db["workout_points_simplified"].create(
+        {"workout_id": str, "zoom": int, "latitude": float, "longitude": float},
+        foreign_keys=[("workout_id", "workouts", "id")],
+    )
+    db["workout_points_simplified"].create_index(["workout_id", "zoom"])
+
+
+def create_simplified_levels_table(db):
+    # The number of points in each simplified track, for choosing the level of a map
+    # without counting its points. Filled in from workout_points_simplified when added
+    # to an older database.
+    if "workout_points_levels" in db.table_names():
+        return
+    db["workout_points_levels"].create(
+        {"workout_id": str, "zoom": int, "n_points": int},
+        pk=("workout_id", "zoom"),
+        foreign_keys=[("workout_id", "workouts", "id")],
+    )
+    with db.conn:
+        db.conn.execute(
+            "INSERT INTO workout_points_levels (workout_id, zoom, n_points) "
+            "SELECT workout_id, zoom, COUNT(*) FROM workout_points_simplified "
+            "GROUP BY workout_id, zoom"
+        )
+
+
+def missing_zoom_levels(db, zoom_levels):
+    # {workout_id: [zoom levels it has no simplified track for]} - so a database built
+    # before a level was added gets just that level
+    missing = {}
+    for workout_id, zoom in db.execute(
+        "SELECT workouts.id, levels.value FROM workouts CROSS JOIN json_each(?) AS levels "
+        "WHERE NOT EXISTS (SELECT 1 FROM workout_points_levels "
+        "WHERE workout_id = workouts.id AND zoom = levels.value)",
+        (json.dumps(list(zoom_levels)),),
+    ):
+        missing.setdefault(workout_id, []).append(zoom)
+    return missing
+
+
+def build_simplified_tracks(db, workout_ids=None, zoom_levels=SIMPLIFIED_ZOOM_LEVELS):
+    # Stores the simplified tracks of the given workouts (default: every workout which
+    # lacks one or more of the levels), replacing any they already have. A workout with
+    # no points (or none with a finite latitude and longitude) gets empty tracks, so it
+    # isn't taken as lacking them again. Returns the number of workouts done.
+    if "workout_points" not in db.table_names():
+        return 0
+    create_simplified_points_table(db)
+    create_simplified_levels_table(db)
+    if workout_ids is None:
+        levels_by_workout_id = missing_zoom_levels(db, zoom_levels)
+    else:
+        levels_by_workout_id = {workout_id: zoom_levels for workout_id in workout_ids}
+    n_workouts = 0
+    for workout_id, workout_zoom_levels in levels_by_workout_id.items():
+        points = np.array(
+            db.execute(
+                "SELECT latitude, longitude FROM workout_points "
+                "WHERE workout_id = ? ORDER BY date",
+                (workout_id,),
+            ).fetchall(),
+            dtype=np.float64,
+        ).reshape(-1, 2)
+        # NULL (NaN) coordinates break the distance comparisons of simplify_mask
+        points = points[np.isfinite(points).all(axis=1)]
+        with db.conn:
+            for zoom in workout_zoom_levels:
+                track = simplify_track_for_zoom(points, zoom)
+                db.conn.execute(
+                    "DELETE FROM workout_points_simplified "
+                    "WHERE workout_id = ? AND zoom = ?",
+                    (workout_id, zoom),
+                )
+                db.conn.executemany(
+                    "INSERT INTO workout_points_simplified "
+                    "(workout_id, zoom, latitude, longitude) VALUES (?, ?, ?, ?)",
+                    ((workout_id, zoom, *point) for point in track.tolist()),
+                )
+                db.conn.execute(
+                    "INSERT OR REPLACE INTO workout_points_levels "
+                    "(workout_id, zoom, n_points) VALUES (?, ?, ?)",
+                    (workout_id, zoom, len(track)),
+                )
+        n_workouts += 1
+    return n_workouts
@@ -0,0 +1,257 @@
+# Spatial index of the workouts' start and finish points: a SQLite R-tree
+#
+#   - workout_endpoints_rtree holds two (zero sized) boxes per workout, its start and
+#     finish latitude/longitude. It is filled in for new workouts during ingest (or, for
+#     an older database, when the summary is calculated).
+#   - Each workout has an integer key (workout_spatial_keys) and its boxes' ids are
+#     key * 2 + START / FINISH, so a search returns only numbers (reading a text
+#     auxiliary column of the R-tree for each match is several times slower)
+#   - "Walks near here" is an R-tree search of the bounding box of the circle, then the
+#     exact (haversine) distance of just the workouts in the box, so the cost grows with
+#     the number of nearby walks rather than all walks
+#   - A walk group is suggested for an unlabelled workout from the labels of the walks
+#     starting or finishing near its start and finish (a distance weighted vote)
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from walk_data_stats import EARTH_RADIUS_METRES, haversine_metres
+
+ENDPOINTS_RTREE_TABLE = "workout_endpoints_rtree"
+SPATIAL_KEYS_TABLE = "workout_spatial_keys"
+
+START = 0
+FINISH = 1
+ENDPOINT_NAMES = {START: "start", FINISH: "finish"}
+
+# Walks starting / finishing within this distance are taken as the same walk
+NEAR_DISTANCE_KM = 0.5
+
+CREATE_ENDPOINTS_RTREE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {SPATIAL_KEYS_TABLE} (
+    key INTEGER PRIMARY KEY,
+    workout_id TEXT UNIQUE
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS {ENDPOINTS_RTREE_TABLE} USING rtree(
+    id,
+    min_latitude, max_latitude,
+    min_longitude, max_longitude
+);
+"""
+
+# As sql/select_start_finish_point_workout.sql: two seeks per workout on the
+# (workout_id, date) index of workout_points
+INSERT_ENDPOINTS_SQL = f"""
+INSERT OR REPLACE INTO {ENDPOINTS_RTREE_TABLE}
+SELECT endpoints.key * 2 + endpoints.endpoint,
+    point.latitude, point.latitude, point.longitude, point.longitude
+FROM (
+    SELECT key, {START} AS endpoint, (
+        SELECT rowid FROM workout_points
+        WHERE workout_points.workout_id = keys.workout_id AND date IS NOT NULL
+        ORDER BY date ASC LIMIT 1
+    ) AS point_rowid
+    FROM {SPATIAL_KEYS_TABLE} AS keys
+    WHERE workout_id IN (SELECT value FROM json_each(:workout_ids))
+    UNION ALL
+    SELECT key, {FINISH}, (
+        SELECT rowid FROM workout_points
+        WHERE workout_points.workout_id = keys.workout_id AND date IS NOT NULL
+        ORDER BY date DESC LIMIT 1
+    )
+    FROM {SPATIAL_KEYS_TABLE} AS keys
+    WHERE workout_id IN (SELECT value FROM json_each(:workout_ids))
+) AS endpoints
+JOIN workout_points AS point ON point.rowid = endpoints.point_rowid
+WHERE point.latitude IS NOT NULL AND point.longitude IS NOT NULL
+"""
+
+# The R-tree stores 32 bit coordinates (rounded outwards, so ~1 m boxes): a point is
+# the centre of its box. The searched boxes are a JSON array of [min_latitude,
+# max_latitude, min_longitude, max_longitude], each probing the R-tree once; search is
+# the box's position in the array.
+SEARCH_ENDPOINTS_SQL = f"""
+SELECT
+    search.key AS search,
+    rtree.id,
+    (rtree.min_latitude + rtree.max_latitude) / 2 AS latitude,
+    (rtree.min_longitude + rtree.max_longitude) / 2 AS longitude
+FROM json_each(?) AS search
+CROSS JOIN {ENDPOINTS_RTREE_TABLE} AS rtree
+WHERE rtree.min_latitude >= json_extract(search.value, '$[0]')
+    AND rtree.max_latitude <= json_extract(search.value, '$[1]')
+    AND rtree.min_longitude >= json_extract(search.value, '$[2]')
+    AND rtree.max_longitude <= json_extract(search.value, '$[3]')
+"""
+
+
+def has_endpoints_rtree(conn):
+    return (
+        conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (ENDPOINTS_RTREE_TABLE,)
+        ).fetchone()
+        is not None
+    )
+
+
+def build_endpoints_rtree(db, workout_ids=None):
+    # Indexes the start and finish of the given workouts (default: every workout not yet
+    # indexed). Returns the number of workouts indexed.
+    if "workout_points" not in db.table_names():
+        return 0
+    db.conn.executescript(CREATE_ENDPOINTS_RTREE_SQL)
+    if workout_ids is None:
+        workout_ids = [
+            row[0]
+            for row in db.execute(
+                f"SELECT id FROM workouts WHERE id NOT IN "
+                f"(SELECT workout_id FROM {SPATIAL_KEYS_TABLE})"
+            )
+        ]
+    workout_ids = list(workout_ids)
+    with db.conn:
+        db.conn.execute(
+            f"INSERT OR IGNORE INTO {SPATIAL_KEYS_TABLE} (workout_id) "
+            f"SELECT value FROM json_each(?)",
+            (json.dumps(workout_ids),),
+        )
+        db.conn.execute(INSERT_ENDPOINTS_SQL, {"workout_ids": json.dumps(workout_ids)})
+    return len(workout_ids)
+
+
+def workout_ids_by_key(conn, keys):
+    # {key: workout_id} of the given keys
+    return dict(
+        conn.execute(
+            f"SELECT key, workout_id FROM {SPATIAL_KEYS_TABLE} "
+            f"WHERE key IN (SELECT value FROM json_each(?))",
+            (json.dumps(pd.unique(np.asarray(keys)).tolist()),),
+        ).fetchall()
+    )
+
+
+def bounding_box(latitudes, longitudes, distance_km):
+    # (min_latitude, max_latitude, min_longitude, max_longitude) of the circles of
+    # distance_km around the points (wider in longitude towards the poles)
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    latitude_degrees = np.degrees(distance_km * 1000 / EARTH_RADIUS_METRES)
+    longitude_degrees = np.minimum(
+        latitude_degrees / np.maximum(np.cos(np.radians(latitudes)), 1e-6), 180
+    )
+    return (
+        latitudes - latitude_degrees,
+        latitudes + latitude_degrees,
+        longitudes - longitude_degrees,
+        longitudes + longitude_degrees,
+    )
+
+
+def search_endpoints(conn, latitudes, longitudes, distance_km):
+    # The indexed endpoints within distance_km of each point: a DataFrame of search (the
+    # position of the point searched around), key (of the workout), endpoint (START or
+    # FINISH), latitude, longitude and distance_km
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    boxes = np.column_stack(bounding_box(latitudes, longitudes, distance_km))
+    matches = np.array(
+        conn.execute(SEARCH_ENDPOINTS_SQL, (json.dumps(boxes.tolist()),)).fetchall(),
+        dtype=np.float64,
+    ).reshape(-1, 4)
+    search = matches[:, 0].astype(np.int64)
+    ids = matches[:, 1].astype(np.int64)
+    distances_km = (
+        haversine_metres(latitudes[search], longitudes[search], matches[:, 2], matches[:, 3])
+        / 1000
+    )
+    near = distances_km <= distance_km
+    return pd.DataFrame(
+        {
+            "search": search[near],
+            "key": ids[near] // 2,
+            "endpoint": ids[near] % 2,
+            "latitude": matches[near, 2],
+            "longitude": matches[near, 3],
+            "distance_km": distances_km[near],
+        }
+    )
+
+
+def workouts_near(conn, latitude, longitude, distance_km, endpoints=(START, FINISH)):
+    # The workouts starting and/or finishing within distance_km of the point, nearest
+    # first: a DataFrame of workout_id, endpoint (the nearer, "start" or "finish"),
+    # latitude, longitude and distance_km
+    matches_df = search_endpoints(conn, [latitude], [longitude], distance_km)
+    matches_df = (
+        matches_df[matches_df["endpoint"].isin(endpoints)]
+        .sort_values("distance_km")
+        .drop_duplicates("key")
+    )
+    matches_df.insert(
+        0, "workout_id", matches_df["key"].map(workout_ids_by_key(conn, matches_df["key"]))
+    )
+    matches_df["endpoint"] = matches_df["endpoint"].map(ENDPOINT_NAMES)
+    return matches_df.drop(columns=["search", "key"]).reset_index(drop=True)
+
+
+def suggest_walk_groups(
+    conn, workouts_df, workout_groups, distance_km=NEAR_DISTANCE_KM, min_share=0.0
+):
+    # workouts_df: workout_id, start_latitude, start_longitude, finish_latitude,
+    # finish_longitude of the workouts to suggest a group for. workout_groups:
+    # {workout_id: walk_group} of the labelled workouts.
+    #
+    # Each labelled workout with an endpoint within distance_km of a workout's start or
+    # finish votes for its group, with a weight falling off with the distance. Returns a
+    # DataFrame of workout_id, walk_group, share (of the votes) and n_walks (labelled
+    # walks nearby), for the workouts with a suggestion at least min_share.
+    columns = ["workout_id", "walk_group", "share", "n_walks"]
+    workouts_df = workouts_df.dropna(
+        subset=["start_latitude", "start_longitude", "finish_latitude", "finish_longitude"]
+    )
+    if workouts_df.empty or not workout_groups:
+        return pd.DataFrame(columns=columns)
+    # A search around each workout's start, then each workout's finish
+    workout_ids = np.r_[workouts_df["workout_id"], workouts_df["workout_id"]]
+    matches_df = search_endpoints(
+        conn,
+        np.r_[workouts_df["start_latitude"], workouts_df["finish_latitude"]],
+        np.r_[workouts_df["start_longitude"], workouts_df["finish_longitude"]],
+        distance_km,
+    )
+    workout_id_by_key = workout_ids_by_key(conn, matches_df["key"])
+    group_by_key = {
+        key: workout_groups[workout_id]
+        for key, workout_id in workout_id_by_key.items()
+        if workout_id in workout_groups
+    }
+    # Each workout's own key (it is among its matches): it doesn't vote for itself
+    key_by_workout_id = {workout_id: key for key, workout_id in workout_id_by_key.items()}
+    search = matches_df["search"].to_numpy()
+    own_keys = np.array([key_by_workout_id.get(workout_id, -1) for workout_id in workout_ids])
+    matches_df["walk_group"] = matches_df["key"].map(group_by_key)
+    matches_df["workout_id"] = workout_ids[search]
+    matches_df = matches_df[
+        matches_df["walk_group"].notna() & (matches_df["key"].to_numpy() != own_keys[search])
+    ]
+    if matches_df.empty:
+        return pd.DataFrame(columns=columns)
+    matches_df["weight"] = 1 - matches_df["distance_km"] / (2 * distance_km)
+    votes_df = matches_df.groupby(["workout_id", "walk_group"], as_index=False)[
+        "weight"
+    ].sum()
+    votes_df["share"] = votes_df["weight"] / votes_df.groupby("workout_id")[
+        "weight"
+    ].transform("sum")
+    suggestions_df = (
+        votes_df.sort_values(["workout_id", "share"], ascending=[True, False])
+        .drop_duplicates("workout_id")
+        .set_index("workout_id")
+    )
+    suggestions_df["n_walks"] = matches_df.groupby("workout_id")["key"].nunique()
+    suggestions_df = suggestions_df.reset_index()
+    return suggestions_df.loc[suggestions_df["share"] >= min_share, columns].reset_index(
+        drop=True
+    )
@@ -0,0 +1,244 @@
+# Compact tracks: one workout_tracks row per workout, holding its points' time, latitude,
+# longitude and altitude as binary arrays (blobs), in place of its workout_points rows
+#
+#   - Latitude and longitude are stored as float32 pairs: ~1 m at worst (longitudes
+#     beyond +/-128 degrees), below the accuracy of a GPS fix and about a pixel at the
+#     maps' highest zoom. Time is stored as float32 offsets from the track's first point
+#     (a REAL column), so float32 only has to resolve the offset (~0.02 s over a walk),
+#     and altitude as float32 metres. 16 bytes a point, against a workout_points row
+#     (eight REALs and the workout_id text) and its entry in the covering index
+#   - Fixed width little-endian floats rather than varints, so np.frombuffer decodes a
+#     blob without copying or parsing it: decode_points returns a read-only view of the
+#     blob as an (n, 2) float32 array
+#   - Optional (compact_tracks=True at conversion, --compact-tracks on the command line):
+#     once a database has the table, the tracks of the workouts added to it (by an
+#     incremental conversion or a GPX import) are built as well. The maps (helper_app)
+#     and the density grid (helper_density) read a workout's points from its row - a
+#     few pages - rather than an index range scan over its thousands of rows, and fall
+#     back to workout_points for databases without the table
+#   - Once everything else derived from a workout's points (the simplified tracks,
+#     statistics, spatial index and density grid) has been built, drop_track_points
+#     checks its track against its workout_points rows and deletes all of them but the
+#     first and last, which the summary's start/finish query reads. Its points are then
+#     only in the track, which build_workout_tracks never rebuilds, and the Parquet
+#     export reads them from it (track_points_df)
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from walk_data_stats import (
+    STATS_CHUNK_WORKOUTS,
+    WORKOUTS_WITH_POINTS_SQL,
+    iter_workout_points,
+    point_seconds,
+)
+
+TRACK_DTYPE = np.dtype("<f4")
+
+WORKOUT_TRACKS_COLUMNS = {
+    "workout_id": str,
+    "n_points": int,
+    "start_seconds": float,  # since the epoch
+    "seconds": bytes,
+    "points": bytes,  # latitude, longitude pairs
+    "altitude": bytes,
+}
+
+# Workouts whose workout_points rows have been dropped (see drop_track_points)
+DROPPED_POINTS_SQL = (
+    "SELECT workout_id FROM workout_tracks WHERE n_points > "
+    "(SELECT COUNT(*) FROM workout_points WHERE workout_id = workout_tracks.workout_id)"
+)
+
+
+def track_origin(values):
+    # The first finite value (0 if there is none)
+    finite = values[np.isfinite(values)]
+    return float(finite[0]) if len(finite) else 0.0
+
+
+def encode_track(seconds, latitudes, longitudes, altitudes):
+    # The workout_tracks columns (after workout_id) for the points, in time order
+    start_seconds = track_origin(seconds)
+    return (
+        len(latitudes),
+        start_seconds,
+        (np.asarray(seconds, dtype=np.float64) - start_seconds)
+        .astype(TRACK_DTYPE)
+        .tobytes(),
+        np.column_stack([latitudes, longitudes]).astype(TRACK_DTYPE).tobytes(),
+        np.asarray(altitudes).astype(TRACK_DTYPE).tobytes(),
+    )
+
+
+def decode_points(points_blob):
+    # (n, 2) float32 array of latitude, longitude: a view of the blob, not a copy
+    return np.frombuffer(points_blob, dtype=TRACK_DTYPE).reshape(-1, 2)
+
+
+def decode_track(row):
+    # A workout_tracks row (without workout_id) -> {"seconds": float64 array,
+    # "latitude", "longitude", "altitude": float32 arrays (views of the blobs)}
+    _, start_seconds, seconds_blob, points_blob, altitude_blob = row
+    points = decode_points(points_blob)
+    return {
+        # (dtype=np.float64 as adding a Python float to a float32 array stays float32)
+        "seconds": np.add(
+            np.frombuffer(seconds_blob, dtype=TRACK_DTYPE), start_seconds, dtype=np.float64
+        ),
+        "latitude": points[:, 0],
+        "longitude": points[:, 1],
+        "altitude": np.frombuffer(altitude_blob, dtype=TRACK_DTYPE),
+    }
+
+
+def has_workout_tracks(db):
+    return "workout_tracks" in db.table_names()
+
+
+def dropped_points_workout_ids(db):
+    if not has_workout_tracks(db):
+        return set()
+    return {row[0] for row in db.execute(DROPPED_POINTS_SQL)}
+
+
+def create_workout_tracks_table(db):
+    if has_workout_tracks(db):
+        return
+    db["workout_tracks"].create(
+        WORKOUT_TRACKS_COLUMNS,
+        pk="workout_id",
+        foreign_keys=[("workout_id", "workouts", "id")],
+    )
+
+
+def build_workout_tracks(db, workout_ids=None, chunk_workouts=STATS_CHUNK_WORKOUTS):
+    # Stores the compact tracks of the given workouts (default: every workout which has
+    # points but no compact track yet). Returns the number of workouts done.
+    if "workout_points" not in db.table_names():
+        return 0
+    create_workout_tracks_table(db)
+    if workout_ids is None:
+        workout_ids = [
+            row[0]
+            for row in db.execute(
+                WORKOUTS_WITH_POINTS_SQL
+                + " AND id NOT IN (SELECT workout_id FROM workout_tracks)"
+            )
+        ]
+    else:
+        # Never from the first and last points left of one whose points were dropped
+        dropped = dropped_points_workout_ids(db)
+        workout_ids = [
+            workout_id for workout_id in workout_ids if workout_id not in dropped
+        ]
+    workout_ids = list(workout_ids)
+    insert_sql = (
+        f"INSERT OR REPLACE INTO workout_tracks ({', '.join(WORKOUT_TRACKS_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(WORKOUT_TRACKS_COLUMNS))})"
+    )
+    n_workouts = 0
+    rows = []
+    for workout_id, points_df in iter_workout_points(db.conn, workout_ids, chunk_workouts):
+        rows.append(
+            (
+                workout_id,
+                *encode_track(
+                    point_seconds(points_df["date"]),
+                    points_df["latitude"].to_numpy(dtype=np.float64),
+                    points_df["longitude"].to_numpy(dtype=np.float64),
+                    points_df["altitude"].to_numpy(dtype=np.float64),
+                ),
+            )
+        )
+        n_workouts += 1
+        if len(rows) >= chunk_workouts:
+            with db.conn:
+                db.conn.executemany(insert_sql, rows)
+            rows = []
+    with db.conn:
+        db.conn.executemany(insert_sql, rows)
+    return n_workouts
+
+
+def drop_track_points(db, workout_ids=None, chunk_workouts=STATS_CHUNK_WORKOUTS):
+    # Deletes the workout_points rows of the given workouts (default: every workout with
+    # a compact track) but the first and last of each, once its compact track has been
+    # checked against them: a workout whose track doesn't match, or which has none,
+    # keeps its rows. Returns the number of workouts whose rows were deleted.
+    if not has_workout_tracks(db):
+        return 0
+    query = (
+        "SELECT workout_id FROM workout_tracks WHERE n_points > 2 AND n_points = "
+        "(SELECT COUNT(*) FROM workout_points WHERE workout_id = workout_tracks.workout_id)"
+    )
+    params = ()
+    if workout_ids is not None:
+        query += " AND workout_id IN (SELECT value FROM json_each(?))"
+        params = (json.dumps(list(workout_ids)),)
+    candidates = [row[0] for row in db.execute(query, params)]
+    n_workouts = 0
+    for start in range(0, len(candidates), chunk_workouts):
+        chunk = candidates[start : start + chunk_workouts]
+        points_by_workout_id = dict(
+            db.execute(
+                "SELECT workout_id, points FROM workout_tracks "
+                "WHERE workout_id IN (SELECT value FROM json_each(?))",
+                (json.dumps(chunk),),
+            )
+        )
+        checked = [
+            workout_id
+            for workout_id, points_df in iter_workout_points(db.conn, chunk, chunk_workouts)
+            if np.array_equal(
+                decode_points(points_by_workout_id[workout_id]),
+                points_df[["latitude", "longitude"]].to_numpy(dtype=TRACK_DTYPE),
+                equal_nan=True,
+            )
+        ]
+        with db.conn:
+            db.conn.executemany(
+                "DELETE FROM workout_points WHERE workout_id = :workout_id "
+                "AND rowid NOT IN ("
+                "(SELECT rowid FROM workout_points WHERE workout_id = :workout_id "
+                "AND date IS NOT NULL ORDER BY date ASC LIMIT 1), "
+                "(SELECT rowid FROM workout_points WHERE workout_id = :workout_id "
+                "AND date IS NOT NULL ORDER BY date DESC LIMIT 1))",
+                ({"workout_id": workout_id} for workout_id in checked),
+            )
+        n_workouts += len(checked)
+    return n_workouts
+
+
+def track_points_df(conn, workout_ids):
+    # The points of the given workouts from their compact tracks, as a DataFrame of the
+    # workout_points columns the tracks hold: the date (UTC, "...Z", to the second),
+    # latitude, longitude, altitude and workout_id, ordered by workout_id then date
+    points_dfs = []
+    for workout_id, *track in conn.execute(
+        "SELECT workout_id, n_points, start_seconds, seconds, points, altitude "
+        "FROM workout_tracks WHERE workout_id IN (SELECT value FROM json_each(?)) "
+        "ORDER BY workout_id",
+        (json.dumps(list(workout_ids)),),
+    ):
+        track = decode_track(track)
+        points_dfs.append(
+            pd.DataFrame(
+                {
+                    "date": pd.to_datetime(np.round(track["seconds"]), unit="s", utc=True)
+                    .strftime("%Y-%m-%dT%H:%M:%SZ")
+                    .to_numpy(dtype=object),
+                    "latitude": track["latitude"].astype(np.float64),
+                    "longitude": track["longitude"].astype(np.float64),
+                    "altitude": track["altitude"].astype(np.float64),
+                    "workout_id": workout_id,
+                }
+            )
+        )
+    if not points_dfs:
+        return pd.DataFrame(
+            columns=["date", "latitude", "longitude", "altitude", "workout_id"]
+        )
+    return pd.concat(points_dfs, ignore_index=True)
@@ -1,48 +1,83 @@
 # Walk data auxiliary functions to support the App
 
 #   - Export all of my Apple HealthFit data from the Health app to export.zip
-#   - Converted this to a SQLite database using `healthkit-to-sqlite`
+#   - Converted this to a SQLite database (natively, see `walk_data_ingest`, producing
+#     the same tables as `healthkit-to-sqlite`)
 #   - Run various SQL queries to allow for producing a summary of (walk/hike) workouts
 
-# The archive can be converted to a SQLite database using the following command:
+# The archive can also be converted to a SQLite database using the following command:
 # `healthkit-to-sqlite export.zip healthkit_db.sqlite`
 
 import datetime as dt
-import subprocess
+import json
+import shutil
+import sqlite3
 from pathlib import Path
-from uuid import UUID, uuid5
 
+import numpy as np
 import pandas as pd
 import pendulum
-import reverse_geocode as rg
 from sqlite_utils import Database
 
-TIMEZONE = "Australia/Sydney"
-
-FIXED_NAMESPACE = UUID("d5c0f985-3af0-4cfd-8012-560516582f0f")
-
-
-def uuid_from_datetime(dt):
-    return uuid5(FIXED_NAMESPACE, dt)
-
-
-def get_location_rg(latitude, longitude):
-    return rg.get(
-        (latitude, longitude),
+from helper_datetime import TIMEZONE, parse_datetimes_as_utc
+from helper_geocode import LocationCache
+from helper_parquet import (
+    ParquetTrackStore,
+    parquet_store_path,
+    partition_path,
+    write_points_partition,
+)
+from helper_tracks import dropped_points_workout_ids, track_points_df
+from walk_data_ingest import (
+    POINT_COLUMNS,
+    build_derived_tables,
+    create_workout_points_indexes,
+    ingest_healthkit_export,
+    uuid_from_datetime,
+)
+
+
+# The following operate on whole columns (pd.Series) at once
+
+def convert_datetime_from_gmt_to_timezone(datetimes):
+    local_datetimes = (
+        parse_datetimes_as_utc(datetimes).dt.tz_convert(TIMEZONE).dt.tz_localize(None)
     )
+    # Much faster than .dt.strftime(): "YYYY-MM-DDTHH:MM:SS" -> "YYYY-MM-DD HH:MM:SS"
+    return pd.Series(
+        np.datetime_as_string(local_datetimes.to_numpy(), unit="s"),
+        index=datetimes.index,
+    ).str.replace("T", " ", regex=False)
 
 
-def convert_datetime_from_gmt_to_timezone(dt):
-    timezone = pendulum.timezone(TIMEZONE)
-    return timezone.convert(pendulum.parse(dt)).to_datetime_string()
+def calculate_elapsed_time_hours(finish_datetimes, start_datetimes):
+    elapsed = parse_datetimes_as_utc(finish_datetimes) - parse_datetimes_as_utc(
+        start_datetimes
+    )
+    # Whole seconds (truncated), as previously given by pendulum's Duration.in_seconds()
+    return np.trunc(elapsed.dt.total_seconds()) / 60 / 60
 
 
-def calculate_elapsed_time_hours(finish_datetime, start_datetime):
-    dt = pendulum.parse(finish_datetime) - pendulum.parse(start_datetime)
-    return float(dt.in_seconds() / 60 / 60)
+def local_datetime_string(healthkit_datetimes):
+    # HealthKit dates look like "2019-06-11 15:00:42 +1000": keep the local date/time
+    return healthkit_datetimes.str.slice(0, 19)
 
 
-def convert_healthkit_export_to_sqlite(export_zip):
+def convert_healthkit_export_to_sqlite(
+    export_zip,
+    progress_callback=None,
+    activity_types=None,
+    previous_db_file=None,
+    workers=None,
+    parquet=False,
+    data_dir=Path(__file__).parent.parent / "data",
+    compact_tracks=False,
+):
+    # If previous_db_file is given the new snapshot starts as a copy of it and only the
+    # workouts new since then (and their points) are appended. With parquet=True the
+    # points are also exported to a Parquet track store alongside the database, and with
+    # compact_tracks=True the compact tracks are built (see helper_tracks). The database
+    # is moved to data_dir once converted.
     zip_file = export_zip.as_posix()
     if export_zip.exists() is False:
         print(zip_file, ": not found")
@@ -51,32 +86,95 @@ def convert_healthkit_export_to_sqlite(export_zip):
         dt.datetime.fromtimestamp(export_zip.stat().st_ctime)
     )
 
-    db_file = zip_file.replace("export.zip", "healthkit_db.sqlite")
+    # Written alongside the export (whatever it is called), then moved to data_dir
+    db_file = export_zip.with_name("healthkit_db.sqlite")
+    if db_file == export_zip:
+        raise ValueError(f"{zip_file}: the export can't be named {db_file.name}")
+    db_file = db_file.as_posix()
     if Path(db_file).exists() is True:
         Path(db_file).unlink()
-    sp_cmd = f"healthkit-to-sqlite {zip_file} {db_file}"
-
-    print(sp_cmd)
-
-    sp = subprocess.Popen(sp_cmd, stdout=subprocess.PIPE, shell=True)
-    (sp_output, _) = sp.communicate()
-
-    db_file_with_date = db_file.replace(
-        ".sqlite", "_" + zip_file_date.to_date_string().replace("-", "_") + ".sqlite"
-    )
-
-    mv_zip_file = zip_file.replace(
-        ".zip", "_" + zip_file_date.to_date_string().replace("-", "_") + ".zip"
-    )
+    incremental = previous_db_file is not None and Path(previous_db_file).exists()
+    try:
+        if incremental:
+            shutil.copyfile(previous_db_file, db_file)
+        ingest_healthkit_export(
+            export_zip,
+            db_file,
+            progress_callback=progress_callback,
+            activity_types=activity_types,
+            incremental=incremental,
+            workers=workers,
+            compact_tracks=compact_tracks,
+        )
+    except Exception:
+        # Don't leave a half written database behind to be picked up as the latest
+        Path(db_file).unlink(missing_ok=True)
+        raise
+
+    date_suffix = "_" + zip_file_date.to_date_string().replace("-", "_")
+    db_file_with_date = Path(db_file).with_stem(Path(db_file).stem + date_suffix)
+
+    mv_zip_file = export_zip.with_stem(export_zip.stem + date_suffix).as_posix()
     export_zip.rename(mv_zip_file)
 
     db_file_with_date = Path(db_file).rename(db_file_with_date)
-    db_file_data_dir = Path(__file__).parent.parent / "data" / db_file_with_date.name
+    db_file_data_dir = Path(data_dir) / db_file_with_date.name
     db_file_with_date.replace(db_file_data_dir)
+    if parquet:
+        export_sqlite_to_parquet(db_file_data_dir)
 
     return db_file_data_dir, mv_zip_file
 
 
+def export_sqlite_to_parquet(db_file, store_dir=None):
+    # Writes the points of every workout which has any to a Parquet track store (see
+    # helper_parquet), one file per month, replacing any previous store. The points of
+    # the workouts whose workout_points rows have been dropped come from their compact
+    # tracks (see helper_tracks).
+    store_dir = parquet_store_path(db_file) if store_dir is None else Path(store_dir)
+    db = Database(db_file)
+    create_workout_points_indexes(db)
+    dropped = dropped_points_workout_ids(db)
+    endpoints_df = create_df_from_sql_query_in_file(
+        "select_start_finish_point_workout.sql", db.conn, None
+    )
+    workouts_df = pd.read_sql_query("SELECT * FROM workouts ORDER BY id", db.conn)
+    workouts_df = workouts_df[workouts_df["id"].isin(endpoints_df["workout_id"])]
+
+    # Written alongside, then swapped in, so a failed export leaves the old store intact
+    tmp_dir = store_dir.with_name(store_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    for month, month_workouts_df in workouts_df.groupby(
+        workouts_df["startDate"].str.slice(0, 7)
+    ):
+        points_df = pd.read_sql_query(
+            f"SELECT {', '.join(POINT_COLUMNS)}, workout_id FROM workout_points "
+            "WHERE workout_id IN (SELECT value FROM json_each(?)) "
+            "ORDER BY workout_id, date",
+            db.conn,
+            params=(json.dumps(month_workouts_df["id"].tolist()),),
+        )
+        month_dropped = sorted(dropped.intersection(month_workouts_df["id"]))
+        if month_dropped:
+            points_df = pd.concat(
+                [
+                    points_df[~points_df["workout_id"].isin(month_dropped)],
+                    track_points_df(db.conn, month_dropped),
+                ],
+                ignore_index=True,
+            ).sort_values("workout_id", kind="stable", ignore_index=True)
+        write_points_partition(
+            partition_path(tmp_dir, month),
+            points_df,
+            month_workouts_df,
+            endpoints_df[endpoints_df["workout_id"].isin(month_workouts_df["id"])],
+        )
+    shutil.rmtree(store_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    tmp_dir.rename(store_dir)
+    return store_dir
+
+
 def create_df_from_sql_query_in_file(
     filename_dot_sql, conn, parse_dates, echo_query=False
 ):
@@ -91,66 +189,116 @@ def create_df_from_sql_query_in_file(
     return df
 
 
+def migrate_database(db_file):
+    # Backfills the index and the derived tables (see walk_data_ingest) of a database
+    # created by healthkit-to-sqlite or an older version of the ingest, which the maps
+    # and the start/finish point query rely on. A database already up to date isn't
+    # written to.
+    build_derived_tables(Database(db_file))
+
+
+def read_workouts_from_sqlite(db_file):
+    # Only reads the database (writing would change its signature and so invalidate
+    # the app's caches of it): see migrate_database for one created elsewhere
+    db = Database(db_file)
+    workouts_df = create_df_from_sql_query_in_file(
+        "select_star_walking_workouts.sql", db.conn, None
+    )
+    workouts_summary_df = create_df_from_sql_query_in_file(
+        "select_start_finish_point_workout.sql", db.conn, None
+    )
+    return workouts_df, workouts_summary_df
+
+
+def read_workouts_from_parquet(store_dir):
+    # As read_workouts_from_sqlite, but from the metadata in the Parquet files' footers
+    # (no points are read): the walking workouts query is run on an in-memory copy of
+    # the workouts table
+    store = ParquetTrackStore(store_dir)
+    conn = sqlite3.connect(":memory:")
+    store.workouts_df().to_sql("workouts", conn, index=False)
+    workouts_df = create_df_from_sql_query_in_file(
+        "select_star_walking_workouts.sql", conn, None
+    )
+    conn.close()
+    workouts_summary_df = store.endpoints_df().sort_values(
+        by="workout_id", ignore_index=True
+    )
+    return workouts_df, workouts_summary_df
+
+
+def write_summary_file(workouts_summary_df, output_file):
+    if Path(output_file).suffix == ".parquet":
+        # The locations (dicts) and UUIDs are stored as text and the numeric text
+        # columns (from the workouts table) as numbers, as they read back from the CSV
+        workouts_summary_df = workouts_summary_df.astype(
+            {"start_location": str, "finish_location": str, "uuid": str}
+        )
+        for column in workouts_summary_df.columns:
+            if pd.api.types.is_string_dtype(workouts_summary_df[column]):
+                try:
+                    workouts_summary_df[column] = pd.to_numeric(
+                        workouts_summary_df[column]
+                    )
+                except (ValueError, TypeError):
+                    pass
+        workouts_summary_df.to_parquet(output_file, index=False)
+    else:
+        workouts_summary_df.to_csv(output_file, index=False)
+
+
 def create_walk_workout_summary(
-    db_file, output_file=Path(__file__).parent.parent / "data/workouts_summary.csv"
+    db_file,
+    output_file=Path(__file__).parent.parent / "data/workouts_summary.csv",
+    location_cache=None,
 ):
+    # db_file is either a SQLite database or a Parquet track store (directory); the
+    # summary is written as Parquet if output_file ends in .parquet, otherwise as CSV
     if db_file is None or Path(db_file).exists() is False:
         return None
-    db = Database(db_file)
+    if location_cache is None:
+        location_cache = LocationCache()
 
     # Extract data
 
-    workouts_df = create_df_from_sql_query_in_file(
-        "select_star_walking_workouts.sql", db.conn, ["startDate", "endDate"]
-    )
-    start_point_df = create_df_from_sql_query_in_file(
-        "select_start_point_workout.sql", db.conn, ["date"]
-    )
-    finish_point_df = create_df_from_sql_query_in_file(
-        "select_finish_point_workout.sql", db.conn, ["date"]
-    )
+    if Path(db_file).is_dir():
+        workouts_df, workouts_summary_df = read_workouts_from_parquet(db_file)
+    else:
+        workouts_df, workouts_summary_df = read_workouts_from_sqlite(db_file)
 
     # Perform joins and additional column manipulations
 
-    workouts_df["startDate"] = workouts_df["startDate"].apply(
-        lambda dt: pendulum.instance(dt).to_datetime_string()
-    )
-    workouts_df["endDate"] = workouts_df["endDate"].apply(
-        lambda dt: pendulum.instance(dt).to_datetime_string()
-    )
+    workouts_df["startDate"] = local_datetime_string(workouts_df["startDate"])
+    workouts_df["endDate"] = local_datetime_string(workouts_df["endDate"])
     # Assuming that the start date/time is unique for the basis of the UUID (which seems reasonable)
-    workouts_df["uuid"] = workouts_df["startDate"].apply(
-        lambda dt: uuid_from_datetime(dt)
-    )
+    workouts_df["uuid"] = [uuid_from_datetime(dt) for dt in workouts_df["startDate"]]
     # Note workout id's are NOT unique between exports from the Health app (just used for linking tables)
-    workouts_summary_df = start_point_df.merge(
-        finish_point_df, how="inner", on="workout_id"
+    workouts_summary_df["elapsed_time_hours"] = calculate_elapsed_time_hours(
+        workouts_summary_df["finish_datetime"], workouts_summary_df["start_datetime"]
     )
-    workouts_summary_df["elapsed_time_hours"] = workouts_summary_df.apply(
-        lambda row: calculate_elapsed_time_hours(
-            row["finish_datetime"], row["start_datetime"]
-        ),
-        axis=1,
-    )
-    workouts_summary_df["start_datetime"] = workouts_summary_df["start_datetime"].apply(
-        lambda dt: convert_datetime_from_gmt_to_timezone(dt)
+    workouts_summary_df["start_datetime"] = convert_datetime_from_gmt_to_timezone(
+        workouts_summary_df["start_datetime"]
     )
 
-    workouts_summary_df["start_location"] = workouts_summary_df.apply(
-        lambda row: get_location_rg(
-            float(row["start_latitude"]), float(row["start_longitude"])
+    # Start and finish locations are geocoded together in one batch
+    n_workouts = len(workouts_summary_df)
+    locations = location_cache.lookup(
+        np.concatenate(
+            [workouts_summary_df["start_latitude"], workouts_summary_df["finish_latitude"]]
         ),
-        axis=1,
-    )
-    workouts_summary_df["finish_location"] = workouts_summary_df.apply(
-        lambda row: get_location_rg(
-            float(row["finish_latitude"]), float(row["finish_longitude"])
+        np.concatenate(
+            [
+                workouts_summary_df["start_longitude"],
+                workouts_summary_df["finish_longitude"],
+            ]
         ),
-        axis=1,
     )
+    location_cache.save()
+    workouts_summary_df["start_location"] = locations[:n_workouts]
+    workouts_summary_df["finish_location"] = locations[n_workouts:]
     workouts_summary_df = workouts_summary_df.merge(
         workouts_df, how="inner", on="workout_id"
     )
 
-    workouts_summary_df.to_csv(output_file, index=False)
+    write_summary_file(workouts_summary_df, output_file)
     return Path(output_file)
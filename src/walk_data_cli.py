@@ -0,0 +1,248 @@
+# Command line pipeline: convert -> summarise -> export without the Streamlit app, e.g.
+# for a nightly refresh from cron
+#
+#   python src/walk_data_cli.py convert ~/Downloads/export.zip  (incremental, or --full)
+#   python src/walk_data_cli.py summarise [--backend Parquet]
+#   python src/walk_data_cli.py export
+#   python src/walk_data_cli.py run ~/Downloads/export.zip  (all three)
+#   python src/walk_data_cli.py migrate  (e.g. a database from healthkit-to-sqlite)
+#
+#   - The stages are the functions the app's convert and summary pages run
+#     (walk_data_aux), on the most recent database in the data directory (helper_app),
+#     writing the same files (the summary, location cache etc.) into it
+#   - Only the standard library is imported at start up: each stage imports the modules
+#     it needs (pandas, sqlite_utils, pyarrow etc.) when it runs, so --help, argument
+#     errors and a `run` with no export.zip to convert (e.g. a nightly cron job on the
+#     nights there's no new export) return without paying for them
+#   - Each stage's time is printed, and the exit status is non-zero if a stage fails (1,
+#     with the traceback if --verbose) or `run` has no export.zip to convert (3)
+
+import argparse
+import sys
+import time
+import traceback
+from pathlib import Path
+
+from helper_activity_types import WALKING_ACTIVITY_TYPES
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+
+# The helper_activity_types.WALKING_ACTIVITY_TYPES default, as a shorter choice
+WALKING = "walking"
+
+# Exit status of a `run` with no export.zip, told apart from a failed stage (1) and an
+# argument error (2)
+NOTHING_TO_DO_STATUS = 3
+
+
+def log(args, message):
+    if not args.quiet:
+        print(message, file=sys.stderr, flush=True)
+
+
+def latest_db_file(data_dir):
+    # The most recent database in the data directory, or None
+    from helper_app import get_latest_sqlite_file
+
+    db_file, db_available = get_latest_sqlite_file(data_dir)
+    return db_file if db_available else None
+
+
+def convert(args):
+    from walk_data_aux import convert_healthkit_export_to_sqlite
+
+    if args.activity_types == [WALKING]:
+        activity_types = list(WALKING_ACTIVITY_TYPES)
+    elif "all" in args.activity_types:
+        activity_types = None
+    else:
+        activity_types = args.activity_types
+    previous_db_file = None if args.full else latest_db_file(args.data_dir)
+
+    def show_progress(stats):
+        log(
+            args,
+            f"  {stats.bytes_read / 1e6:,.0f} / {stats.bytes_total / 1e6:,.0f} MB read - "
+            f"{stats.workouts:,} new workouts ({stats.workouts_skipped:,} already ingested), "
+            f"{stats.points:,} points, {stats.records:,} records "
+            f"({stats.rows_per_second:,.0f} rows/s)"
+            + (f" - {stats.stage}" if stats.stage else ""),
+        )
+
+    db_file, zip_file = convert_healthkit_export_to_sqlite(
+        args.export_zip,
+        progress_callback=show_progress,
+        activity_types=activity_types,
+        previous_db_file=previous_db_file,
+        workers=args.workers,
+        data_dir=args.data_dir,
+        compact_tracks=args.compact_tracks,
+    )
+    if db_file is None:
+        raise FileNotFoundError(zip_file)
+    log(args, f"  {db_file} ({args.export_zip.name} renamed to {zip_file})")
+
+
+def summarise(args):
+    from helper_app import BACKEND_PARQUET, summary_file
+    from helper_geocode import LOCATION_CACHE_FILE, LocationCache
+    from helper_parquet import parquet_store_path
+    from walk_data_aux import create_walk_workout_summary, export_sqlite_to_parquet
+
+    db_file = latest_db_file(args.data_dir)
+    if db_file is None:
+        raise FileNotFoundError(f"No database in {args.data_dir}: convert an export first")
+    source = db_file
+    if args.backend == BACKEND_PARQUET:
+        source = parquet_store_path(db_file)
+        if not source.exists():
+            export_sqlite_to_parquet(db_file)
+    location_cache = LocationCache(args.data_dir / LOCATION_CACHE_FILE.name)
+    output_file = create_walk_workout_summary(
+        source,
+        output_file=args.data_dir / summary_file(args.backend).name,
+        location_cache=location_cache,
+    )
+    log(
+        args,
+        f"  {output_file} (location cache: {location_cache.hits:,} hits, "
+        f"{location_cache.misses:,} misses)",
+    )
+
+
+def export(args):
+    # The Parquet track store of the most recent database, unless it is newer than the
+    # database already (e.g. written by summarise --backend Parquet) and not --force
+    from helper_parquet import parquet_store_path
+    from walk_data_aux import export_sqlite_to_parquet
+
+    db_file = latest_db_file(args.data_dir)
+    if db_file is None:
+        raise FileNotFoundError(f"No database in {args.data_dir}: convert an export first")
+    store_dir = parquet_store_path(db_file)
+    if (
+        not args.force
+        and store_dir.exists()
+        and store_dir.stat().st_mtime >= Path(db_file).stat().st_mtime
+    ):
+        log(args, f"  {store_dir} is up to date")
+        return
+    log(args, f"  {export_sqlite_to_parquet(db_file)}")
+
+
+def migrate(args):
+    # Backfills the derived tables of the most recent database (see
+    # walk_data_aux.migrate_database), which summarise only reads
+    from walk_data_aux import migrate_database
+
+    db_file = latest_db_file(args.data_dir)
+    if db_file is None:
+        raise FileNotFoundError(f"No database in {args.data_dir}: convert an export first")
+    migrate_database(db_file)
+    log(args, f"  {db_file}")
+
+
+def run(args):
+    if not args.export_zip.exists():
+        # Nothing new to convert, so nothing to refresh
+        log(args, f"{args.export_zip} not found: nothing to do")
+        return NOTHING_TO_DO_STATUS
+    run_stages(args, [convert, summarise, export])
+    return 0
+
+
+def run_stages(args, stages):
+    for stage in stages:
+        log(args, f"{stage.__name__}...")
+        start = time.perf_counter()
+        stage(args)
+        log(args, f"{stage.__name__}: {time.perf_counter() - start:.1f} s")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert a HealthKit export.zip, summarise the walks and export the "
+        "tracks, as the app's convert and summary pages do"
+    )
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    parser.add_argument("--quiet", action="store_true", help="no progress output")
+    parser.add_argument(
+        "--verbose", action="store_true", help="the traceback of a failed stage"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = argparse.ArgumentParser(add_help=False)
+    convert_parser.add_argument("export_zip", type=Path)
+    convert_parser.add_argument(
+        "--activity-types",
+        nargs="+",
+        default=[WALKING],
+        help=f"HKWorkoutActivityType... names, '{WALKING}' (walking and hiking, the "
+        "default) or 'all' (every workout type and all Records)",
+    )
+    convert_parser.add_argument(
+        "--full",
+        action="store_true",
+        help="a new database rather than adding the new workouts to a copy of the most "
+        "recent one (the default)",
+    )
+    convert_parser.add_argument("--workers", type=int, help="default: all cores")
+    convert_parser.add_argument(
+        "--compact-tracks",
+        action="store_true",
+        help="store each workout's track as compact blobs in place of its points' rows "
+        "(faster maps, a far smaller database, no accuracy, course or speed)",
+    )
+
+    summarise_parser = argparse.ArgumentParser(add_help=False)
+    summarise_parser.add_argument(
+        "--backend", choices=["SQLite", "Parquet"], default="SQLite"
+    )
+
+    export_parser = argparse.ArgumentParser(add_help=False)
+    export_parser.add_argument(
+        "--force", action="store_true", help="even if the track store is up to date"
+    )
+
+    commands.add_parser(
+        "convert",
+        parents=[convert_parser],
+        help="export.zip to a SQLite database (by default the most recent one plus the "
+        "new workouts, see --full)",
+    ).set_defaults(stage=convert)
+    commands.add_parser(
+        "summarise", parents=[summarise_parser], help="the workouts summary"
+    ).set_defaults(stage=summarise)
+    commands.add_parser(
+        "export", parents=[export_parser], help="the points to a Parquet track store"
+    ).set_defaults(stage=export)
+    commands.add_parser(
+        "migrate",
+        help="add the tables the maps need to a database converted by "
+        "healthkit-to-sqlite or an older version",
+    ).set_defaults(stage=migrate)
+    commands.add_parser(
+        "run",
+        parents=[convert_parser, summarise_parser, export_parser],
+        help="convert, summarise and export (nothing, with exit status "
+        f"{NOTHING_TO_DO_STATUS}, if export.zip doesn't exist)",
+    ).set_defaults(stage=run)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        if args.stage is run:
+            return run(args)
+        run_stages(args, [args.stage])
+    except Exception as e:
+        if args.verbose:
+            traceback.print_exc()
+        print(f"{args.command} failed: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+# Bulk import of GPX files (e.g. walks recorded outside Apple Health) into the workout
+# database, so they can be summarised, labelled and mapped like the HealthKit workouts
+
+#   - The GPX files of a directory (searched recursively) or a zip archive are parsed
+#     across a process pool into columnar arrays (helper_gpx) and written to the same
+#     `workouts` / `workout_points` tables as walk_data_ingest, in file name order
+#   - Each file becomes one workout (by default a walk) spanning its timed points. Its
+#     start date is written as HealthKit writes them, local time in TIMEZONE (e.g.
+#     "2020-01-01 11:00:00 +1100"), so the workout's UUID is derived by
+#     uuid_from_datetime from the local date/time as for any other workout
+#   - Files starting at the same time (UUID) as a workout already in the database, or
+#     an earlier file of the same import, are skipped; files which can't be parsed or
+#     have no timed points are reported and skipped
+#   - Progress and throughput (files and points per second) are reported through a
+#     callback, and the new workouts' simplified tracks, statistics, spatial index
+#     entries, compact tracks (if the database has them) and density grid counts are
+#     built as after an ingest
+
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from xml.parsers import expat
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from sqlite_utils import Database
+
+from helper_datetime import TIMEZONE
+from helper_gpx import gpx_points_to_arrays, read_gpx_file
+from walk_data_ingest import (
+    BATCH_SIZE,
+    PROGRESS_INTERVAL_SECONDS,
+    ROUTES_PER_WORKER_CHUNK,
+    IngestStats,
+    IngestWriter,
+    build_derived_tables,
+    existing_workout_ids,
+    existing_workout_uuids,
+    workout_hash_id,
+    workout_uuid,
+)
+from walk_data_stats import haversine_metres, point_seconds
+
+GPX_SOURCE_NAME = "GPX import"
+GPX_ACTIVITY_TYPE = "HKWorkoutActivityTypeWalking"
+
+# Read by sql/select_star_walking_workouts.sql but not known for a GPX file: written as
+# NULL so the columns exist even in a database of only imported walks
+GPX_UNKNOWN_COLUMNS = [
+    "totalEnergyBurned",
+    "sourceVersion",
+    "metadata_HKWeatherTemperature",
+    "metadata_HKWeatherHumidity",
+    "metadata_HKElevationAscended",
+    "metadata_HKAverageMETs",
+]
+
+
+@dataclass
+class GpxImportStats(IngestStats):
+    # routes / routes_total count the GPX files and bytes_read / bytes_total their sizes
+    files_failed: list = field(default_factory=list)  # (file name, reason)
+
+    @property
+    def files_per_second(self):
+        elapsed = self.elapsed_seconds
+        return self.routes / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def points_per_second(self):
+        elapsed = self.elapsed_seconds
+        return self.points / elapsed if elapsed > 0 else 0.0
+
+
+def list_gpx_files(source):
+    # [(name, size in bytes)] of the GPX files in the directory or zip archive
+    source = Path(source)
+    if source.is_dir():
+        return [
+            (path.as_posix(), path.stat().st_size) for path in sorted(source.rglob("*.gpx"))
+        ]
+    with zipfile.ZipFile(source) as zip_ref:
+        return sorted(
+            (info.filename, info.file_size)
+            for info in zip_ref.infolist()
+            if info.filename.endswith(".gpx")
+        )
+
+
+def healthkit_date(seconds):
+    # Seconds since the epoch -> "YYYY-MM-DD HH:MM:SS +HHMM" in TIMEZONE
+    return datetime.fromtimestamp(seconds, ZoneInfo(TIMEZONE)).strftime(
+        "%Y-%m-%d %H:%M:%S %z"
+    )
+
+
+def gpx_track_summary(arrays):
+    # (start seconds, finish seconds, distance km) of the timed points, or None. The
+    # times may be UTC ("...Z") or have an offset ("...+10:00").
+    seconds = point_seconds(arrays["date"])
+    timed = ~np.isnan(seconds)
+    if not timed.any():
+        return None
+    seconds = seconds[timed]
+    latitudes = arrays["latitude"][timed]
+    longitudes = arrays["longitude"][timed]
+    metres = np.nansum(
+        haversine_metres(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+    )
+    return float(seconds.min()), float(seconds.max()), float(metres) / 1000
+
+
+def gpx_workout_record(name, summary, activity_type=GPX_ACTIVITY_TYPE):
+    # A workouts row for a GPX file, with the attributes HealthKit gives a workout (as
+    # text, as they are in the export) and its file name
+    start_seconds, finish_seconds, distance_km = summary
+    record = {
+        "workoutActivityType": activity_type,
+        "duration": str(round((finish_seconds - start_seconds) / 60, 4)),
+        "durationUnit": "min",
+        "totalDistance": str(round(distance_km, 4)),
+        "totalDistanceUnit": "km",
+        "sourceName": GPX_SOURCE_NAME,
+        "creationDate": healthkit_date(finish_seconds),
+        "startDate": healthkit_date(start_seconds),
+        "endDate": healthkit_date(finish_seconds),
+        "metadata_gpx_file": Path(name).name,
+        **{column: None for column in GPX_UNKNOWN_COLUMNS},
+    }
+    return {"id": workout_hash_id(record), **record}
+
+
+# Each worker process opens the zip archive (if the files are in one) once
+
+_worker_zip_ref = None
+
+
+def init_gpx_worker(archive):
+    global _worker_zip_ref
+    _worker_zip_ref = zipfile.ZipFile(archive) if archive is not None else None
+
+
+def parse_gpx(name):
+    # (summary or None, arrays or the reason the file can't be imported)
+    try:
+        if _worker_zip_ref is None:
+            arrays = read_gpx_file(name)
+        else:
+            with _worker_zip_ref.open(name) as gpx_fp:
+                arrays = gpx_points_to_arrays(gpx_fp)
+        summary = gpx_track_summary(arrays)
+    except (expat.ExpatError, KeyError, ValueError) as e:
+        return None, f"not a valid GPX file ({e})"
+    if summary is None:
+        return None, "no timed track points"
+    return summary, arrays
+
+
+def iter_parsed_gpx(archive, names, workers):
+    # Yields parse_gpx(name) for each name in the order given, a window of files at a
+    # time as walk_data_ingest.iter_parsed_routes
+    if workers <= 1:
+        init_gpx_worker(archive)
+        try:
+            yield from map(parse_gpx, names)
+        finally:
+            if _worker_zip_ref is not None:
+                _worker_zip_ref.close()
+            init_gpx_worker(None)
+        return
+    window = workers * ROUTES_PER_WORKER_CHUNK * 4
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_gpx_worker, initargs=(archive,)
+    ) as executor:
+        for start in range(0, len(names), window):
+            yield from executor.map(
+                parse_gpx, names[start : start + window], chunksize=ROUTES_PER_WORKER_CHUNK
+            )
+
+
+def import_gpx_files(
+    source,
+    db_file,
+    progress_callback=None,
+    activity_type=GPX_ACTIVITY_TYPE,
+    batch_size=BATCH_SIZE,
+    workers=None,
+):
+    # source: a directory of GPX files or a zip archive of them. workers is the number of
+    # processes parsing the files (default: all cores). Returns a GpxImportStats.
+    source = Path(source)
+    archive = None if source.is_dir() else source.as_posix()
+    gpx_files = list_gpx_files(source)
+    workers = workers or os.cpu_count() or 1
+    db = Database(db_file)
+    db.execute("PRAGMA synchronous = OFF")
+    stats = GpxImportStats(
+        bytes_total=sum(size for _, size in gpx_files), routes_total=len(gpx_files)
+    )
+    writer = IngestWriter(db, stats, batch_size)
+    skip_ids = existing_workout_ids(db)
+    skip_uuids = existing_workout_uuids(db)
+    last_progress = 0.0
+
+    names = [name for name, _ in gpx_files]
+    for (name, size), (summary, arrays) in zip(
+        gpx_files, iter_parsed_gpx(archive, names, workers)
+    ):
+        stats.routes += 1
+        stats.bytes_read += size
+        if summary is None:
+            stats.files_failed.append((name, arrays))
+        else:
+            record = gpx_workout_record(name, summary, activity_type)
+            uuid = workout_uuid(record["startDate"])
+            if record["id"] in skip_ids or uuid in skip_uuids:
+                stats.workouts_skipped += 1
+            else:
+                skip_uuids.add(uuid)
+                writer.add_workout(record)
+                writer.add_point_arrays(arrays, record["id"])
+        if (
+            progress_callback is not None
+            and stats.elapsed_seconds - last_progress > PROGRESS_INTERVAL_SECONDS
+        ):
+            last_progress = stats.elapsed_seconds
+            # Written first, so an import cancelled by the callback (a job) leaves only
+            # whole workouts behind
+            writer.flush()
+            progress_callback(stats)
+    writer.flush()
+    # Built for every workout missing them: the new ones, and those of an earlier import
+    # cancelled or failed before building them (which this import skipped)
+    build_derived_tables(db, stats=stats, progress_callback=progress_callback)
+    db.execute("PRAGMA synchronous = FULL")
+
+    if progress_callback is not None:
+        progress_callback(stats)
+    return stats
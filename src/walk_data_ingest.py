@@ -0,0 +1,595 @@
+# Native (in-process) ingest of an Apple HealthKit export.zip into SQLite
+
+#   - Streams export.xml straight out of the zip with an incremental iterparse,
+#     clearing elements as it goes so memory stays flat for multi-GB exports
+#   - Writes the same `workouts` / `workout_points` (and `r*` record) tables as
+#     `healthkit-to-sqlite`, so the SQL in `sql/` works unchanged
+#   - Inserts are batched, one transaction per batch, and progress (bytes read,
+#     rows written, rows per second) is reported through a callback
+#   - Optionally only workouts of the given `workoutActivityType`s (and the route GPX
+#     files they reference) are ingested, skipping the millions of Records
+#   - Optionally incremental: only workouts not already in the database (compared by the
+#     deterministic start date UUID, as workout ids differ between exports) are appended
+#   - Route GPX files are streamed straight from the zip and parsed across a process
+#     pool into columnar arrays, then written in export order (deterministic output)
+#   - Simplified tracks of the new workouts are precomputed for the maps (helper_simplify),
+#     as are (optionally) their compact tracks (helper_tracks, which then replace their
+#     workout_points rows), and their points are added to the density grid of the
+#     all-time heatmap (helper_density)
+#   - The defects in the export.xml of some iOS versions are repaired as it is read
+#     (RepairedXmlReader), rather than by unzipping and patching it on disk first
+
+import hashlib
+import json
+import os
+import re
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from uuid import UUID, uuid5
+from xml.etree import ElementTree as ET
+
+from sqlite_utils import Database
+
+from helper_density import build_density_grid
+from helper_gpx import FLOAT_COLUMNS, gpx_points_to_arrays
+from helper_simplify import build_simplified_tracks
+from helper_spatial import build_endpoints_rtree
+from helper_tracks import build_workout_tracks, drop_track_points, has_workout_tracks
+from walk_data_stats import build_workout_stats
+
+FIXED_NAMESPACE = UUID("d5c0f985-3af0-4cfd-8012-560516582f0f")
+
+BATCH_SIZE = 5000
+PROGRESS_INTERVAL_SECONDS = 0.5
+
+# Number of route files handed to each worker process at a time
+ROUTES_PER_WORKER_CHUNK = 8
+
+POINT_COLUMNS = [
+    "date",
+    "latitude",
+    "longitude",
+    "altitude",
+    "horizontalAccuracy",
+    "verticalAccuracy",
+    "course",
+    "speed",
+]
+
+
+def uuid_from_datetime(dt):
+    return uuid5(FIXED_NAMESPACE, dt)
+
+
+def workout_uuid(start_date):
+    # HealthKit dates look like "2019-06-11 15:00:42 +1000": the UUID is based on the local
+    # date/time part, matching the `uuid` column of workouts_summary.csv
+    return uuid_from_datetime(start_date[:19])
+
+
+@dataclass
+class IngestStats:
+    bytes_total: int = 0
+    bytes_read: int = 0
+    workouts: int = 0
+    workouts_skipped: int = 0
+    routes: int = 0
+    routes_total: int = 0
+    points: int = 0
+    records: int = 0
+    # Once the points are written, what build_derived_tables is doing
+    stage: str = None
+    started: float = field(default_factory=time.perf_counter)
+
+    @property
+    def rows(self):
+        return self.workouts + self.points + self.records
+
+    @property
+    def elapsed_seconds(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed_seconds
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def fraction_done(self):
+        # Reading export.xml and parsing the route files are counted as equal halves
+        xml_done = min(self.bytes_read / self.bytes_total, 1.0) if self.bytes_total else 0.0
+        routes_done = self.routes / self.routes_total if self.routes_total else xml_done
+        return (xml_done + routes_done) / 2
+
+
+class CountingReader:
+    # Wraps a file object so the ingest progress can be expressed in bytes of export.xml
+    # read, reporting it (at most every PROGRESS_INTERVAL_SECONDS) as the parser consumes it
+    def __init__(self, fp, stats, progress_callback=None):
+        self.fp = fp
+        self.stats = stats
+        self.progress_callback = progress_callback
+        self.last_progress = 0.0
+
+    def read(self, size=-1):
+        chunk = self.fp.read(size)
+        self.stats.bytes_read += len(chunk)
+        if (
+            self.progress_callback is not None
+            and self.stats.elapsed_seconds - self.last_progress > PROGRESS_INTERVAL_SECONDS
+        ):
+            self.last_progress = self.stats.elapsed_seconds
+            self.progress_callback(self.stats)
+        return chunk
+
+
+# Repairs of the export.xml of some iOS versions (see data/README.md), previously made on
+# disk by export.zip_fix_xml.sh (with data/patch.txt and sed):
+#   - The DOCTYPE's internal subset (the DTD) has malformed declarations. Nothing in the
+#     export depends on the DTD, so the DOCTYPE is dropped, leaving its newlines so that
+#     parse errors still give the line numbers of the original file
+#   - Some elements have a second startDate attribute which should be endDate (the
+#     script's `sed 's/startDate/endDate/2'`, here only renaming the second startDate
+#     attribute on a line rather than any second occurrence of the word)
+DOCTYPE_RE = re.compile(rb"<!DOCTYPE[^\[>]*(?:\[.*?\]\s*)?>", re.DOTALL)
+ROOT_ELEMENT_RE = re.compile(rb"<[A-Za-z_]")
+# (Starting with a literal, so the regex engine can skip ahead to each startDate)
+DUPLICATE_START_DATE_RE = re.compile(rb'( startDate="[^"\n]*"[^\n>]*? )startDate=')
+
+REPAIR_CHUNK_BYTES = 1024 * 1024
+# Beyond which a line (or the prolog) is passed on unrepaired rather than buffered further
+MAX_REPAIR_BUFFER_BYTES = 64 * 1024 * 1024
+
+
+class RepairedXmlReader:
+    # Wraps a file object, applying the repairs above as the parser reads it. Whole lines
+    # are repaired a chunk (REPAIR_CHUNK_BYTES) at a time, so memory use is bounded by the
+    # chunk size and nothing is written to disk.
+    def __init__(self, fp, chunk_bytes=REPAIR_CHUNK_BYTES):
+        self.fp = fp
+        self.chunk_bytes = chunk_bytes
+        self.pending = b""  # read but not yet repaired: an incomplete line (or prolog)
+        self.output = b""  # repaired, returned from output_offset on
+        self.output_offset = 0
+        self.in_prolog = True
+        self.eof = False
+
+    def read(self, size=-1):
+        while not self.eof and (
+            size < 0 or len(self.output) - self.output_offset < size
+        ):
+            self.fill()
+        end = len(self.output) if size < 0 else self.output_offset + size
+        chunk = self.output[self.output_offset : end]
+        self.output_offset += len(chunk)
+        return chunk
+
+    def fill(self):
+        data = self.fp.read(self.chunk_bytes)
+        self.eof = not data
+        data = self.pending + data
+        self.pending = b""
+        if not self.eof:
+            # Only whole lines (and, at the start, the whole DOCTYPE) are repaired
+            end = data.rfind(b"\n") + 1
+            complete = end > 0 and (
+                not self.in_prolog or self.strip_doctype(data[:end]) is not None
+            )
+            if not complete and len(data) < MAX_REPAIR_BUFFER_BYTES:
+                self.pending = data
+                return
+            if end > 0:
+                data, self.pending = data[:end], data[end:]
+        if self.in_prolog:
+            data = self.strip_doctype(data, final=True)
+            self.in_prolog = False
+        self.output = self.output[self.output_offset :] + DUPLICATE_START_DATE_RE.sub(
+            rb"\1endDate=", data
+        )
+        self.output_offset = 0
+
+    @staticmethod
+    def strip_doctype(text, final=False):
+        # text without its DOCTYPE, or None if more is needed to tell (unless final)
+        doctype = text.find(b"<!DOCTYPE")
+        root = ROOT_ELEMENT_RE.search(text)
+        if doctype == -1 or (root is not None and root.start() < doctype):
+            return text if root is not None or final else None
+        match = DOCTYPE_RE.match(text, doctype)
+        if match is None:
+            return text if final else None
+        return text[: match.start()] + b"\n" * match.group().count(b"\n") + text[match.end() :]
+
+
+def find_export_xml(zip_ref):
+    for info in zip_ref.infolist():
+        if Path(info.filename).name == "export.xml":
+            return info
+    raise FileNotFoundError(f"{zip_ref.filename}: no export.xml found in archive")
+
+
+def iter_top_level_elements(fp, tags):
+    # Yields (tag, element) for each element in `tags` once it has been fully parsed.
+    # Children of the root are cleared as soon as they end, so only one top level
+    # element (e.g. a Workout and its route) is ever held in memory.
+    context = ET.iterparse(fp, events=("start", "end"))
+    root = None
+    depth = 0
+    for event, el in context:
+        if event == "start":
+            if root is None:
+                root = el
+            depth += 1
+            continue
+        depth -= 1
+        if el.tag in tags:
+            yield el.tag, el
+        if depth == 1:
+            root.clear()
+
+
+def to_float(value):
+    return float(value) if value is not None else None
+
+
+def point_row(point, workout_id):
+    return (
+        point.get("date"),
+        *(to_float(point.get(column)) for column in POINT_COLUMNS[1:]),
+        workout_id,
+    )
+
+
+def workout_hash_id(record):
+    # Same content hash as sqlite-utils `hash_id` so ids match healthkit-to-sqlite databases
+    return hashlib.sha1(
+        json.dumps(record, separators=(",", ":"), sort_keys=True, default=repr).encode(
+            "utf8"
+        )
+    ).hexdigest()
+
+
+def workout_record(el):
+    record = dict(el.attrib)
+    for child in el.findall("MetadataEntry"):
+        record["metadata_" + child.attrib["key"]] = child.attrib["value"]
+    # Dump any WorkoutEvent in a nested list (stored as JSON) as healthkit-to-sqlite does
+    record["workout_events"] = [dict(child.attrib) for child in el.findall("WorkoutEvent")]
+    return record
+
+
+def health_record(el):
+    record = dict(el.attrib)
+    for child in el.findall("MetadataEntry"):
+        record["metadata_" + child.attrib["key"]] = child.attrib["value"]
+    return record
+
+
+def record_table_name(record_type):
+    return "r" + record_type.replace("HKQuantityTypeIdentifier", "").replace(
+        "HKCategoryTypeIdentifier", ""
+    )
+
+
+def create_workout_points_table(db):
+    if "workout_points" in db.table_names():
+        return
+    db["workout_points"].create(
+        {
+            "date": str,
+            "latitude": float,
+            "longitude": float,
+            "altitude": float,
+            "horizontalAccuracy": float,
+            "verticalAccuracy": float,
+            "course": float,
+            "speed": float,
+            "workout_id": str,
+        },
+        foreign_keys=[("workout_id", "workouts", "id")],
+    )
+
+
+def create_workout_points_indexes(db):
+    # (workout_id, date) lets the start/finish point of each workout be found with an
+    # index seek (see sql/select_start_finish_point_workout.sql), and including latitude
+    # and longitude makes it covering for the map lookups in helper_app, which then
+    # read a workout's track in date order without touching the table itself
+    if "workout_points" not in db.table_names():
+        return
+    with db.conn:
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_workout_points_workout_id_date_lat_lon "
+            "ON workout_points (workout_id, date, latitude, longitude)"
+        )
+        # Superseded by the covering index above
+        db.execute("DROP INDEX IF EXISTS idx_workout_points_workout_id_date")
+
+
+def build_derived_tables(
+    db, workout_ids=None, compact_tracks=False, stats=None, progress_callback=None
+):
+    # The index and the tables derived from the points: the simplified tracks, the track
+    # statistics, the spatial index, the compact tracks (if compact_tracks or the
+    # database already has them) and the density grid, of the given workouts or by
+    # default of every workout missing from them (e.g. in a database created by
+    # healthkit-to-sqlite or an older version of the ingest). With compact tracks the
+    # points are then dropped from workout_points (see helper_tracks), and the space
+    # they took reclaimed. Given stats, progress_callback(stats) is called with its
+    # stage set before each table is built (so a job can be cancelled between them).
+    def drop_points():
+        if drop_track_points(db, workout_ids):
+            db.vacuum()
+
+    compact = compact_tracks or has_workout_tracks(db)
+    stages = [
+        ("indexing the points", lambda: create_workout_points_indexes(db)),
+        ("simplifying the tracks", lambda: build_simplified_tracks(db, workout_ids)),
+        ("calculating the track statistics", lambda: build_workout_stats(db, workout_ids)),
+        ("indexing the start and finish", lambda: build_endpoints_rtree(db, workout_ids)),
+    ]
+    if compact:
+        stages.append(
+            ("building the compact tracks", lambda: build_workout_tracks(db, workout_ids))
+        )
+    stages.append(
+        ("binning the points for the heatmap", lambda: build_density_grid(db, workout_ids))
+    )
+    if compact:
+        # Last, as everything else is built from the points it drops
+        stages.append(("dropping the points the compact tracks replace", drop_points))
+    for stage, build in stages:
+        if stats is not None and progress_callback is not None:
+            stats.stage = stage
+            progress_callback(stats)
+        build()
+
+
+class IngestWriter:
+    # Accumulates rows and writes them in batches, one transaction per batch
+    def __init__(self, db, stats, batch_size=BATCH_SIZE):
+        self.db = db
+        self.stats = stats
+        self.batch_size = batch_size
+        self.workouts = []
+        self.points = []
+        self.records = {}
+        self.n_records = 0
+        self.activity_summaries = []
+        self.workout_ids = []
+
+    def add_workout(self, record):
+        self.workouts.append(record)
+        self.workout_ids.append(record["id"])
+        self.stats.workouts += 1
+
+    def add_points(self, rows):
+        for row in rows:
+            self.points.append(row)
+            if len(self.points) >= self.batch_size:
+                self.flush()
+
+    def add_point_arrays(self, arrays, workout_id):
+        # Columnar route from helper_gpx.gpx_points_to_arrays (NaN is stored as NULL,
+        # as is the date of a point without a <time>, as for the points embedded in
+        # export.xml)
+        n_points = len(arrays["date"])
+        self.add_points(
+            zip(
+                [date or None for date in arrays["date"].tolist()],
+                *(arrays[column].tolist() for column in FLOAT_COLUMNS),
+                [workout_id] * n_points,
+            )
+        )
+
+    def add_record(self, record):
+        self.records.setdefault(record_table_name(record.pop("type")), []).append(record)
+        self.n_records += 1
+        if self.n_records >= self.batch_size:
+            self.flush()
+
+    def add_activity_summary(self, record):
+        self.activity_summaries.append(record)
+        if len(self.activity_summaries) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with self.db.conn:
+            if self.workouts:
+                self.db["workouts"].insert_all(
+                    self.workouts, pk="id", alter=True, batch_size=self.batch_size
+                )
+                self.workouts = []
+            if self.points:
+                create_workout_points_table(self.db)
+                self.db.conn.executemany(
+                    f"INSERT INTO workout_points ({', '.join(POINT_COLUMNS)}, workout_id) "
+                    f"VALUES ({', '.join('?' * (len(POINT_COLUMNS) + 1))})",
+                    self.points,
+                )
+                self.stats.points += len(self.points)
+                self.points = []
+            for table, rows in self.records.items():
+                self.db[table].insert_all(
+                    rows,
+                    alter=True,
+                    column_order=["startDate", "endDate", "value", "unit"],
+                    batch_size=self.batch_size,
+                )
+            self.stats.records += self.n_records
+            self.records = {}
+            self.n_records = 0
+            if self.activity_summaries:
+                self.db["activity_summary"].insert_all(
+                    self.activity_summaries, alter=True, batch_size=self.batch_size
+                )
+                self.activity_summaries = []
+
+
+def existing_workout_ids(db):
+    if "workouts" not in db.table_names():
+        return set()
+    return {row[0] for row in db.execute("SELECT id FROM workouts")}
+
+
+def existing_workout_uuids(db):
+    if "workouts" not in db.table_names():
+        return set()
+    return {workout_uuid(row[0]) for row in db.execute("SELECT startDate FROM workouts")}
+
+
+# Each worker process opens the export.zip once and streams route members out of it
+
+_worker_zip_ref = None
+
+
+def init_route_worker(export_zip):
+    global _worker_zip_ref
+    _worker_zip_ref = zipfile.ZipFile(export_zip)
+
+
+def parse_route_member(member_name):
+    with _worker_zip_ref.open(member_name) as gpx_fp:
+        return gpx_points_to_arrays(gpx_fp)
+
+
+def iter_parsed_routes(export_zip, member_names, workers):
+    # Yields the parsed arrays for each route in the order given. Routes are submitted
+    # a window at a time so parsed-but-unwritten routes never pile up in memory.
+    if workers <= 1:
+        with zipfile.ZipFile(export_zip) as zip_ref:
+            for member_name in member_names:
+                with zip_ref.open(member_name) as gpx_fp:
+                    yield gpx_points_to_arrays(gpx_fp)
+        return
+    window = workers * ROUTES_PER_WORKER_CHUNK * 4
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_route_worker, initargs=(str(export_zip),)
+    ) as executor:
+        for start in range(0, len(member_names), window):
+            yield from executor.map(
+                parse_route_member,
+                member_names[start : start + window],
+                chunksize=ROUTES_PER_WORKER_CHUNK,
+            )
+
+
+def ingest_routes(export_zip, route_jobs, writer, workers, progress_callback=None):
+    writer.stats.routes_total = len(route_jobs)
+    last_progress = writer.stats.elapsed_seconds
+    member_names = [member_name for _, member_name in route_jobs]
+    for (workout_id, _), arrays in zip(
+        route_jobs, iter_parsed_routes(export_zip, member_names, workers)
+    ):
+        writer.add_point_arrays(arrays, workout_id)
+        writer.stats.routes += 1
+        if (
+            progress_callback is not None
+            and writer.stats.elapsed_seconds - last_progress > PROGRESS_INTERVAL_SECONDS
+        ):
+            last_progress = writer.stats.elapsed_seconds
+            progress_callback(writer.stats)
+
+
+def ingest_workout(el, writer, gpx_members, route_jobs, skip_ids, skip_uuids):
+    record = workout_record(el)
+    workout_id = workout_hash_id(record)
+    if workout_id in skip_ids or workout_uuid(record["startDate"]) in skip_uuids:
+        writer.stats.workouts_skipped += 1
+        return
+    writer.add_workout({"id": workout_id, **record})
+    # Points are either embedded (older exports) or in a GPX file referenced by the workout
+    writer.add_points(
+        point_row(location.attrib, workout_id)
+        for location in el.findall("WorkoutRoute/Location")
+    )
+    file_reference = el.find(".//FileReference")
+    if file_reference is not None:
+        gpx_member = gpx_members.get(Path(file_reference.attrib["path"]).name)
+        if gpx_member is not None:
+            # Parsed later (in parallel) by ingest_routes
+            route_jobs.append((workout_id, gpx_member))
+
+
+def ingest_healthkit_export(
+    export_zip,
+    db_file,
+    progress_callback=None,
+    batch_size=BATCH_SIZE,
+    activity_types=None,
+    incremental=False,
+    workers=None,
+    repair_xml=True,
+    compact_tracks=False,
+):
+    # activity_types=None ingests everything (as healthkit-to-sqlite does). Otherwise only
+    # workouts of those types are ingested and Records/ActivitySummaries are skipped.
+    # Workouts already in db_file are never ingested twice, so re-running against the
+    # same database with more activity types only adds the new workouts.
+    # incremental=True appends to an existing snapshot: workouts whose start date UUID is
+    # already present are skipped along with their points, and Records (which have no
+    # stable identity between exports) are not re-ingested.
+    # workers is the number of processes parsing route GPX files (default: all cores).
+    # repair_xml=False reads export.xml as is, without RepairedXmlReader's repairs.
+    # compact_tracks=True builds the compact tracks (see helper_tracks) in place of the
+    # workout_points rows, as does a database which already has them.
+    export_zip = Path(export_zip)
+    workers = workers or os.cpu_count() or 1
+    db = Database(db_file)
+    db.execute("PRAGMA synchronous = OFF")
+    stats = IngestStats()
+    writer = IngestWriter(db, stats, batch_size)
+    skip_ids = existing_workout_ids(db)
+    skip_uuids = existing_workout_uuids(db) if incremental else set()
+    if activity_types is None and not incremental:
+        tags = {"Record", "Workout", "ActivitySummary"}
+    else:
+        tags = {"Workout"}
+        activity_types = set(activity_types) if activity_types is not None else None
+
+    with zipfile.ZipFile(export_zip) as zip_ref:
+        export_xml = find_export_xml(zip_ref)
+        stats.bytes_total = export_xml.file_size
+        gpx_members = {
+            Path(info.filename).name: info.filename
+            for info in zip_ref.infolist()
+            if info.filename.endswith(".gpx")
+        }
+        route_jobs = []
+        with zip_ref.open(export_xml) as xml_fp:
+            xml_fp = CountingReader(xml_fp, stats, progress_callback)
+            if repair_xml:
+                xml_fp = RepairedXmlReader(xml_fp)
+            for tag, el in iter_top_level_elements(xml_fp, tags):
+                if tag == "Workout":
+                    if (
+                        activity_types is None
+                        or el.get("workoutActivityType") in activity_types
+                    ):
+                        ingest_workout(
+                            el, writer, gpx_members, route_jobs, skip_ids, skip_uuids
+                        )
+                elif tag == "Record":
+                    writer.add_record(health_record(el))
+                else:
+                    writer.add_activity_summary(dict(el.attrib))
+    writer.flush()
+    ingest_routes(export_zip, route_jobs, writer, workers, progress_callback)
+    writer.flush()
+    # An incremental snapshot is a copy of the previous database, which may predate some
+    # of the derived tables: its workouts are backfilled along with the new ones
+    build_derived_tables(
+        db,
+        None if incremental else writer.workout_ids,
+        compact_tracks=compact_tracks,
+        stats=stats,
+        progress_callback=progress_callback,
+    )
+    db.execute("PRAGMA synchronous = FULL")
+
+    if progress_callback is not None:
+        progress_callback(stats)
+    return stats
@@ -0,0 +1,208 @@
+# Per-workout track statistics, calculated from workout_points with NumPy
+#
+#   - Distance (haversine, summed over the segments between consecutive points)
+#   - Moving time versus stopped time (from the speed over each segment)
+#   - Cumulative ascent and descent (from the altitude, lightly smoothed)
+#   - Pace splits (the time taken for each whole km)
+#
+# Each workout's statistics come from one vectorised pass over its points. The whole
+# database is processed in chunks of workouts (one query per chunk), so memory use is
+# bounded by the chunk size, not the number of points, and the results are written to
+# the workout_stats table.
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from helper_datetime import datetimes_to_seconds
+
+EARTH_RADIUS_METRES = 6_371_008.8
+
+# A segment slower than this, or spanning a gap in the recording longer than this, is
+# counted as stopped
+MOVING_SPEED_METRES_PER_SECOND = 0.5
+MAX_MOVING_SEGMENT_SECONDS = 120
+
+# Moving average (in points) applied to the altitude before summing the climbs, as
+# GPS altitude jitters by a few metres from point to point
+ALTITUDE_SMOOTHING_POINTS = 5
+
+SPLIT_METRES = 1000
+
+STATS_CHUNK_WORKOUTS = 200
+
+# Workouts with any points (those without, e.g. indoor walks, have nothing to calculate)
+WORKOUTS_WITH_POINTS_SQL = (
+    "SELECT id FROM workouts WHERE EXISTS "
+    "(SELECT 1 FROM workout_points WHERE workout_id = workouts.id)"
+)
+
+STATS_COLUMNS = {
+    "workout_id": str,
+    "n_points": int,
+    "distance_km": float,
+    "elapsed_time_hours": float,
+    "moving_time_hours": float,
+    "stopped_time_hours": float,
+    "ascent_m": float,
+    "descent_m": float,
+    "average_pace_min_per_km": float,
+    "moving_pace_min_per_km": float,
+    # JSON list: seconds taken for each whole km
+    "split_seconds_per_km": str,
+}
+
+
+def point_seconds(dates):
+    # Seconds since the epoch of the points' dates: "...Z" from the route GPX files, or
+    # "2019-06-11 15:00:42 +1000" as embedded in older exports (see helper_datetime).
+    # NaN where a point has no date.
+    return datetimes_to_seconds(np.asarray(dates, dtype=object))
+
+
+def haversine_metres(latitudes_1, longitudes_1, latitudes_2, longitudes_2):
+    latitudes_1, longitudes_1, latitudes_2, longitudes_2 = map(
+        np.radians, (latitudes_1, longitudes_1, latitudes_2, longitudes_2)
+    )
+    a = (
+        np.sin((latitudes_2 - latitudes_1) / 2) ** 2
+        + np.cos(latitudes_1)
+        * np.cos(latitudes_2)
+        * np.sin((longitudes_2 - longitudes_1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_METRES * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def elevation_change(altitudes):
+    # (ascent, descent) in metres, ignoring points without an altitude
+    altitudes = altitudes[~np.isnan(altitudes)]
+    if len(altitudes) >= ALTITUDE_SMOOTHING_POINTS:
+        altitudes = np.convolve(
+            altitudes,
+            np.full(ALTITUDE_SMOOTHING_POINTS, 1 / ALTITUDE_SMOOTHING_POINTS),
+            mode="valid",
+        )
+    climbs = np.diff(altitudes)
+    return float(climbs[climbs > 0].sum()), float(-climbs[climbs < 0].sum())
+
+
+def pace_splits(cumulative_metres, elapsed_seconds):
+    # Seconds taken for each whole SPLIT_METRES (interpolating between points)
+    marks = np.arange(SPLIT_METRES, cumulative_metres[-1] + 1e-9, SPLIT_METRES)
+    if len(marks) == 0:
+        return np.empty(0)
+    return np.diff(np.interp(marks, cumulative_metres, elapsed_seconds), prepend=0.0)
+
+
+def pace_min_per_km(seconds, metres):
+    return seconds / 60 / (metres / 1000) if metres > 0 else None
+
+
+def track_stats(seconds, latitudes, longitudes, altitudes):
+    # seconds, latitudes, longitudes, altitudes: arrays of a workout's points in date
+    # order. Points without a date (NaN seconds) are left out.
+    timed = ~np.isnan(seconds)
+    if not timed.all():
+        seconds, latitudes, longitudes, altitudes = (
+            values[timed] for values in (seconds, latitudes, longitudes, altitudes)
+        )
+    start_seconds = seconds[0] if len(seconds) else 0.0
+    distances = np.nan_to_num(
+        haversine_metres(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+    )
+    durations = np.diff(seconds)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speeds = distances / durations
+    moving = (
+        (durations > 0)
+        & (durations <= MAX_MOVING_SEGMENT_SECONDS)
+        & (speeds >= MOVING_SPEED_METRES_PER_SECOND)
+    )
+    elapsed_seconds = float(seconds[-1] - start_seconds) if len(seconds) else 0.0
+    moving_seconds = float(durations[moving].sum())
+    metres = float(distances.sum())
+    ascent, descent = elevation_change(altitudes)
+    splits = pace_splits(np.r_[0.0, np.cumsum(distances)], seconds - start_seconds)
+    return {
+        "n_points": len(seconds),
+        "distance_km": metres / 1000,
+        "elapsed_time_hours": elapsed_seconds / 3600,
+        "moving_time_hours": moving_seconds / 3600,
+        "stopped_time_hours": (elapsed_seconds - moving_seconds) / 3600,
+        "ascent_m": ascent,
+        "descent_m": descent,
+        "average_pace_min_per_km": pace_min_per_km(elapsed_seconds, metres),
+        "moving_pace_min_per_km": pace_min_per_km(moving_seconds, metres),
+        "split_seconds_per_km": json.dumps(np.round(splits, 1).tolist()),
+    }
+
+
+def iter_workout_points(conn, workout_ids, chunk_workouts=STATS_CHUNK_WORKOUTS):
+    # Yields (workout_id, DataFrame of its points in date order), reading the points of
+    # chunk_workouts workouts at a time
+    for start in range(0, len(workout_ids), chunk_workouts):
+        points_df = pd.read_sql_query(
+            "SELECT workout_id, date, latitude, longitude, altitude FROM workout_points "
+            "WHERE workout_id IN (SELECT value FROM json_each(?)) "
+            "ORDER BY workout_id, date",
+            conn,
+            params=(json.dumps(workout_ids[start : start + chunk_workouts]),),
+        )
+        yield from points_df.groupby("workout_id", sort=False)
+
+
+def create_workout_stats_table(db):
+    if "workout_stats" in db.table_names():
+        return
+    db["workout_stats"].create(
+        STATS_COLUMNS,
+        pk="workout_id",
+        foreign_keys=[("workout_id", "workouts", "id")],
+    )
+
+
+def build_workout_stats(
+    db, workout_ids=None, chunk_workouts=STATS_CHUNK_WORKOUTS, progress_callback=None
+):
+    # Calculates (or recalculates) the statistics of the given workouts (default: every
+    # workout which has points but no statistics yet). progress_callback(n_done, n_total)
+    # is called after each chunk. Returns the number of workouts done.
+    if "workout_points" not in db.table_names():
+        return 0
+    create_workout_stats_table(db)
+    if workout_ids is None:
+        workout_ids = [
+            row[0]
+            for row in db.execute(
+                WORKOUTS_WITH_POINTS_SQL
+                + " AND id NOT IN (SELECT workout_id FROM workout_stats)"
+            )
+        ]
+    workout_ids = list(workout_ids)
+    insert_sql = (
+        f"INSERT OR REPLACE INTO workout_stats ({', '.join(STATS_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(STATS_COLUMNS))})"
+    )
+    n_workouts = 0
+    rows = []
+    for workout_id, points_df in iter_workout_points(db.conn, workout_ids, chunk_workouts):
+        stats = track_stats(
+            point_seconds(points_df["date"]),
+            points_df["latitude"].to_numpy(dtype=np.float64),
+            points_df["longitude"].to_numpy(dtype=np.float64),
+            points_df["altitude"].to_numpy(dtype=np.float64),
+        )
+        rows.append((workout_id, *stats.values()))
+        n_workouts += 1
+        if len(rows) >= chunk_workouts:
+            with db.conn:
+                db.conn.executemany(insert_sql, rows)
+            rows = []
+            if progress_callback is not None:
+                progress_callback(n_workouts, len(workout_ids))
+    with db.conn:
+        db.conn.executemany(insert_sql, rows)
+    if progress_callback is not None:
+        progress_callback(n_workouts, len(workout_ids))
+    return n_workouts
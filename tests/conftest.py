@@ -0,0 +1,129 @@
+import zipfile
+
+import pytest
+
+# A small export: records, an activity summary and three workouts whose routes are in
+# GPX files (as in recent exports), one point a minute heading south
+
+ROUTE_GPX = """<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="Apple Health Export" xmlns="http://www.topografix.com/GPX/1/1">
+ <metadata><time>2023-03-10T09:00:00Z</time></metadata>
+ <trk>
+  <name>Route {name}</name>
+  <trkseg>
+{points}
+  </trkseg>
+ </trk>
+</gpx>
+"""
+
+ROUTE_POINT = (
+    '   <trkpt lon="{longitude:.6f}" lat="{latitude:.6f}"><ele>{altitude:.1f}</ele>'
+    "<time>{time}</time><extensions><speed>1.8</speed><course>180.0</course>"
+    "<hAcc>3.0</hAcc><vAcc>2.0</vAcc></extensions></trkpt>"
+)
+
+# (workoutActivityType, day, number of points): each starts at 7am local time (9pm UTC
+# the day before) and has a point a minute
+EXPORT_WORKOUTS = [
+    ("HKWorkoutActivityTypeWalking", "2019-06-12", 11),
+    ("HKWorkoutActivityTypeCycling", "2019-06-13", 6),
+    ("HKWorkoutActivityTypeHiking", "2019-06-15", 21),
+]
+
+EXPORT_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<HealthData locale="en_AU">
+ <ExportDate value="2023-03-10 20:00:00 +1100"/>
+ <Me HKCharacteristicTypeIdentifierDateOfBirth=""/>
+ <Record type="HKQuantityTypeIdentifierStepCount" sourceName="iPhone" unit="count" creationDate="2019-06-12 08:00:00 +1000" startDate="2019-06-12 07:00:00 +1000" endDate="2019-06-12 07:10:00 +1000" value="1200"/>
+ <Record type="HKQuantityTypeIdentifierStepCount" sourceName="iPhone" unit="count" creationDate="2019-06-13 08:00:00 +1000" startDate="2019-06-13 07:00:00 +1000" endDate="2019-06-13 07:10:00 +1000" value="80"/>
+ <Record type="HKQuantityTypeIdentifierHeartRate" sourceName="Apple Watch" unit="count/min" creationDate="2019-06-12 07:05:00 +1000" startDate="2019-06-12 07:05:00 +1000" endDate="2019-06-12 07:05:00 +1000" value="96">
+  <MetadataEntry key="HKMetadataKeyHeartRateMotionContext" value="2"/>
+ </Record>
+{workouts}
+ <ActivitySummary dateComponents="2019-06-12" activeEnergyBurned="310" activeEnergyBurnedGoal="400" activeEnergyBurnedUnit="kJ" appleExerciseTime="10" appleExerciseTimeGoal="30" appleStandHours="9" appleStandHoursGoal="12"/>
+</HealthData>
+"""
+
+EXPORT_WORKOUT = """ <Workout workoutActivityType="{activity_type}" duration="{minutes}" durationUnit="min" totalDistance="{distance:.3f}" totalDistanceUnit="km" totalEnergyBurned="{minutes}0" totalEnergyBurnedUnit="kJ" sourceName="Apple Watch" sourceVersion="5.2.1" creationDate="{end} +1000" startDate="{start} +1000" endDate="{end} +1000">
+  <MetadataEntry key="HKIndoorWorkout" value="0"/>
+  <MetadataEntry key="HKWeatherTemperature" value="59 degF"/>
+  <MetadataEntry key="HKWeatherHumidity" value="6700 %"/>
+  <MetadataEntry key="HKElevationAscended" value="{minutes}00 cm"/>
+  <MetadataEntry key="HKAverageMETs" value="3.3 kcal/hr·kg"/>
+  <WorkoutEvent type="HKWorkoutEventTypeSegment" date="{start} +1000" duration="{minutes}" durationUnit="min"/>
+  <WorkoutRoute sourceName="Apple Watch" creationDate="{end} +1000" startDate="{start} +1000" endDate="{end} +1000">
+   <MetadataEntry key="HKMetadataKeySyncVersion" value="2"/>
+   <FileReference path="/workout-routes/{route_file}"/>
+  </WorkoutRoute>
+ </Workout>"""
+
+
+def route_gpx(utc_day, n_points):
+    points = [
+        ROUTE_POINT.format(
+            latitude=-33.8 - 0.001 * i,
+            longitude=151.2,
+            altitude=10.0 + i,
+            time=f"{utc_day}T21:{i:02d}:00Z",
+        )
+        for i in range(n_points)
+    ]
+    return ROUTE_GPX.format(name=utc_day, points="\n".join(points))
+
+
+def write_export_zip(export_zip, workouts=EXPORT_WORKOUTS):
+    with zipfile.ZipFile(export_zip, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        xml_workouts = []
+        for activity_type, day, n_points in workouts:
+            minutes = n_points - 1
+            route_file = f"route_{day}_7.{minutes:02d}am.gpx"
+            xml_workouts.append(
+                EXPORT_WORKOUT.format(
+                    activity_type=activity_type,
+                    minutes=minutes,
+                    distance=minutes * 0.111,
+                    start=f"{day} 07:00:00",
+                    end=f"{day} 07:{minutes:02d}:00",
+                    route_file=route_file,
+                )
+            )
+            utc_day = f"{day[:8]}{int(day[8:]) - 1:02d}"
+            zip_ref.writestr(
+                f"apple_health_export/workout-routes/{route_file}",
+                route_gpx(utc_day, n_points),
+            )
+        zip_ref.writestr(
+            "apple_health_export/export.xml",
+            EXPORT_XML.format(workouts="\n".join(xml_workouts)),
+        )
+    return export_zip
+
+
+@pytest.fixture
+def export_zip(tmp_path):
+    return write_export_zip(tmp_path / "export.zip")
+
+
+# An older export: the workout's route is embedded in export.xml as Locations, with
+# HealthKit's "+1000" dates (one of them missing)
+EMBEDDED_LOCATIONS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<HealthData locale="en_AU">
+ <Workout workoutActivityType="HKWorkoutActivityTypeWalking" duration="2" durationUnit="min" sourceName="Apple Watch" creationDate="2019-06-11 15:02:42 +1000" startDate="2019-06-11 15:00:42 +1000" endDate="2019-06-11 15:02:42 +1000">
+  <WorkoutRoute sourceName="Apple Watch" startDate="2019-06-11 15:00:42 +1000" endDate="2019-06-11 15:02:42 +1000">
+   <Location date="2019-06-11 15:00:42 +1000" latitude="-33.8000" longitude="151.2000" altitude="10" horizontalAccuracy="3" verticalAccuracy="2" course="0" speed="1.3"/>
+   <Location date="2019-06-11 15:01:42 +1000" latitude="-33.8005" longitude="151.2000" altitude="11" horizontalAccuracy="3" verticalAccuracy="2" course="0" speed="1.3"/>
+   <Location latitude="-33.8007" longitude="151.2000" altitude="11" horizontalAccuracy="3" verticalAccuracy="2" course="0" speed="1.3"/>
+   <Location date="2019-06-11 15:02:42 +1000" latitude="-33.8010" longitude="151.2000" altitude="12" horizontalAccuracy="3" verticalAccuracy="2" course="0" speed="1.3"/>
+  </WorkoutRoute>
+ </Workout>
+</HealthData>
+"""
+
+
+@pytest.fixture
+def embedded_export_zip(tmp_path):
+    export_zip = tmp_path / "export.zip"
+    with zipfile.ZipFile(export_zip, "w") as zip_ref:
+        zip_ref.writestr("apple_health_export/export.xml", EMBEDDED_LOCATIONS_XML)
+    return export_zip
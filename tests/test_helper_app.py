@@ -0,0 +1,207 @@
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlite_utils import Database
+
+import helper_app
+from helper_app import (
+    BACKEND_SQLITE,
+    WORKOUT_POINTS_CACHE,
+    WORKOUT_POINTS_SQL,
+    cached_read,
+    fetch_workout_points,
+    fetch_workouts_points,
+    get_latest_sqlite_file,
+    open_track_store,
+    query_workout_points,
+    read_workouts_labelled,
+    read_workouts_points,
+)
+from helper_labels import open_label_store, save_labels
+from walk_data_ingest import ingest_healthkit_export
+
+
+@pytest.fixture
+def db_file(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    ingest_healthkit_export(export_zip, db_file)
+    return db_file
+
+
+@pytest.fixture
+def db(db_file):
+    return Database(db_file)
+
+
+def test_fetch_workout_points(db):
+    workout_id, n_points = db.execute(
+        "SELECT workout_id, COUNT(*) FROM workout_points GROUP BY workout_id LIMIT 1"
+    ).fetchone()
+    points = fetch_workout_points(db.conn, workout_id)
+    assert points.shape == (n_points, 2)
+    # In date order (heading south)
+    assert (np.diff(points[:, 0]) < 0).all()
+    assert fetch_workout_points(db.conn, "unknown").shape == (0, 2)
+
+
+def test_workout_points_read_from_covering_index(db):
+    plan = " ".join(
+        row[-1] for row in db.execute("EXPLAIN QUERY PLAN " + WORKOUT_POINTS_SQL, ("",))
+    )
+    assert "COVERING INDEX idx_workout_points_workout_id_date_lat_lon" in plan
+
+
+def test_query_workout_points(db):
+    workout_id = db.execute("SELECT id FROM workouts LIMIT 1").fetchone()[0]
+    data_filtered_df = pd.DataFrame(
+        {"uuid": ["a", "b"], "workout_id": ["x", workout_id]}
+    )
+    np.testing.assert_array_equal(
+        query_workout_points("b", data_filtered_df, db.conn),
+        fetch_workout_points(db.conn, workout_id),
+    )
+
+
+def test_fetch_workouts_points(db):
+    workout_ids = [row[0] for row in db.execute("SELECT id FROM workouts ORDER BY id")]
+    # Duplicates and workouts without points are ignored
+    points = fetch_workouts_points(db.conn, [*workout_ids, "unknown", workout_ids[0]])
+    assert list(points) == workout_ids
+    for workout_id, track in points.items():
+        np.testing.assert_array_equal(track, fetch_workout_points(db.conn, workout_id))
+    # The temp table is refilled each time
+    assert list(fetch_workouts_points(db.conn, workout_ids[1:])) == workout_ids[1:]
+    assert fetch_workouts_points(db.conn, []) == {}
+
+
+def test_cached_read_until_changed(tmp_path):
+    csv_file = tmp_path / "walk_groups.csv"
+    csv_file.write_text("walk_group,walk_group_name\nGNW,Great North Walk\n")
+    walk_groups_df = cached_read(csv_file)
+    # A copy, as the pages modify it
+    walk_groups_df.loc[0, "walk_group"] = "XXX"
+    assert cached_read(csv_file)["walk_group"].tolist() == ["GNW"]
+    with open(csv_file, "a") as f:
+        f.write("RIV,Riverside\n")
+    assert cached_read(csv_file)["walk_group"].tolist() == ["GNW", "RIV"]
+
+
+def test_latest_sqlite_file_until_changed(tmp_path):
+    assert get_latest_sqlite_file(tmp_path)[1] == 0
+    db_file = tmp_path / "healthkit_db_2023_03_10.sqlite"
+    db_file.touch()
+    assert get_latest_sqlite_file(tmp_path) == (db_file.as_posix(), 1)
+
+
+def test_workout_points_cached(db_file, db):
+    conn = open_track_store(db_file)
+    workout_ids = [row[0] for row in db.execute("SELECT id FROM workouts")]
+    points = fetch_workout_points(conn, workout_ids[0])
+    hits = WORKOUT_POINTS_CACHE.hits
+    assert fetch_workout_points(conn, workout_ids[0]) is points
+    assert not points.flags.writeable
+    # Only the workouts not already cached are read
+    tracks = fetch_workouts_points(conn, workout_ids)
+    assert tracks[workout_ids[0]] is points
+    assert WORKOUT_POINTS_CACHE.hits == hits + 2
+    assert fetch_workouts_points(conn, workout_ids[1:])[workout_ids[1]] is (
+        tracks[workout_ids[1]]
+    )
+
+
+def test_cached_points_discarded_with_track_store(db_file, db, tmp_path, monkeypatch):
+    monkeypatch.setattr(helper_app, "CACHED_TRACK_STORES", 1)
+    conn = open_track_store(db_file)
+    workout_ids = [row[0] for row in db.execute("SELECT id FROM workouts")]
+    fetch_workouts_points(conn, workout_ids)
+    assert any(key[0] is conn for key in WORKOUT_POINTS_CACHE.entries)
+    # Opening another database evicts (and closes) the connection, and its entries go
+    other_db_file = tmp_path / "other.sqlite"
+    other_db_file.write_bytes(db_file.read_bytes())
+    open_track_store(other_db_file)
+    assert not any(key[0] is conn for key in WORKOUT_POINTS_CACHE.entries)
+
+
+@pytest.fixture
+def db_files(tmp_path):
+    db_files = []
+    for n in range(helper_app.CACHED_TRACK_STORES + 1):
+        db_file = tmp_path / f"healthkit_db_{n}.sqlite"
+        conn = sqlite3.connect(db_file)
+        conn.execute(
+            "CREATE TABLE workout_points (date TEXT, latitude FLOAT, longitude FLOAT, "
+            "workout_id TEXT)"
+        )
+        with conn:
+            conn.executemany(
+                "INSERT INTO workout_points VALUES (?, ?, ?, ?)",
+                [
+                    (f"2020-01-01T06:00:0{i}Z", -33.8 + i, 151.2, f"w{i % 3}")
+                    for i in range(9)
+                ],
+            )
+        conn.close()
+        db_files.append(db_file)
+    return db_files
+
+
+def is_closed(conn):
+    try:
+        conn.execute("SELECT 1")
+    except sqlite3.ProgrammingError:
+        return True
+    return False
+
+
+def test_track_store_reused_until_changed(db_files):
+    conn = open_track_store(db_files[0], BACKEND_SQLITE)
+    assert open_track_store(db_files[0].as_posix(), BACKEND_SQLITE) is conn
+    with sqlite3.connect(db_files[0]) as writer:
+        writer.execute("INSERT INTO workout_points VALUES ('', 0, 0, 'w9')")
+    assert open_track_store(db_files[0], BACKEND_SQLITE) is not conn
+    assert is_closed(conn)
+
+
+def test_least_recently_used_track_store_closed(db_files):
+    conns = [open_track_store(db_file, BACKEND_SQLITE) for db_file in db_files]
+    assert is_closed(conns[0])
+    assert not any(is_closed(conn) for conn in conns[1:])
+
+
+def test_read_workouts_points_threads(db_files):
+    conn = open_track_store(db_files[0], BACKEND_SQLITE)
+    results = []
+
+    def read(workout_ids):
+        for _ in range(50):
+            results.append(
+                {
+                    workout_id: len(points)
+                    for workout_id, points in read_workouts_points(
+                        conn, workout_ids, None
+                    ).items()
+                }
+            )
+
+    threads = [
+        threading.Thread(target=read, args=(workout_ids,))
+        for workout_ids in (["w0"], ["w1", "w2"], ["w0", "w2"])
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 150
+    assert all(set(result.values()) == {3} for result in results)
+
+
+def test_read_workouts_labelled_reads_given_store(tmp_path):
+    store_file = tmp_path / "walk_labels.sqlite"
+    conn = open_label_store(store_file, labels_csv=None)
+    save_labels(conn, [("uuid-1", "GNW"), ("uuid-2", "RIV")])
+    conn.close()
+    labels_df = read_workouts_labelled(store_file)
+    assert labels_df.values.tolist() == [["uuid-1", "GNW"], ["uuid-2", "RIV"]]
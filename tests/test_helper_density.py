@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from sqlite_utils import Database
+
+from helper_density import build_density_grid, heatmap_cells, read_density
+from walk_data_ingest import ingest_healthkit_export
+
+# (workout id, activity type, number of points)
+WORKOUTS = [
+    ("walk", "HKWorkoutActivityTypeWalking", 3),
+    ("hike", "HKWorkoutActivityTypeHiking", 2),
+    ("ride", "HKWorkoutActivityTypeCycling", 5),
+]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(tmp_path / "healthkit_db.sqlite")
+    db["workouts"].insert_all(
+        (
+            {"id": workout_id, "workoutActivityType": activity_type}
+            for workout_id, activity_type, _ in WORKOUTS
+        ),
+        pk="id",
+    )
+    db["workout_points"].insert_all(
+        {
+            "date": "",
+            "latitude": -33.8 + i * 1e-4,
+            "longitude": 151.2,
+            "workout_id": workout_id,
+        }
+        for workout_id, _, n_points in WORKOUTS
+        for i in range(n_points)
+    )
+    return db
+
+
+def test_only_walks_binned(db):
+    assert build_density_grid(db) == 2
+    assert read_density(db.conn)[1].sum() == 5
+    # Already binned: nothing to add
+    assert build_density_grid(db, ["walk", "hike", "ride"]) == 0
+    assert read_density(db.conn)[1].sum() == 5
+
+
+def test_ingest_bins_walks(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    ingest_healthkit_export(export_zip, db_file, workers=1)
+    # The walk and the hike's points, not the ride's
+    cells, n_points = read_density(Database(db_file).conn)
+    assert n_points.sum() == 11 + 21
+    latitudes, longitudes, _ = heatmap_cells(cells, n_points)
+    assert latitudes.min() > -33.83
+    assert longitudes.tolist() == pytest.approx([151.2005] * len(cells))
+
+
+def test_heatmap_cells_coarsened():
+    cells = np.arange(100, dtype=np.int64) * 7
+    n_points = np.arange(1, 101, dtype=np.int64)
+    latitudes, longitudes, coarse_points = heatmap_cells(cells, n_points, max_cells=20)
+    assert len(coarse_points) <= 20
+    assert coarse_points.sum() == n_points.sum()
+    assert len(latitudes) == len(longitudes) == len(coarse_points)
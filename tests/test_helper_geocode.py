@@ -0,0 +1,38 @@
+import reverse_geocode as rg
+
+from helper_geocode import LocationCache
+
+# Allambie Heights, but Frenchs Forest once rounded to the cache's 3 decimal places
+NEAR_BOUNDARY = (-33.76140466392237, 151.23382947114925)
+
+
+def test_lookup_geocodes_actual_coordinate():
+    cache = LocationCache(cache_file=None)
+    [location] = cache.lookup([NEAR_BOUNDARY[0]], [NEAR_BOUNDARY[1]])
+    assert location == rg.search([NEAR_BOUNDARY])[0]
+    assert location["city"] == "Allambie Heights"
+
+
+def test_lookup_cache(tmp_path):
+    cache_file = tmp_path / "location_cache.json"
+    cache = LocationCache(cache_file)
+    # Sydney (twice, within the same key) and Melbourne
+    latitudes = [-33.8688, -33.86881, -37.8136]
+    longitudes = [151.2093, 151.20931, 144.9631]
+    first = cache.lookup(latitudes, longitudes)
+    assert (cache.hits, cache.misses) == (0, 3)
+    assert first[0] == first[1]
+    assert [location["city"] for location in first[1:]] == ["Sydney", "Melbourne"]
+    cache.save()
+    cache = LocationCache(cache_file)
+    assert cache.lookup(latitudes, longitudes) == first
+    assert (cache.hits, cache.misses) == (3, 0)
+
+
+def test_least_recently_used_evicted():
+    cache = LocationCache(cache_file=None, max_entries=2)
+    cache.lookup([-33.8688], [151.2093])
+    cache.lookup([-37.8136], [144.9631])
+    cache.lookup([-33.8688], [151.2093])
+    cache.lookup([-27.4698], [153.0251])
+    assert cache.keys([-33.8688, -27.4698], [151.2093, 153.0251]) == list(cache.entries)
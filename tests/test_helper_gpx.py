@@ -0,0 +1,51 @@
+import io
+
+import numpy as np
+
+from helper_gpx import cached_gpx_track, cached_simplified_track, gpx_points_to_arrays
+
+GPX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="Apple Health Export" xmlns="http://www.topografix.com/GPX/1/1">
+ <metadata><time>2023-03-10T09:00:00Z</time></metadata>
+ <trk><trkseg>
+  <trkpt lon="151.200000" lat="-33.800000"><ele>10.5</ele><time>2019-06-11T21:00:00Z</time><extensions><speed>1.8</speed><course>180.0</course><hAcc>3.0</hAcc><vAcc>2.0</vAcc></extensions></trkpt>
+  <trkpt lon="151.200100" lat="-33.801000"><time>2019-06-11T21:01:00Z</time></trkpt>
+  <trkpt lon="151.200200" lat="-33.802000"><ele> 12 </ele></trkpt>
+ </trkseg></trk>
+</gpx>
+"""
+
+
+def test_gpx_points_to_arrays():
+    arrays = gpx_points_to_arrays(io.BytesIO(GPX))
+    assert arrays["date"].tolist() == [
+        "2019-06-11T21:00:00Z",
+        "2019-06-11T21:01:00Z",
+        "",
+    ]
+    np.testing.assert_array_equal(arrays["latitude"], [-33.8, -33.801, -33.802])
+    np.testing.assert_array_equal(arrays["longitude"], [151.2, 151.2001, 151.2002])
+    # Missing fields are NaN
+    np.testing.assert_array_equal(arrays["altitude"], [10.5, np.nan, 12.0])
+    np.testing.assert_array_equal(arrays["speed"], [1.8, np.nan, np.nan])
+    np.testing.assert_array_equal(arrays["horizontalAccuracy"], [3.0, np.nan, np.nan])
+
+
+def test_gpx_points_to_arrays_empty():
+    arrays = gpx_points_to_arrays(io.BytesIO(b"<gpx><trk><trkseg/></trk></gpx>"))
+    assert all(len(array) == 0 for array in arrays.values())
+
+
+def test_cached_gpx_track(tmp_path):
+    gpx_file = tmp_path / "route.gpx"
+    gpx_file.write_bytes(GPX)
+    arrays = cached_gpx_track(gpx_file)
+    assert cached_gpx_track(gpx_file) is arrays
+    assert arrays["date"][0] == "2019-06-11T21:00:00Z"
+    track = cached_simplified_track(gpx_file, 16)
+    assert cached_simplified_track(gpx_file, 16) is track
+    # A straight line simplifies to its ends
+    np.testing.assert_array_equal(track, [[-33.8, 151.2], [-33.802, 151.2002]])
+    # Read again once the file changes
+    gpx_file.write_bytes(GPX.replace(b"2019-06-11T21:00:00Z", b"2019-06-12T21:00:00Z"))
+    assert cached_gpx_track(gpx_file)["date"][0] == "2019-06-12T21:00:00Z"
@@ -0,0 +1,224 @@
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from helper_jobs import (
+    CANCELLED,
+    DONE,
+    FAILED,
+    INTERRUPTED,
+    JOB_FUNCTIONS,
+    QUEUED,
+    JobAlreadyActive,
+    JobRunner,
+    finish_job,
+    insert_job,
+    mark_interrupted_jobs,
+    open_job_store,
+    read_job,
+    request_cancel,
+    requeue_job,
+    run_job,
+)
+
+SRC_DIR = Path(__file__).parent.parent / "src"
+
+
+@pytest.fixture
+def store_file(tmp_path):
+    return tmp_path / "jobs.sqlite"
+
+
+@pytest.fixture
+def conn(store_file):
+    conn = open_job_store(store_file)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def stages_run(monkeypatch):
+    # A job of stages "first" and "second", failing in the second while fail_second is
+    # set, and cancelling itself (as if from the page) once the first is done while
+    # cancel_after_first is set
+    stages_run = []
+
+    def stages_job(job, fail_second=False, cancel_after_first=False):
+        if job.stage("first"):
+            stages_run.append("first")
+            job.stage_done("first", first_output="first.out")
+        if cancel_after_first:
+            request_cancel(job.conn, job.job.id)
+        if job.stage("second"):
+            stages_run.append("second")
+            job.progress(0.5, "half way")
+            if fail_second:
+                raise ValueError("second stage failed")
+            job.stage_done("second")
+
+    monkeypatch.setitem(JOB_FUNCTIONS, "stages", stages_job)
+    return stages_run
+
+
+def test_duplicate_active_key_rejected(conn):
+    job_id = insert_job(conn, "stages", "export.zip", {})
+    with pytest.raises(JobAlreadyActive) as e:
+        insert_job(conn, "stages", "export.zip", {})
+    assert e.value.job.id == job_id
+    # Only while the job is queued or running
+    assert insert_job(conn, "stages", "other.zip", {}) != job_id
+    finish_job(conn, job_id, DONE)
+    assert insert_job(conn, "stages", "export.zip", {}) > job_id
+
+
+def test_run_job(store_file, conn, stages_run):
+    job_id = insert_job(conn, "stages", "export.zip", {})
+    run_job(store_file, job_id)
+    job = read_job(conn, job_id)
+    assert job.status == DONE
+    assert job.state["stages_done"] == ["first", "second"]
+    assert job.state["first_output"] == "first.out"
+    assert stages_run == ["first", "second"]
+    # Only a job which didn't complete can be resumed
+    assert not requeue_job(conn, job_id)
+
+
+def test_resume_from_first_stage_not_done(store_file, conn, stages_run):
+    job_id = insert_job(conn, "stages", "export.zip", {"fail_second": True})
+    run_job(store_file, job_id)
+    job = read_job(conn, job_id)
+    assert job.status == FAILED
+    assert job.error.startswith("second stage failed")
+    assert job.resumable
+    # Not while another job with the key is active
+    other_job_id = insert_job(conn, "stages", "export.zip", {})
+    with pytest.raises(JobAlreadyActive):
+        requeue_job(conn, job_id)
+    finish_job(conn, other_job_id, CANCELLED)
+    with conn:
+        conn.execute("UPDATE jobs SET params = '{}' WHERE id = ?", (job_id,))
+    assert requeue_job(conn, job_id)
+    assert read_job(conn, job_id).status == QUEUED
+    run_job(store_file, job_id)
+    job = read_job(conn, job_id)
+    assert (job.status, job.error) == (DONE, None)
+    assert stages_run == ["first", "second", "second"]
+
+
+def test_cancel_queued_job(store_file, conn, stages_run):
+    job_id = insert_job(conn, "stages", "export.zip", {})
+    request_cancel(conn, job_id)
+    assert read_job(conn, job_id).status == CANCELLED
+    run_job(store_file, job_id)
+    assert read_job(conn, job_id).status == CANCELLED
+    assert stages_run == []
+
+
+def test_cancel_running_job(store_file, conn, stages_run):
+    job_id = insert_job(conn, "stages", "export.zip", {"cancel_after_first": True})
+    run_job(store_file, job_id)
+    job = read_job(conn, job_id)
+    assert job.status == CANCELLED
+    # Stopped at the next stage, keeping the stage done for a resume
+    assert job.state["stages_done"] == ["first"]
+    assert stages_run == ["first"]
+
+
+def test_mark_interrupted_jobs(conn):
+    # A job of a server process which has gone, and one of this process
+    process = subprocess.run(
+        [sys.executable, "-c", "import os; print(os.getpid())"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    gone_pid = int(process.stdout)
+    gone_job_id = insert_job(conn, "stages", "export.zip", {})
+    with conn:
+        conn.execute(
+            "UPDATE jobs SET runner_pid = ? WHERE id = ?", (gone_pid, gone_job_id)
+        )
+    job_id = insert_job(conn, "stages", "other.zip", {})
+    mark_interrupted_jobs(conn)
+    assert read_job(conn, gone_job_id).status == INTERRUPTED
+    assert read_job(conn, gone_job_id).resumable
+    assert read_job(conn, job_id).status == QUEUED
+    assert read_job(conn, job_id).active
+
+
+def test_page_imports_are_light():
+    # The jobs' modules are imported by the job functions (in the worker processes)
+    code = (
+        "import sys, helper_jobs; "
+        "print(sorted({'walk_data_aux', 'pendulum', 'reverse_geocode'} "
+        "& set(sys.modules)))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "[]"
+
+
+def test_runner_shared_by_threads(tmp_path):
+    runner = JobRunner(tmp_path / "jobs.sqlite", workers=1)
+    job_ids = []
+
+    def submit_and_poll(n):
+        for i in range(5):
+            # An unknown kind of job fails as soon as it runs
+            job_id = runner.submit("unknown", f"key {n} {i}", {})
+            job_ids.append(job_id)
+            runner.job(job_id)
+            runner.latest_job(f"key {n} {i}")
+
+    threads = [threading.Thread(target=submit_and_poll, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    deadline = time.monotonic() + 60
+    while any(runner.job(job_id).active for job_id in job_ids):
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+    assert len(job_ids) == 20
+    assert {runner.job(job_id).status for job_id in job_ids} == {FAILED}
+    runner.executor.shutdown()
+
+
+def test_convert_cancelled_between_build_stages(
+    store_file, conn, export_zip, monkeypatch
+):
+    import walk_data_ingest
+
+    built = []
+
+    def build_workout_stats(db, workout_ids):
+        built.append("statistics")
+        request_cancel(conn, job_id)
+
+    monkeypatch.setattr(walk_data_ingest, "build_workout_stats", build_workout_stats)
+    monkeypatch.setattr(
+        walk_data_ingest,
+        "build_endpoints_rtree",
+        lambda db, workout_ids: built.append("spatial index"),
+    )
+    job_id = insert_job(
+        conn,
+        "convert",
+        export_zip.as_posix(),
+        {"export_zip": export_zip.as_posix(), "workers": 1},
+    )
+    run_job(store_file, job_id)
+    assert read_job(conn, job_id).status == CANCELLED
+    # Stopped before the next stage, without leaving a half built database behind
+    assert built == ["statistics"]
+    assert not export_zip.with_name("healthkit_db.sqlite").exists()
+    assert export_zip.exists()
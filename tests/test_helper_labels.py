@@ -0,0 +1,73 @@
+import pandas as pd
+
+from helper_labels import (
+    NEXT_UNLABELLED_OF_SQL,
+    NEXT_UNLABELLED_SQL,
+    next_unlabelled_workout,
+    open_label_store,
+    read_labels,
+    save_label,
+    sync_summary_workouts,
+)
+
+SUMMARY_DF = pd.DataFrame(
+    {
+        "uuid": ["u3", "u1", "u2", "u4"],
+        "start_datetime": [
+            "2019-06-15 07:00:00",
+            "2019-06-12 07:00:00",
+            "2019-06-13 07:00:00",
+            "2019-06-16 07:00:00",
+        ],
+        "totaldistance_km": [2.2, 1.1, 0.5, 3.0],
+    }
+)
+
+
+def test_labels_csv_imported_into_new_store(tmp_path):
+    labels_csv = tmp_path / "workouts_labelled.csv"
+    labels_csv.write_text("uuid,walk_group\nu1,GNW\nu2,RIV\nu1,SCC\n")
+    conn = open_label_store(tmp_path / "walk_labels.sqlite", labels_csv)
+    # Where a workout was labelled more than once the last label wins
+    assert dict(read_labels(conn).values.tolist()) == {"u1": "SCC", "u2": "RIV"}
+    conn.close()
+    # Only when the store is created
+    labels_csv.write_text("uuid,walk_group\nu3,GNW\n")
+    conn = open_label_store(tmp_path / "walk_labels.sqlite", labels_csv)
+    assert len(read_labels(conn)) == 2
+
+
+def test_next_unlabelled_workout(tmp_path):
+    conn = open_label_store(tmp_path / "walk_labels.sqlite", labels_csv=None)
+    sync_summary_workouts(conn, SUMMARY_DF)
+    # The earliest unlabelled walk of at least the distance
+    assert next_unlabelled_workout(conn) == "u1"
+    assert next_unlabelled_workout(conn, 2.0) == "u3"
+    save_label(conn, "u1", "GNW")
+    assert next_unlabelled_workout(conn) == "u2"
+    # Workouts which are no longer in the summary aren't labelled, but keep their labels
+    sync_summary_workouts(conn, SUMMARY_DF[SUMMARY_DF["uuid"] != "u2"])
+    assert next_unlabelled_workout(conn) == "u3"
+    # Of the walks shown, when another session has synced a different summary
+    assert next_unlabelled_workout(conn, 0, ["u4", "u2"]) == "u4"
+    assert next_unlabelled_workout(conn, 0, ["u2"]) is None
+    assert next_unlabelled_workout(conn, 0, []) is None
+    save_label(conn, "u3", "RIV")
+    save_label(conn, "u4", "SCC")
+    assert next_unlabelled_workout(conn) is None
+    assert dict(read_labels(conn).values.tolist()) == {
+        "u1": "GNW",
+        "u3": "RIV",
+        "u4": "SCC",
+    }
+
+
+def test_next_unlabelled_workout_uses_partial_index(tmp_path):
+    conn = open_label_store(tmp_path / "walk_labels.sqlite", labels_csv=None)
+    queries = [(NEXT_UNLABELLED_SQL, (0,)), (NEXT_UNLABELLED_OF_SQL, (0, "[]"))]
+    for query, params in queries:
+        plan = " ".join(
+            row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)
+        )
+        assert "idx_workout_labels_unlabelled" in plan
+        assert "TEMP B-TREE" not in plan
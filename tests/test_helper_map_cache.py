@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+from helper_map_cache import GroupLayerCache, build_group_layer, group_fingerprint
+
+GROUP_DF = pd.DataFrame({"uuid": ["u1", "u2", "u3"], "workout_id": ["w1", "w2", "w3"]})
+
+TRACKS = {
+    "w1": np.array([[-33.8, 151.2], [-33.81, 151.21], [-33.82, 151.2]]),
+    # A single point: no line
+    "w2": np.array([[-33.9, 151.3]]),
+}
+
+
+def test_build_group_layer():
+    layer = build_group_layer(GROUP_DF, TRACKS, zoom=13)
+    geometries = [
+        (feature["properties"]["uuid"], feature["geometry"]["type"])
+        for feature in layer["features"]
+    ]
+    # w3 has no points
+    assert geometries == [("u1", "LineString"), ("u1", "Point"), ("u2", "Point")]
+    # Longitude, latitude
+    assert layer["features"][1]["geometry"]["coordinates"] == [151.2, -33.8]
+    assert layer["bbox"] == [151.2, -33.9, 151.3, -33.8]
+    assert "bbox" not in build_group_layer(GROUP_DF, {}, zoom=13)
+
+
+def test_group_fingerprint():
+    fingerprint = group_fingerprint(GROUP_DF, "healthkit_db.sqlite")
+    assert group_fingerprint(GROUP_DF[::-1], "healthkit_db.sqlite") == fingerprint
+    assert group_fingerprint(GROUP_DF[1:], "healthkit_db.sqlite") != fingerprint
+    assert group_fingerprint(GROUP_DF, "healthkit_db_2.sqlite") != fingerprint
+
+
+def test_group_layer_cache(tmp_path):
+    cache = GroupLayerCache(tmp_path)
+    builds = []
+
+    def build():
+        builds.append(1)
+        return build_group_layer(GROUP_DF, TRACKS, zoom=13)
+
+    layer = cache.get("GNW/1", "a" * 16, build)
+    assert cache.get("GNW/1", "a" * 16, build) == layer
+    assert (len(builds), cache.hits, cache.misses) == (1, 1, 1)
+    # A new fingerprint replaces the group's layer, leaving other groups' alone
+    cache.get("GNW_1", "a" * 16, build)
+    cache.get("GNW/1", "b" * 16, build)
+    assert len(builds) == 3
+    assert len(cache) == 2
+    assert sorted(path.name.split("-")[0] for path in cache.files()) == ["GNW_1"] * 2
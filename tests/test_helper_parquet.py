@@ -0,0 +1,70 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from sqlite_utils import Database
+
+from helper_app import fetch_workout_points, fetch_workouts_points
+from helper_geocode import LocationCache
+from helper_parquet import ParquetTrackStore, records_to_json
+from walk_data_aux import create_walk_workout_summary, export_sqlite_to_parquet
+from walk_data_ingest import ingest_healthkit_export
+
+
+@pytest.fixture
+def db_file(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    ingest_healthkit_export(export_zip, db_file)
+    return db_file
+
+
+def test_store_points(db_file):
+    store = ParquetTrackStore(export_sqlite_to_parquet(db_file))
+    conn = Database(db_file).conn
+    workout_ids = [row[0] for row in conn.execute("SELECT id FROM workouts")]
+    assert len(store) == 3
+    # One file for the month, with a row group for each workout
+    [file] = store.files
+    assert file.parent.name == "month=2019-06"
+    assert pq.ParquetFile(file).num_row_groups == 3
+    for workout_id in workout_ids:
+        np.testing.assert_array_equal(
+            store.workout_points(workout_id), fetch_workout_points(conn, workout_id)
+        )
+    tracks = store.workouts_points([*workout_ids[::-1], "unknown"])
+    expected_tracks = fetch_workouts_points(conn, workout_ids)
+    assert set(tracks) == set(expected_tracks) == set(workout_ids)
+    for workout_id, track in tracks.items():
+        np.testing.assert_array_equal(track, expected_tracks[workout_id])
+    assert store.workout_points("unknown").shape == (0, 2)
+
+
+def test_summary_from_store_metadata(db_file, tmp_path):
+    # The same summary as from the database
+    location_cache = LocationCache(cache_file=None)
+    summaries = [
+        create_walk_workout_summary(
+            source, tmp_path / f"{name}_summary.parquet", location_cache
+        )
+        for name, source in [
+            ("sqlite", db_file),
+            ("parquet", export_sqlite_to_parquet(db_file)),
+        ]
+    ]
+    pd.testing.assert_frame_equal(*(pd.read_parquet(summary) for summary in summaries))
+
+
+def test_records_to_json_full_precision():
+    df = pd.DataFrame(
+        {
+            "workout_id": ["a", "b"],
+            "latitude": [-33.80000123456789, np.nan],
+            "n_points": np.array([3, 4], dtype=np.int64),
+        }
+    )
+    assert json.loads(records_to_json(df)) == [
+        {"workout_id": "a", "latitude": -33.80000123456789, "n_points": 3},
+        {"workout_id": "b", "latitude": None, "n_points": 4},
+    ]
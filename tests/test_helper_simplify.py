@@ -0,0 +1,173 @@
+import math
+
+import numpy as np
+import pytest
+from sqlite_utils import Database
+
+from helper_app import fetch_workout_points
+from helper_simplify import (
+    SIMPLIFIED_ZOOM_LEVELS,
+    build_simplified_tracks,
+    choose_zoom_level,
+    simplify_mask,
+    stored_zoom_level,
+    tolerance_for_zoom,
+    zoom_for_bounds,
+)
+from walk_data_ingest import ingest_healthkit_export
+
+
+def douglas_peucker(points, tolerance):
+    # Recursive reference implementation, on the same projection as simplify_mask
+    y = points[:, 0]
+    x = points[:, 1] * math.cos(math.radians(float(np.mean(y))))
+    keep = np.zeros(len(points), dtype=bool)
+
+    def distance_to_segment(i, first, last):
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[i] - x[first], y[i] - y[first]
+        length_squared = dx * dx + dy * dy
+        t = (px * dx + py * dy) / length_squared if length_squared else 0
+        t = min(max(t, 0), 1)
+        return math.hypot(px - t * dx, py - t * dy)
+
+    def simplify(first, last):
+        keep[first] = keep[last] = True
+        if last - first < 2:
+            return
+        distances = [
+            distance_to_segment(i, first, last) for i in range(first + 1, last)
+        ]
+        split = first + 1 + int(np.argmax(distances))
+        if max(distances) > tolerance:
+            simplify(first, split)
+            simplify(split, last)
+
+    simplify(0, len(points) - 1)
+    return keep
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("zoom", [10, 13, 16])
+def test_simplify_mask_matches_recursive(seed, zoom):
+    # A random walk of ~10 m steps, with a loop back to the start
+    steps = np.random.default_rng(seed).normal(scale=1e-4, size=(2000, 2))
+    points = np.cumsum(steps, axis=0) + [-33.8, 151.2]
+    points = np.vstack([points, points[:1]])
+    tolerance = tolerance_for_zoom(zoom, -33.8)
+    keep = simplify_mask(points, tolerance)
+    np.testing.assert_array_equal(keep, douglas_peucker(points, tolerance))
+    assert keep.sum() < len(points)
+
+
+def test_simplify_mask_straight_line():
+    points = np.column_stack([np.linspace(-33.8, -33.9, 100), np.full(100, 151.2)])
+    assert np.flatnonzero(simplify_mask(points, 1e-6)).tolist() == [0, 99]
+    assert simplify_mask(points[:2], 1e-6).all()
+
+
+def test_zoom_levels():
+    # ~900 m across is ~470 px at zoom 16 (~2 m a pixel), so fits a 550 px wide map
+    latitudes = np.array([-33.8, -33.805])
+    longitudes = np.array([151.2, 151.21])
+    assert zoom_for_bounds(latitudes, longitudes, 550, 300) == 16
+    assert zoom_for_bounds(latitudes, longitudes, 400, 300) == 15
+    assert stored_zoom_level(15) == 16
+    assert stored_zoom_level(10) == 10
+    assert stored_zoom_level(17) is None
+    assert tolerance_for_zoom(13) == 2 * tolerance_for_zoom(14)
+
+
+def test_build_simplified_tracks(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    ingest_healthkit_export(export_zip, db_file)
+    db = Database(db_file)
+    zoom_levels = db.execute(
+        "SELECT DISTINCT workout_id, zoom FROM workout_points_simplified"
+    ).fetchall()
+    assert len(zoom_levels) == 3 * len(SIMPLIFIED_ZOOM_LEVELS)
+    # Each route is a straight line, so simplifies to its ends
+    workout_id = zoom_levels[0][0]
+    points = fetch_workout_points(db.conn, workout_id)
+    np.testing.assert_array_equal(
+        fetch_workout_points(db.conn, workout_id, zoom=12), points[[0, -1]]
+    )
+    # Beyond the stored levels the raw points are used
+    np.testing.assert_array_equal(
+        fetch_workout_points(db.conn, workout_id, zoom=18), points
+    )
+    # Everything is already simplified
+    assert build_simplified_tracks(db) == 0
+
+
+def test_choose_zoom_level():
+    n_points_by_level = {4: 100, 7: 1_000, 10: 10_000, 13: 50_000, 16: 200_000}
+    assert choose_zoom_level(15, n_points_by_level, max_points=50_000) == 13
+    assert choose_zoom_level(15, n_points_by_level, max_points=500) == 4
+    assert choose_zoom_level(15, n_points_by_level, max_points=50) == 4
+    assert choose_zoom_level(11, n_points_by_level, max_points=50_000) == 13
+    # Beyond the stored levels, the raw points if within max_points
+    assert choose_zoom_level(18, {None: 1_000}, max_points=50_000) is None
+    assert choose_zoom_level(18, {None: 60_000, 16: 200_000}, max_points=50_000) == 13
+    # A level without counts is taken as within max_points
+    assert choose_zoom_level(15, {}, max_points=50_000) == 16
+
+
+def test_missing_levels_backfilled(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    ingest_healthkit_export(export_zip, db_file)
+    db = Database(db_file)
+    levels = db.execute(
+        "SELECT workout_id, zoom, n_points FROM workout_points_levels ORDER BY 1, 2"
+    ).fetchall()
+    assert {n_points for _, _, n_points in levels} == {2}
+    # A database built before the overview levels, and their counts, were added
+    with db.conn:
+        db.conn.execute("DELETE FROM workout_points_simplified WHERE zoom IN (4, 7)")
+    db["workout_points_levels"].drop()
+    assert build_simplified_tracks(db) == 3
+    assert (
+        db.execute(
+            "SELECT workout_id, zoom, n_points FROM workout_points_levels ORDER BY 1, 2"
+        ).fetchall()
+        == levels
+    )
+    assert db["workout_points_simplified"].count == 2 * len(levels)
+
+
+def test_rebuild_replaces_tracks(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    ingest_healthkit_export(export_zip, db_file)
+    db = Database(db_file)
+    n_simplified = db["workout_points_simplified"].count
+    workout_ids = [row[0] for row in db.execute("SELECT id FROM workouts")]
+    assert build_simplified_tracks(db, workout_ids) == 3
+    assert db["workout_points_simplified"].count == n_simplified
+
+
+def test_workouts_without_points_not_reselected(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    ingest_healthkit_export(export_zip, db_file)
+    db = Database(db_file)
+    (workout_id, no_points_id) = [
+        row[0] for row in db.execute("SELECT id FROM workouts ORDER BY id LIMIT 2")
+    ]
+    with db.conn:
+        db.conn.execute(
+            "UPDATE workout_points SET latitude = NULL "
+            "WHERE rowid = (SELECT MIN(rowid) FROM workout_points WHERE workout_id = ?)",
+            (workout_id,),
+        )
+        db.conn.execute("DELETE FROM workout_points WHERE workout_id = ?", (no_points_id,))
+        db.conn.execute("DELETE FROM workout_points_levels")
+        db.conn.execute("DELETE FROM workout_points_simplified")
+    assert build_simplified_tracks(db) == 3
+    levels = dict(
+        db.execute(
+            "SELECT workout_id, SUM(n_points) FROM workout_points_levels GROUP BY 1"
+        ).fetchall()
+    )
+    # The point without a latitude is left out of the (straight line) track
+    assert levels[workout_id] == 2 * len(SIMPLIFIED_ZOOM_LEVELS)
+    assert levels[no_points_id] == 0
+    assert build_simplified_tracks(db) == 0
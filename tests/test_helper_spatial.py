@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sqlite_utils import Database
+
+from helper_app import open_spatial_index
+from helper_spatial import (
+    bounding_box,
+    build_endpoints_rtree,
+    suggest_walk_groups,
+    workouts_near,
+)
+from walk_data_ingest import ingest_healthkit_export
+from walk_data_stats import haversine_metres
+
+
+def create_db(db_file, endpoints):
+    # endpoints: {workout_id: (start latitude, start longitude, finish latitude,
+    # finish longitude)}, each workout having a midpoint as well
+    db = Database(db_file)
+    db["workouts"].insert_all(({"id": workout_id} for workout_id in endpoints), pk="id")
+    db["workout_points"].insert_all(
+        {
+            "date": f"2020-01-01T06:0{i}:00Z",
+            "latitude": latitude,
+            "longitude": longitude,
+            "workout_id": workout_id,
+        }
+        for workout_id, (lat_1, lon_1, lat_2, lon_2) in endpoints.items()
+        for i, (latitude, longitude) in enumerate(
+            [(lat_1, lon_1), ((lat_1 + lat_2) / 2, (lon_1 + lon_2) / 2), (lat_2, lon_2)]
+        )
+    )
+    db["workout_points"].create_index(["workout_id", "date"])
+    return db
+
+
+ENDPOINTS = {
+    "a": (-33.8, 151.2, -33.81, 151.2),
+    # Starting ~55 m from a, finishing ~55 m from a's finish
+    "b": (-33.8005, 151.2, -33.8105, 151.2),
+    # Starting where a finishes
+    "c": (-33.81, 151.2, -33.85, 151.25),
+    "melbourne": (-37.81, 144.96, -37.82, 144.97),
+}
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = create_db(tmp_path / "healthkit_db.sqlite", ENDPOINTS)
+    assert build_endpoints_rtree(db) == 4
+    # Only the workouts not yet indexed
+    assert build_endpoints_rtree(db) == 0
+    return db
+
+
+def endpoints_df(workout_ids):
+    return pd.DataFrame(
+        [(workout_id, *ENDPOINTS[workout_id]) for workout_id in workout_ids],
+        columns=[
+            "workout_id",
+            "start_latitude",
+            "start_longitude",
+            "finish_latitude",
+            "finish_longitude",
+        ],
+    )
+
+
+def test_workouts_near(db):
+    near_df = workouts_near(db.conn, -33.8, 151.2, 0.5)
+    assert near_df["workout_id"].tolist() == ["a", "b"]
+    assert near_df["endpoint"].tolist() == ["start", "start"]
+    assert near_df["distance_km"].tolist() == pytest.approx([0, 0.0556], abs=1e-3)
+    # The nearer endpoint of each workout
+    near_df = workouts_near(db.conn, -33.81, 151.2, 0.5)
+    assert dict(zip(near_df["workout_id"], near_df["endpoint"])) == {
+        "a": "finish",
+        "c": "start",
+        "b": "finish",
+    }
+    assert workouts_near(db.conn, -33.81, 151.2, 0.5, endpoints=[1])[
+        "workout_id"
+    ].tolist() == ["a", "b"]
+    assert workouts_near(db.conn, 0, 0, 10).empty
+
+
+def test_workouts_near_matches_brute_force(tmp_path):
+    rng = np.random.default_rng(0)
+    low, high = [-34.0, 151.0, -34.0, 151.0], [-33.6, 151.4, -33.6, 151.4]
+    points = rng.uniform(low, high, size=(500, 4))
+    endpoints = {f"w{i}": tuple(row) for i, row in enumerate(points)}
+    db = create_db(tmp_path / "healthkit_db.sqlite", endpoints)
+    build_endpoints_rtree(db)
+    for latitude, longitude in rng.uniform(low[:2], high[:2], size=(20, 2)):
+        distances_km = np.minimum(
+            haversine_metres(latitude, longitude, points[:, 0], points[:, 1]),
+            haversine_metres(latitude, longitude, points[:, 2], points[:, 3]),
+        ) / 1000
+        near_df = workouts_near(db.conn, latitude, longitude, 3.0)
+        # (Allowing for the R-tree's 32 bit coordinates at the edge of the circle)
+        assert {f"w{i}" for i in np.flatnonzero(distances_km <= 2.999)} <= set(
+            near_df["workout_id"]
+        ) <= {f"w{i}" for i in np.flatnonzero(distances_km <= 3.001)}
+        assert near_df["distance_km"].is_monotonic_increasing
+
+
+def test_suggest_walk_groups(db):
+    suggestions_df = suggest_walk_groups(
+        db.conn, endpoints_df(["b", "c"]), {"a": "GNW", "melbourne": "MEL"}
+    )
+    assert suggestions_df.values.tolist() == [
+        ["b", "GNW", 1.0, 1],
+        ["c", "GNW", 1.0, 1],
+    ]
+    # a's start and finish are near b's (GNW), its finish is c's start (RIV). A workout
+    # doesn't vote for itself.
+    suggestions_df = suggest_walk_groups(
+        db.conn, endpoints_df(["a", "b"]), {"b": "GNW", "c": "RIV"}
+    )
+    assert suggestions_df["workout_id"].tolist() == ["a", "b"]
+    assert suggestions_df["walk_group"].tolist() == ["GNW", "RIV"]
+    assert suggestions_df["share"].iloc[0] == pytest.approx(1.889 / 2.889, abs=1e-3)
+    assert suggestions_df["n_walks"].tolist() == [2, 1]
+    assert suggest_walk_groups(
+        db.conn, endpoints_df(["a"]), {"b": "GNW", "c": "RIV"}, min_share=0.7
+    ).empty
+    assert suggest_walk_groups(db.conn, endpoints_df(["a"]), {}).empty
+
+
+def test_bounding_box():
+    min_latitude, max_latitude, min_longitude, max_longitude = bounding_box(
+        [0, -60], [151.2, 151.2], 1
+    )
+    assert (max_latitude - min_latitude).tolist() == pytest.approx(
+        [0.018, 0.018], abs=1e-4
+    )
+    # Twice as wide in longitude at 60 degrees south
+    assert (max_longitude - min_longitude).tolist() == pytest.approx(
+        [0.018, 0.036], abs=1e-4
+    )
+
+
+def test_ingest_indexes_workouts(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    ingest_healthkit_export(export_zip, db_file)
+    conn = open_spatial_index(db_file)
+    # The workouts all start at the same point, finishing 0.111 km apart
+    near_df = workouts_near(conn, -33.8, 151.2, 0.1)
+    assert near_df["endpoint"].tolist() == ["start", "start", "start"]
+    assert workouts_near(conn, -33.805, 151.2, 0.05)["endpoint"].tolist() == ["finish"]
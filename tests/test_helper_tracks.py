@@ -0,0 +1,141 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlite_utils import Database
+
+from helper_app import fetch_workout_points, fetch_workouts_points
+from helper_parquet import ParquetTrackStore
+from helper_tracks import (
+    build_workout_tracks,
+    decode_points,
+    decode_track,
+    drop_track_points,
+    dropped_points_workout_ids,
+    encode_track,
+    has_workout_tracks,
+)
+from walk_data_aux import create_df_from_sql_query_in_file, export_sqlite_to_parquet
+from walk_data_ingest import ingest_healthkit_export
+from walk_data_stats import point_seconds
+
+
+def test_encode_decode_round_trip():
+    seconds = point_seconds(["2019-06-11 15:00:42 +1000", "", "2019-06-11T05:01:42Z"])
+    latitudes = np.array([-33.8, -33.80001, -33.80002])
+    longitudes = np.array([151.2, 151.20001, 151.20002])
+    altitudes = np.array([10.0, np.nan, 12.0])
+    row = encode_track(seconds, latitudes, longitudes, altitudes)
+    track = decode_track(row)
+    np.testing.assert_allclose(track["seconds"], seconds)
+    # float32: within ~1 m
+    np.testing.assert_allclose(track["latitude"], latitudes, atol=1e-5)
+    np.testing.assert_allclose(track["longitude"], longitudes, atol=1e-5)
+    np.testing.assert_allclose(track["altitude"], altitudes)
+    # A view of the blob
+    points = decode_points(row[3])
+    assert points.dtype == np.float32 and points.shape == (3, 2)
+    assert not points.flags.owndata
+
+
+def ingest_both(export_zip, tmp_path):
+    # The same export with and without compact tracks
+    db_file = tmp_path / "healthkit_db.sqlite"
+    ingest_healthkit_export(export_zip, db_file, workers=1, compact_tracks=True)
+    raw_db_file = tmp_path / "raw.sqlite"
+    ingest_healthkit_export(export_zip, raw_db_file, workers=1)
+    return Database(db_file), Database(raw_db_file)
+
+
+def test_maps_read_compact_tracks(export_zip, tmp_path):
+    db, raw_db = ingest_both(export_zip, tmp_path)
+    assert db["workout_tracks"].count == 3
+    # Only the first and last points are left in workout_points
+    assert db["workout_points"].count == 3 * 2
+    # Nothing left to build, and never rebuilt from what is left
+    workout_ids = [row[0] for row in db.execute("SELECT id FROM workouts ORDER BY id")]
+    assert build_workout_tracks(db) == 0
+    assert build_workout_tracks(db, workout_ids) == 0
+    points = fetch_workouts_points(db.conn, workout_ids)
+    assert sorted(len(track) for track in points.values()) == [6, 11, 21]
+    raw_points = fetch_workouts_points(raw_db.conn, workout_ids)
+    for workout_id in workout_ids:
+        np.testing.assert_allclose(points[workout_id], raw_points[workout_id], atol=1e-5)
+        np.testing.assert_array_equal(
+            fetch_workout_points(db.conn, workout_id), points[workout_id]
+        )
+
+
+def test_dropped_points_summarised_and_exported(export_zip, tmp_path):
+    db, raw_db = ingest_both(export_zip, tmp_path)
+    # The summary's start and finish points are those kept
+    for query in [
+        "select_start_finish_point_workout.sql",
+        "select_star_walking_workouts.sql",
+    ]:
+        pd.testing.assert_frame_equal(
+            create_df_from_sql_query_in_file(query, db.conn, None),
+            create_df_from_sql_query_in_file(query, raw_db.conn, None),
+        )
+    # Everything else was built from all the points
+    for table in ["workout_stats", "workout_points_levels"]:
+        query = f"SELECT * FROM {table} ORDER BY 1, 2"
+        assert db.execute(query).fetchall() == raw_db.execute(query).fetchall()
+    # (binned from the float32 tracks, so a point on a cell's edge may fall either side)
+    query = "SELECT SUM(n_points) FROM workout_points_density"
+    assert db.execute(query).fetchall() == raw_db.execute(query).fetchall()
+    # The Parquet export reads the points from the compact tracks
+    store = ParquetTrackStore(export_sqlite_to_parquet(tmp_path / "healthkit_db.sqlite"))
+    workout_ids = [row[0] for row in db.execute("SELECT id FROM workouts")]
+    raw_points = fetch_workouts_points(raw_db.conn, workout_ids)
+    for workout_id, points in store.workouts_points(workout_ids).items():
+        np.testing.assert_allclose(points, raw_points[workout_id], atol=1e-5)
+    assert len(store.workouts_points(workout_ids)) == 3
+
+
+def test_points_kept_unless_track_matches(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    ingest_healthkit_export(export_zip, db_file, workers=1)
+    db = Database(db_file)
+    assert drop_track_points(db) == 0
+    build_workout_tracks(db)
+    workout_id = db.execute("SELECT id FROM workouts ORDER BY id").fetchone()[0]
+    with db.conn:
+        db.conn.execute(
+            "UPDATE workout_points SET latitude = latitude + 0.001 WHERE rowid = "
+            "(SELECT MAX(rowid) FROM workout_points WHERE workout_id = ?)",
+            (workout_id,),
+        )
+    assert drop_track_points(db) == 2
+    assert dropped_points_workout_ids(db) == {
+        row[0] for row in db.execute("SELECT id FROM workouts WHERE id != ?", (workout_id,))
+    }
+    assert drop_track_points(db) == 0
+
+
+@pytest.mark.parametrize("compact_tracks", [False, True])
+def test_ingest_compact_tracks_optional(embedded_export_zip, tmp_path, compact_tracks):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    ingest_healthkit_export(
+        embedded_export_zip, db_file, workers=1, compact_tracks=compact_tracks
+    )
+    db = Database(db_file)
+    assert has_workout_tracks(db) == compact_tracks
+    if compact_tracks:
+        assert db.execute("SELECT n_points FROM workout_tracks").fetchall() == [(4,)]
+
+
+def test_build_workout_tracks_skips_workouts_without_points(
+    embedded_export_zip, tmp_path
+):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    ingest_healthkit_export(
+        embedded_export_zip, db_file, workers=1, compact_tracks=True
+    )
+    db = Database(db_file)
+    # e.g. an indoor walk
+    db["workouts"].insert({"id": "indoor"})
+    assert build_workout_tracks(db) == 0
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT COUNT(*) FROM workout_tracks").fetchone() == (1,)
@@ -0,0 +1,46 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from helper_geocode import LocationCache
+from synthetic_export import write_export_zip
+from walk_data_aux import (
+    convert_healthkit_export_to_sqlite,
+    create_walk_workout_summary,
+)
+
+
+def test_synthetic_export_converts(tmp_path):
+    export_zip = tmp_path / "export.zip"
+    n_points = write_export_zip(
+        export_zip, n_workouts=10, points_per_workout=30, n_records=8
+    )
+    assert n_points == 300
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    db_file, _ = convert_healthkit_export_to_sqlite(
+        export_zip, workers=1, data_dir=data_dir
+    )
+    assert db_file.parent == data_dir
+    conn = sqlite3.connect(db_file)
+    assert conn.execute(
+        "SELECT workoutActivityType, COUNT(*) FROM workouts GROUP BY 1 ORDER BY 1"
+    ).fetchall() == [
+        ("HKWorkoutActivityTypeHiking", 1),
+        ("HKWorkoutActivityTypeRunning", 1),
+        ("HKWorkoutActivityTypeWalking", 8),
+    ]
+    assert conn.execute("SELECT COUNT(*) FROM workout_points").fetchone() == (300,)
+    assert conn.execute("SELECT COUNT(*) FROM rHeartRate").fetchone() == (6,)
+    assert conn.execute("SELECT COUNT(*) FROM rStepCount").fetchone() == (2,)
+    # The walks and the hike, starting between 7am and 5pm local time and each lasting
+    # the route's 29 seconds
+    summary_file = create_walk_workout_summary(
+        db_file, tmp_path / "summary.csv", LocationCache(cache_file=None)
+    )
+    summary_df = pd.read_csv(summary_file)
+    assert len(summary_df) == 9
+    hours = pd.to_datetime(summary_df["startDate"]).dt.hour
+    assert hours.between(7, 16).all()
+    assert summary_df["elapsed_time_hours"].tolist() == pytest.approx([29 / 3600] * 9)
@@ -0,0 +1,154 @@
+import sqlite3
+import zipfile
+
+import pandas as pd
+import pendulum
+import pytest
+from healthkit_to_sqlite.utils import convert_xml_to_sqlite
+from sqlite_utils import Database
+
+from helper_app import file_signature
+from helper_geocode import LocationCache
+from walk_data_aux import (
+    TIMEZONE,
+    calculate_elapsed_time_hours,
+    convert_healthkit_export_to_sqlite,
+    convert_datetime_from_gmt_to_timezone,
+    create_df_from_sql_query_in_file,
+    create_walk_workout_summary,
+    migrate_database,
+    uuid_from_datetime,
+)
+from walk_data_ingest import ingest_healthkit_export
+
+# Either side of the change to and from daylight saving time in Sydney
+GMT_DATETIMES = pd.Series(
+    [
+        "2019-06-11T21:00:00Z",
+        "2022-04-02T15:59:59Z",
+        "2022-04-02T16:00:00Z",
+        "2022-10-01T15:59:59Z",
+        "2022-10-01T16:00:00Z",
+    ]
+)
+
+
+def test_convert_datetime_from_gmt_to_timezone():
+    # As previously converted one at a time with pendulum
+    timezone = pendulum.timezone(TIMEZONE)
+    expected = [
+        timezone.convert(pendulum.parse(datetime)).to_datetime_string()
+        for datetime in GMT_DATETIMES
+    ]
+    assert convert_datetime_from_gmt_to_timezone(GMT_DATETIMES).tolist() == expected
+
+
+def test_calculate_elapsed_time_hours():
+    elapsed = calculate_elapsed_time_hours(
+        pd.Series(["2019-06-11T21:10:00Z", "2019-06-11T22:00:00.9Z"]),
+        pd.Series(["2019-06-11T21:00:00Z", "2019-06-11T21:00:00Z"]),
+    )
+    # In whole seconds
+    assert elapsed.tolist() == [10 / 60, 1.0]
+
+
+def test_create_walk_workout_summary(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    ingest_healthkit_export(export_zip, db_file)
+    summary_file = create_walk_workout_summary(
+        db_file, tmp_path / "summary.csv", LocationCache(cache_file=None)
+    )
+    summary_df = pd.read_csv(summary_file).sort_values("startDate")
+    # The walk and the hike
+    assert summary_df["startDate"].tolist() == [
+        "2019-06-12 07:00:00",
+        "2019-06-15 07:00:00",
+    ]
+    assert summary_df["start_datetime"].tolist() == summary_df["startDate"].tolist()
+    elapsed_time_hours = summary_df["elapsed_time_hours"].tolist()
+    assert elapsed_time_hours == pytest.approx([10 / 60, 20 / 60])
+    assert summary_df["uuid"].tolist() == [
+        str(uuid_from_datetime(start_date)) for start_date in summary_df["startDate"]
+    ]
+
+
+def test_start_finish_points(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    ingest_healthkit_export(export_zip, db_file)
+    conn = Database(db_file).conn
+    endpoints_df = create_df_from_sql_query_in_file(
+        "select_start_finish_point_workout.sql", conn, None
+    )
+    # As found by ranking every point, one query for each end
+    expected_df = create_df_from_sql_query_in_file(
+        "select_start_point_workout.sql", conn, None
+    ).merge(
+        create_df_from_sql_query_in_file("select_finish_point_workout.sql", conn, None),
+        on="workout_id",
+    )
+    expected_df = expected_df[endpoints_df.columns].sort_values(
+        "workout_id", ignore_index=True
+    )
+    pd.testing.assert_frame_equal(endpoints_df, expected_df)
+    assert len(endpoints_df) == 3
+
+
+@pytest.mark.parametrize("name", ["export.zip", "export-1.zip", "healthkit_db.zip"])
+def test_convert_any_export_name(embedded_export_zip, tmp_path, name):
+    export_zip = embedded_export_zip.rename(tmp_path / name)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    db_file, zip_file = convert_healthkit_export_to_sqlite(
+        export_zip, workers=1, data_dir=data_dir
+    )
+    assert db_file.parent == data_dir
+    assert db_file.name.startswith("healthkit_db_")
+    assert zip_file.startswith((tmp_path / export_zip.stem).as_posix() + "_")
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT COUNT(*) FROM workout_points").fetchone() == (4,)
+
+
+DERIVED_TABLES = {
+    "workout_points_simplified",
+    "workout_points_levels",
+    "workout_stats",
+    "workout_endpoints_rtree",
+    "workout_points_density",
+}
+
+
+def test_summary_only_reads_database(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    with zipfile.ZipFile(export_zip) as zip_ref:
+        with zip_ref.open("apple_health_export/export.xml") as xml_fp:
+            convert_xml_to_sqlite(xml_fp, Database(db_file), zipfile=zip_ref)
+    signature, contents = file_signature(db_file), db_file.read_bytes()
+    create_walk_workout_summary(
+        db_file, tmp_path / "summary.csv", LocationCache(cache_file=None)
+    )
+    assert file_signature(db_file) == signature
+    assert db_file.read_bytes() == contents
+
+
+def test_migrate_database(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    with zipfile.ZipFile(export_zip) as zip_ref:
+        with zip_ref.open("apple_health_export/export.xml") as xml_fp:
+            convert_xml_to_sqlite(xml_fp, Database(db_file), zipfile=zip_ref)
+    assert not DERIVED_TABLES & set(Database(db_file).table_names())
+    migrate_database(db_file)
+    db = Database(db_file)
+    assert DERIVED_TABLES <= set(db.table_names())
+    assert db["workout_stats"].count == 3
+    # As if converted by the ingest
+    expected_db_file = tmp_path / "ingested.sqlite"
+    ingest_healthkit_export(export_zip, expected_db_file)
+    for table in ["workout_points_levels", "workout_points_density"]:
+        query = f"SELECT * FROM {table} ORDER BY 1, 2"
+        assert db.execute(query).fetchall() == (
+            Database(expected_db_file).execute(query).fetchall()
+        )
+    # Nothing left to do, so not written to
+    signature = file_signature(db_file)
+    migrate_database(db_file)
+    assert file_signature(db_file) == signature
@@ -0,0 +1,54 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+from walk_data_cli import NOTHING_TO_DO_STATUS, main
+
+SRC_DIR = Path(__file__).parent.parent / "src"
+
+
+def test_start_up_imports_only_the_standard_library():
+    code = (
+        "import sys, walk_data_cli; "
+        "print(sorted({'pandas', 'numpy', 'sqlite_utils', 'pyarrow'} "
+        "& set(sys.modules)))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "[]"
+
+
+def test_run(export_zip, tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    args = ["--data-dir", str(data_dir), "--quiet"]
+    assert main([*args, "run", str(export_zip), "--workers", "1"]) == 0
+    (db_file,) = data_dir.glob("healthkit_db_*.sqlite")
+    assert db_file.with_suffix(".parquet").is_dir()
+    summary_df = pd.read_csv(data_dir / "workouts_summary.csv")
+    # The walk and the hike
+    assert len(summary_df) == 2
+    # Converted with the derived tables, so nothing to migrate
+    modified = db_file.stat().st_mtime_ns
+    assert main([*args, "migrate"]) == 0
+    assert db_file.stat().st_mtime_ns == modified
+    # export.zip was renamed, so nothing more to do
+    assert not export_zip.exists()
+    assert main([*args, "run", str(export_zip)]) == NOTHING_TO_DO_STATUS
+
+
+def test_failed_stage(tmp_path, capsys):
+    assert main(["--data-dir", str(tmp_path), "summarise"]) == 1
+    err = capsys.readouterr().err
+    assert "summarise failed: No database in" in err
+    assert "Traceback" not in err
+    assert main(["--data-dir", str(tmp_path), "--verbose", "summarise"]) == 1
+    err = capsys.readouterr().err
+    assert "Traceback" in err and "FileNotFoundError" in err
@@ -0,0 +1,208 @@
+import re
+import sqlite3
+import zipfile
+
+import pytest
+
+from helper_jobs import (
+    CANCELLED,
+    DONE,
+    gpx_import_job_key,
+    insert_job,
+    open_job_store,
+    read_job,
+    request_cancel,
+    requeue_job,
+    run_job,
+)
+from walk_data_aux import create_df_from_sql_query_in_file
+from walk_data_gpx_import import import_gpx_files
+
+GPX = """<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1">
+ <trk><trkseg>
+  <trkpt lat="-33.8000" lon="151.2000"><ele>10</ele><time>{0}</time></trkpt>
+  <trkpt lat="-33.8005" lon="151.2000"><ele>11</ele><time>{1}</time></trkpt>
+  <trkpt lat="-33.8010" lon="151.2000"><ele>12</ele><time>{2}</time></trkpt>
+ </trkseg></trk>
+</gpx>
+"""
+
+
+def day_gpx(day):
+    return GPX.format(*(f"2019-06-{day}T05:0{i}:42Z" for i in range(3)))
+
+
+@pytest.fixture
+def gpx_dir(tmp_path):
+    gpx_dir = tmp_path / "gpx"
+    (gpx_dir / "2019").mkdir(parents=True)
+    (gpx_dir / "2019" / "walk_1.gpx").write_text(day_gpx(11))
+    (gpx_dir / "2019" / "walk_2.gpx").write_text(day_gpx(12))
+    # The same walk again
+    (gpx_dir / "2019" / "walk_3.gpx").write_text(day_gpx(12))
+    (gpx_dir / "broken.gpx").write_text("<gpx><trk>")
+    (gpx_dir / "untimed.gpx").write_text(re.sub(r"<time>\{\d\}</time>", "", GPX))
+    (gpx_dir / "notes.txt").write_text(day_gpx(13))
+    return gpx_dir
+
+
+def test_import_gpx_files(gpx_dir, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    stats = import_gpx_files(gpx_dir, db_file, workers=1)
+    assert (stats.routes, stats.workouts, stats.workouts_skipped) == (5, 2, 1)
+    assert stats.points == 6
+    assert [name.rsplit("/", 1)[1] for name, _ in stats.files_failed] == [
+        "broken.gpx",
+        "untimed.gpx",
+    ]
+    conn = sqlite3.connect(db_file)
+    assert conn.execute(
+        "SELECT startDate, endDate, metadata_gpx_file, workoutActivityType "
+        "FROM workouts ORDER BY startDate"
+    ).fetchall() == [
+        (
+            "2019-06-11 15:00:42 +1000",
+            "2019-06-11 15:02:42 +1000",
+            "walk_1.gpx",
+            "HKWorkoutActivityTypeWalking",
+        ),
+        (
+            "2019-06-12 15:00:42 +1000",
+            "2019-06-12 15:02:42 +1000",
+            "walk_2.gpx",
+            "HKWorkoutActivityTypeWalking",
+        ),
+    ]
+    assert float(conn.execute("SELECT totalDistance FROM workouts").fetchone()[0]) == (
+        pytest.approx(0.1112, abs=1e-4)
+    )
+    # Built as after an ingest
+    for table in ["workout_points_simplified", "workout_stats", "workout_spatial_keys"]:
+        assert conn.execute(
+            f"SELECT COUNT(DISTINCT workout_id) FROM {table}"
+        ).fetchone() == (2,)
+    # Importing the same files again skips them all
+    stats = import_gpx_files(gpx_dir, db_file, workers=1)
+    assert (stats.workouts, stats.workouts_skipped) == (0, 3)
+
+
+def test_import_gpx_zip(gpx_dir, tmp_path):
+    gpx_zip = tmp_path / "gpx.zip"
+    with zipfile.ZipFile(gpx_zip, "w") as zip_ref:
+        for path in sorted(gpx_dir.rglob("*")):
+            if path.is_file():
+                zip_ref.write(path, path.relative_to(gpx_dir).as_posix())
+    db_files = [tmp_path / "healthkit_db_zip.sqlite", tmp_path / "healthkit_db.sqlite"]
+    stats = import_gpx_files(gpx_zip, db_files[0], workers=2)
+    assert (stats.routes, stats.workouts, len(stats.files_failed)) == (5, 2, 2)
+    import_gpx_files(gpx_dir, db_files[1], workers=1)
+    workouts, points = (
+        [
+            sqlite3.connect(db_file)
+            .execute(f"SELECT * FROM {table} ORDER BY 1, 2")
+            .fetchall()
+            for db_file in db_files
+        ]
+        for table in ["workouts", "workout_points"]
+    )
+    assert workouts[0] == workouts[1]
+    assert points[0] == points[1]
+
+
+@pytest.mark.parametrize(
+    "times",
+    [
+        ["2019-06-11T05:00:42Z", "2019-06-11T05:01:42Z", "2019-06-11T05:02:42Z"],
+        [
+            "2019-06-11T15:00:42+10:00",
+            "2019-06-11T15:01:42+10:00",
+            "2019-06-11T15:02:42+10:00",
+        ],
+    ],
+)
+def test_import_gpx_times(tmp_path, times):
+    gpx_dir = tmp_path / "gpx"
+    gpx_dir.mkdir()
+    (gpx_dir / "walk.gpx").write_text(GPX.format(*times))
+    db_file = tmp_path / "healthkit_db.sqlite"
+    stats = import_gpx_files(gpx_dir, db_file, workers=1)
+    assert stats.files_failed == []
+    assert stats.workouts == 1
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT startDate, endDate FROM workouts").fetchone() == (
+        "2019-06-11 15:00:42 +1000",
+        "2019-06-11 15:02:42 +1000",
+    )
+    assert conn.execute("SELECT elapsed_time_hours FROM workout_stats").fetchone() == (
+        pytest.approx(2 / 60),
+    )
+
+
+def test_untimed_point_not_the_start(tmp_path):
+    gpx_dir = tmp_path / "gpx"
+    gpx_dir.mkdir()
+    (gpx_dir / "walk.gpx").write_text(
+        GPX.replace("<time>{0}</time>", "").format(
+            None, "2019-06-11T05:01:42Z", "2019-06-11T05:02:42Z"
+        )
+    )
+    db_file = tmp_path / "healthkit_db.sqlite"
+    import_gpx_files(gpx_dir, db_file, workers=1)
+    conn = sqlite3.connect(db_file)
+    # NULL, as for the points embedded in export.xml, rather than ""
+    assert conn.execute("SELECT date FROM workout_points ORDER BY rowid").fetchall() == [
+        (None,),
+        ("2019-06-11T05:01:42Z",),
+        ("2019-06-11T05:02:42Z",),
+    ]
+    endpoints_df = create_df_from_sql_query_in_file(
+        "select_start_finish_point_workout.sql", conn, None
+    )
+    assert endpoints_df[["start_datetime", "start_latitude"]].values.tolist() == [
+        ["2019-06-11T05:01:42Z", -33.8005]
+    ]
+
+
+def test_import_job_cancelled_and_resumed(gpx_dir, tmp_path, monkeypatch):
+    import walk_data_gpx_import
+
+    store_file = tmp_path / "jobs.sqlite"
+    db_file = tmp_path / "healthkit_db.sqlite"
+    job_conn = open_job_store(store_file)
+    job_id = insert_job(
+        job_conn,
+        "import",
+        gpx_import_job_key(db_file),
+        {"source": gpx_dir.as_posix(), "db_file": db_file.as_posix(), "workers": 1},
+    )
+    # Cancelled (as if from the page) once the first walk is read, at the progress
+    # update following it
+    gpx_workout_record = walk_data_gpx_import.gpx_workout_record
+
+    def cancel_after_first(*args):
+        request_cancel(job_conn, job_id)
+        return gpx_workout_record(*args)
+
+    monkeypatch.setattr(walk_data_gpx_import, "PROGRESS_INTERVAL_SECONDS", -1)
+    monkeypatch.setattr(walk_data_gpx_import, "gpx_workout_record", cancel_after_first)
+    run_job(store_file, job_id)
+    assert read_job(job_conn, job_id).status == CANCELLED
+    conn = sqlite3.connect(db_file)
+    # The walk read was written whole, but its derived tables weren't built
+    assert conn.execute("SELECT COUNT(*) FROM workout_points").fetchone() == (3,)
+    assert conn.execute(
+        "SELECT name FROM sqlite_master WHERE name = 'workout_stats'"
+    ).fetchone() is None
+
+    monkeypatch.setattr(walk_data_gpx_import, "gpx_workout_record", gpx_workout_record)
+    requeue_job(job_conn, job_id)
+    run_job(store_file, job_id)
+    job = read_job(job_conn, job_id)
+    assert job.status == DONE
+    assert (job.state["workouts"], job.state["workouts_skipped"]) == (1, 2)
+    assert len(job.state["files_failed"]) == 2
+    for table in ["workout_points_simplified", "workout_stats", "workout_spatial_keys"]:
+        assert conn.execute(
+            f"SELECT COUNT(DISTINCT workout_id) FROM {table}"
+        ).fetchone() == (2,)
@@ -0,0 +1,221 @@
+import io
+import sqlite3
+import zipfile
+from xml.etree import ElementTree
+
+import pytest
+
+from healthkit_to_sqlite.utils import convert_xml_to_sqlite
+from sqlite_utils import Database
+
+from conftest import EXPORT_WORKOUTS, write_export_zip
+from helper_activity_types import WALKING_ACTIVITY_TYPES
+from synthetic_export import write_export_zip as write_synthetic_export_zip
+from walk_data_ingest import (
+    RepairedXmlReader,
+    create_workout_points_indexes,
+    ingest_healthkit_export,
+    iter_top_level_elements,
+)
+
+
+def table_rows(db_file, table, order_by):
+    conn = sqlite3.connect(db_file)
+    rows = conn.execute(f"SELECT * FROM [{table}] ORDER BY {order_by}").fetchall()
+    conn.close()
+    return rows
+
+
+def test_ingest_matches_healthkit_to_sqlite(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    stats = ingest_healthkit_export(export_zip, db_file)
+    assert (stats.workouts, stats.points, stats.records) == (3, 38, 3)
+
+    expected_db_file = tmp_path / "healthkit_to_sqlite.sqlite"
+    with zipfile.ZipFile(export_zip) as zip_ref:
+        with zip_ref.open("apple_health_export/export.xml") as xml_fp:
+            convert_xml_to_sqlite(xml_fp, Database(expected_db_file), zipfile=zip_ref)
+    for table, order_by in [
+        ("workouts", "id"),
+        ("workout_points", "workout_id, date"),
+        ("rStepCount", "startDate"),
+        ("rHeartRate", "startDate"),
+        ("activity_summary", "dateComponents"),
+    ]:
+        assert table_rows(db_file, table, order_by) == table_rows(
+            expected_db_file, table, order_by
+        )
+
+
+def test_ingest_progress(export_zip, tmp_path):
+    progress = []
+    ingest_healthkit_export(
+        export_zip, tmp_path / "healthkit_db.sqlite", progress_callback=progress.append
+    )
+    assert progress[-1].bytes_read == progress[-1].bytes_total
+    assert progress[-1].fraction_done == 1.0
+
+
+def test_ingest_walking_only(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    stats = ingest_healthkit_export(
+        export_zip, db_file, activity_types=WALKING_ACTIVITY_TYPES
+    )
+    assert (stats.workouts, stats.points, stats.records) == (2, 32, 0)
+    db = Database(db_file)
+    assert not {"rStepCount", "rHeartRate", "activity_summary"} & set(db.table_names())
+    activity_types = db.execute("SELECT DISTINCT workoutActivityType FROM workouts")
+    assert {row[0] for row in activity_types} == set(WALKING_ACTIVITY_TYPES)
+
+    # Adding a type only ingests its workouts
+    stats = ingest_healthkit_export(
+        export_zip,
+        db_file,
+        activity_types=[*WALKING_ACTIVITY_TYPES, "HKWorkoutActivityTypeCycling"],
+    )
+    assert (stats.workouts, stats.workouts_skipped, stats.points) == (1, 2, 6)
+    assert db.execute("SELECT COUNT(*) FROM workout_points").fetchone() == (38,)
+
+
+def test_ingest_incremental(tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    previous_zip = write_export_zip(tmp_path / "previous.zip", EXPORT_WORKOUTS[:2])
+    ingest_healthkit_export(previous_zip, db_file)
+    # Workout ids aren't the same from one export to the next
+    with sqlite3.connect(db_file) as conn:
+        conn.execute("UPDATE workouts SET id = 'previous ' || id")
+    export_zip = write_export_zip(tmp_path / "export.zip")
+    stats = ingest_healthkit_export(export_zip, db_file, incremental=True)
+    # Only the new workout (and its points), and no Records again
+    assert (stats.workouts, stats.workouts_skipped) == (1, 2)
+    assert (stats.points, stats.records) == (21, 0)
+    db = Database(db_file)
+    assert db["workouts"].count == 3
+    assert db["workout_points"].count == 38
+    assert db["rStepCount"].count == 2
+
+
+def test_ingest_routes_in_parallel(export_zip, tmp_path):
+    # Points are written in export order whatever the number of workers
+    for workers in (1, 2):
+        ingest_healthkit_export(
+            export_zip, tmp_path / f"healthkit_db_{workers}.sqlite", workers=workers
+        )
+    serial, parallel = (
+        table_rows(db_file, "workout_points", "rowid")
+        for db_file in sorted(tmp_path.glob("healthkit_db_*.sqlite"))
+    )
+    assert serial == parallel
+
+
+def test_covering_index_replaces_narrow_index(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    ingest_healthkit_export(export_zip, db_file)
+    db = Database(db_file)
+    # As created by an earlier version
+    db.execute("DROP INDEX idx_workout_points_workout_id_date_lat_lon")
+    db["workout_points"].create_index(
+        ["workout_id", "date"], index_name="idx_workout_points_workout_id_date"
+    )
+    create_workout_points_indexes(db)
+    assert [index.name for index in db["workout_points"].indexes] == [
+        "idx_workout_points_workout_id_date_lat_lon"
+    ]
+
+
+# export.xml with the iOS defects: a malformed DTD in the DOCTYPE, and a second startDate
+# attribute which should be endDate
+DEFECTIVE_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE HealthData [
+<!ELEMENT HealthData (ExportDate,Me,(Record|Workout)*)>
+<!ATTLIST Record
+  type CDATA #REQUIRED
+  startDate CDATA #REQUIRED
+  endDate CDATA #REQUIRED
+  value CDATA #IMPLIED
+  HKMetadataKey CDATA #IMPLIED>
+<!ELEMENT broken (>
+]>
+<HealthData locale="en_AU">
+ <ExportDate value="2023-03-10 09:00:00 +1100"/>
+ <Record type="HKQuantityTypeIdentifierStepCount" startDate="2023-03-10 08:00:00 +1100" startDate="2023-03-10 08:01:00 +1100" value="12"/>
+ <Record type="HKQuantityTypeIdentifierStepCount" startDate="2023-03-10 08:02:00 +1100" endDate="2023-03-10 08:03:00 +1100" value="34"/>
+ <Record type="HKQuantityTypeIdentifierHeartRate" startDate="2023-03-10 08:04:00 +1100" startDate="2023-03-10 08:05:00 +1100" value="61"/>
+</HealthData>
+"""
+
+# The DOCTYPE replaced by its newlines (so the line numbers are unchanged)
+DOCTYPE = DEFECTIVE_XML[
+    DEFECTIVE_XML.index(b"<!DOCTYPE") : DEFECTIVE_XML.index(b"]>") + 2
+]
+REPAIRED_XML = DEFECTIVE_XML.replace(DOCTYPE, b"\n" * DOCTYPE.count(b"\n")).replace(
+    b'+1100" startDate=', b'+1100" endDate='
+)
+
+
+def read_all(reader, size):
+    chunks = []
+    while chunk := reader.read(size):
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+@pytest.mark.parametrize("chunk_bytes", [1, 2, 7, 16, 64, 333, 4096])
+@pytest.mark.parametrize("read_size", [-1, 1, 100])
+def test_repaired_xml_reader_chunk_boundaries(chunk_bytes, read_size):
+    reader = RepairedXmlReader(io.BytesIO(DEFECTIVE_XML), chunk_bytes=chunk_bytes)
+    assert read_all(reader, read_size) == REPAIRED_XML
+
+
+def test_repaired_xml_reader_keeps_line_numbers():
+    repaired = read_all(RepairedXmlReader(io.BytesIO(DEFECTIVE_XML), chunk_bytes=5), -1)
+    assert repaired.count(b"\n") == DEFECTIVE_XML.count(b"\n")
+
+
+def test_repaired_xml_reader_parses():
+    reader = RepairedXmlReader(io.BytesIO(DEFECTIVE_XML), chunk_bytes=16)
+    records = [el.attrib for _, el in iter_top_level_elements(reader, {"Record"})]
+    assert [record["endDate"] for record in records] == [
+        "2023-03-10 08:01:00 +1100",
+        "2023-03-10 08:03:00 +1100",
+        "2023-03-10 08:05:00 +1100",
+    ]
+
+
+def test_repaired_xml_reader_no_doctype():
+    xml = DEFECTIVE_XML[DEFECTIVE_XML.index(b"<HealthData") :]
+    repaired = read_all(RepairedXmlReader(io.BytesIO(xml), chunk_bytes=3), 10)
+    assert repaired == xml.replace(b'+1100" startDate=', b'+1100" endDate=')
+
+
+def test_repaired_xml_reader_only_renames_attributes():
+    # A second "startDate" which isn't an attribute (e.g. in a value) is left alone
+    xml = b'<HealthData>\n <Record startDate="1" value="startDate=2"/>\n</HealthData>\n'
+    assert read_all(RepairedXmlReader(io.BytesIO(xml), chunk_bytes=4), -1) == xml
+
+
+def test_ingest_repairs_ios_defects(tmp_path):
+    export_zip = tmp_path / "export.zip"
+    write_synthetic_export_zip(
+        export_zip, n_workouts=2, points_per_workout=10, n_records=100, ios_defects=True
+    )
+    db_file = tmp_path / "healthkit_db.sqlite"
+    with pytest.raises(ElementTree.ParseError):
+        ingest_healthkit_export(export_zip, db_file, repair_xml=False)
+    db_file.unlink()
+    stats = ingest_healthkit_export(export_zip, db_file)
+    assert (stats.workouts, stats.points, stats.records) == (2, 20, 100)
+
+
+def test_ingest_embedded_locations(embedded_export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    stats = ingest_healthkit_export(embedded_export_zip, db_file, workers=1)
+    assert stats.workouts == 1
+    assert stats.points == 4
+    conn = sqlite3.connect(db_file)
+    n_points, distance_km, elapsed_time_hours = conn.execute(
+        "SELECT n_points, distance_km, elapsed_time_hours FROM workout_stats"
+    ).fetchone()
+    assert n_points == 3
+    assert distance_km == pytest.approx(0.111, abs=1e-3)
+    assert elapsed_time_hours == pytest.approx(2 / 60)
@@ -0,0 +1,131 @@
+import json
+
+import numpy as np
+import pytest
+from sqlite_utils import Database
+
+from walk_data_ingest import ingest_healthkit_export
+from walk_data_stats import (
+    build_workout_stats,
+    haversine_metres,
+    point_seconds,
+    track_stats,
+)
+
+# 2019-06-11 05:00:42 UTC
+SECONDS = 1560229242
+
+# 0.001 degrees of latitude
+STEP_METRES = 111.195
+
+
+def straight_track(n_points, step_seconds=60.0):
+    seconds = SECONDS + step_seconds * np.arange(n_points)
+    latitudes = -33.8 - 0.001 * np.arange(n_points)
+    longitudes = np.full(n_points, 151.2)
+    altitudes = 10.0 + np.arange(n_points, dtype=np.float64)
+    return seconds, latitudes, longitudes, altitudes
+
+
+def test_haversine_metres():
+    assert haversine_metres(-33.8, 151.2, -33.801, 151.2) == pytest.approx(
+        STEP_METRES, abs=0.01
+    )
+    # Sydney to Melbourne
+    assert haversine_metres(-33.8688, 151.2093, -37.8136, 144.9631) == pytest.approx(
+        713_800, rel=1e-3
+    )
+
+
+def test_track_stats_moving():
+    stats = track_stats(*straight_track(21))
+    assert stats["n_points"] == 21
+    assert stats["distance_km"] == pytest.approx(20 * STEP_METRES / 1000, abs=1e-5)
+    assert stats["elapsed_time_hours"] == pytest.approx(20 / 60)
+    assert stats["moving_time_hours"] == pytest.approx(20 / 60)
+    assert stats["stopped_time_hours"] == pytest.approx(0)
+    # The smoothed altitude climbs a metre a point
+    assert (stats["ascent_m"], stats["descent_m"]) == pytest.approx((16, 0))
+    assert stats["average_pace_min_per_km"] == pytest.approx(
+        20 / (20 * STEP_METRES / 1000)
+    )
+    # Two whole km, each taking 1000 / STEP_METRES minutes
+    splits = json.loads(stats["split_seconds_per_km"])
+    assert splits == pytest.approx([60 * 1000 / STEP_METRES] * 2, abs=0.1)
+
+
+def test_track_stats_stopped():
+    seconds, latitudes, longitudes, altitudes = straight_track(11)
+    # Standing still for the last 5 minutes, then a 10 minute gap in the recording
+    latitudes[6:] = latitudes[5]
+    seconds[10] += 600
+    stats = track_stats(seconds, latitudes, longitudes, altitudes)
+    assert stats["distance_km"] == pytest.approx(5 * STEP_METRES / 1000, abs=1e-5)
+    assert stats["elapsed_time_hours"] == pytest.approx(20 / 60)
+    assert stats["moving_time_hours"] == pytest.approx(5 / 60)
+    assert stats["stopped_time_hours"] == pytest.approx(15 / 60)
+    assert stats["moving_pace_min_per_km"] == pytest.approx(1000 / STEP_METRES)
+
+
+def test_track_stats_single_point():
+    stats = track_stats(*straight_track(1))
+    assert (stats["n_points"], stats["distance_km"]) == (1, 0)
+    assert stats["average_pace_min_per_km"] is None
+    assert stats["split_seconds_per_km"] == "[]"
+
+
+def test_build_workout_stats(export_zip, tmp_path):
+    db_file = tmp_path / "healthkit_db.sqlite"
+    ingest_healthkit_export(export_zip, db_file)
+    db = Database(db_file)
+    rows = db.execute(
+        "SELECT n_points, distance_km, elapsed_time_hours FROM workout_stats "
+        "ORDER BY n_points"
+    ).fetchall()
+    assert [row[0] for row in rows] == [6, 11, 21]
+    for n_points, distance_km, elapsed_time_hours in rows:
+        n_segments = n_points - 1
+        assert distance_km == pytest.approx(n_segments * STEP_METRES / 1000, abs=1e-5)
+        assert elapsed_time_hours == pytest.approx(n_segments / 60)
+    # Everything is done, unless asked for again
+    assert build_workout_stats(db) == 0
+    workout_ids = [row[0] for row in db.execute("SELECT id FROM workouts")]
+    assert build_workout_stats(db, workout_ids, chunk_workouts=2) == 3
+
+
+@pytest.mark.parametrize(
+    "date",
+    [
+        "2019-06-11T05:00:42Z",  # route GPX files
+        "2019-06-11 15:00:42 +1000",  # embedded in older exports
+        "2019-06-11T15:00:42+10:00",  # other GPX files
+    ],
+)
+def test_point_seconds_formats(date):
+    assert point_seconds([date]).tolist() == [SECONDS]
+
+
+def test_point_seconds_fractional():
+    assert point_seconds(["2019-06-11T05:00:42.5Z"]).tolist() == [SECONDS + 0.5]
+
+
+def test_point_seconds_missing_dates():
+    seconds = point_seconds(["2019-06-11 15:00:42 +1000", "", None])
+    assert seconds[0] == SECONDS
+    assert np.isnan(seconds[1:]).all()
+
+
+def test_track_stats_ignores_points_without_dates():
+    seconds = np.array([np.nan, SECONDS, SECONDS + 60.0])
+    latitudes = np.array([0.0, -33.8, -33.801])
+    longitudes = np.array([0.0, 151.0, 151.0])
+    stats = track_stats(seconds, latitudes, longitudes, np.full(3, np.nan))
+    assert stats["n_points"] == 2
+    assert stats["elapsed_time_hours"] == pytest.approx(1 / 60)
+    assert stats["distance_km"] == pytest.approx(0.111, abs=1e-3)
+
+
+def test_track_stats_no_dates():
+    stats = track_stats(np.full(2, np.nan), np.ones(2), np.ones(2), np.ones(2))
+    assert stats["n_points"] == 0
+    assert stats["elapsed_time_hours"] == 0